@@ -9,17 +9,30 @@
     See "run-client.py" for more information on how to connect to the
     server. 
 
+    Use the `--history-dir` flag to keep each buffer's history in a log
+    file in that directory, so the session survives a restart.
+
 """
 from src.network import PolyServer
 from getpass import getpass
 
+import argparse
+
+parser = argparse.ArgumentParser(
+    prog="Polyglot Server",
+    description="Server for collaborative Live Coding")
+
+parser.add_argument('-d', '--history-dir', action='store', help="Directory to save buffer history in (default: history is kept in memory only)")
+
+args = parser.parse_args()
+
 try:
 
-    myServer = PolyServer(password=getpass("Password (leave blank for no password): "))
+    myServer = PolyServer(password=getpass("Password (leave blank for no password): "), history_dir=args.history_dir)
     myServer.start()
 
 # Exit cleanly on Ctrl + c
 
 except KeyboardInterrupt:
 
-    pass
\ No newline at end of file
+    pass
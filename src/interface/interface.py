@@ -291,9 +291,18 @@ class Interface(BasicInterface):
     def handle_set_all(self, message):
         ''' Sets the contents of the text box and updates the location of peer markers '''
         
+        # Servers that number our operations from their own history transform them without
+        # reordering inserts, so we must do the same
+
+        canonical = not self.client.send.capabilities & CAP_REVISIONS
+
         for buf_id, documents in message["buffers"].items():
+
+            text = self.buffers[int(buf_id)].text
+
+            text.canonical = canonical
         
-            self.buffers[int(buf_id)].text.handle_set_all(*documents)
+            text.handle_set_all(*read_snapshot(documents))
         
         for peer_id, location in message["peers"].items():
 
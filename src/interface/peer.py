@@ -40,14 +40,19 @@ class Highlight:
             self.hide()
         return
 
-    def shift(self, loc, amount):
+    def get_indices(self):
+        """ Returns a list of the anchor, start and end indices """
+        return [self.anchor, self.start, self.end]
+
+    def set_indices(self, anchor, start, end):
+        """ Updates the indices after moving them through an operation and hides
+            the highlight if all of its text has been deleted """
         if self.active:
-            if loc < self.start:
-                self.anchor += amount
-                self.start  += amount
-                self.end    += amount
-            elif loc < self.end:
-                self.end += amount
+            self.anchor = anchor
+            self.start  = start
+            self.end    = end
+            if self.start == self.end:
+                self.hide()
         return
 
     def is_active(self):
@@ -77,23 +82,6 @@ class Highlight:
         self.deactivate()
         return
 
-    def remove(self, start, end):
-        """ Removes a portion of the highlight """
-        if self.active:
-            start, end = sorted((start, end))
-            size = end - start
-            # If the area falls outside of this highlight, do nothing
-            if start > self.end or end < self.start:
-                return
-            elif start < self.start and end < self.end:
-                self.end   = self.end + (end - self.start) - size
-                self.start = start
-            elif start > self.start and end > self.end:
-                self.end = start
-            elif start > self.start and end < self.end:
-                self.end = self.end - size
-        return
-
     def clear(self):
         """ Clears the selection from all text widgets """
         for buf in self.peer.root.buffers.values():
@@ -234,12 +222,13 @@ class Peer:
         """ Updates the peer's location relative to its current location by calling `move` """        
         return self.move(self.buf_id, self.index_num + amount, *args, **kwargs)
 
-    def select_shift(self, loc, amount):
-        return self.hl_select.shift(loc, amount)
+    def get_select_indices(self):
+        """ Returns the anchor, start and end index of the selection """
+        return self.hl_select.get_indices()
 
-    def select_remove(self, start, end):
-        """ Removes an area from the select highlight """
-        return self.hl_select.remove(start, end)
+    def set_select_indices(self, anchor, start, end):
+        """ Moves the selection after an operation has been applied """
+        return self.hl_select.set_indices(anchor, start, end)
 
     def find_overlapping_peers(self):
         """ Returns True if this peer overlaps another peer's label """
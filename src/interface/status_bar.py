@@ -57,7 +57,7 @@ class StatusBar(Tk.Frame):
 
             for i, buf in self.root.buffers.items():
 
-                count += buf.text.peer_tag_doc.count(peer.char)
+                count += buf.text.peer_tag_doc.count(p_id)
 
             counts[p_id] = count
 
@@ -6,10 +6,12 @@ from ..interpreter import *
 
 from ..ot.client import Client as OTClient
 from ..ot.text_operation import TextOperation, IncompatibleOperationError
+from ..ot.attribution import Attribution
 
 from .peer import *
 from .constraints import TextConstraint
 from .colour_merge import ColourMerge
+from .undo import UndoStack
 
 from .tkimport import Tk
 
@@ -34,9 +36,9 @@ class ThreadSafeText(Tk.Text, OTClient):
         self.constraint = TextConstraint(self)
 
         self.config(undo=True, autoseparators=True, maxundo=50)
-        self.undo_stack = []
-        self.redo_stack = []
         self.max_undo_size = 50
+        self.undo_stack = UndoStack(self.max_undo_size)
+        self.redo_stack = UndoStack(self.max_undo_size)
 
         # If we are blending font colours
 
@@ -68,10 +70,10 @@ class ThreadSafeText(Tk.Text, OTClient):
 
             self.tag_config(tag_name, **kwargs)
 
-        # Create 2 docs - one with chars, one with peer ids
+        # Create the doc of chars and a run-length index of peer ids
 
         self.document = ""
-        self.peer_tag_doc = ""
+        self.peer_tag_doc = Attribution()
 
 
     def __str__(self):
@@ -171,8 +173,7 @@ class ThreadSafeText(Tk.Text, OTClient):
 
     def insert_peer_id(self, peer, ops):
         """ Applies a text operation to the `peer_tag_doc` which contains information about which character relates to which peers """
-        operation = TextOperation(self.get_peer_loc_ops(peer, ops))
-        self.peer_tag_doc = operation(self.peer_tag_doc)
+        self.peer_tag_doc.apply(ops, peer.id)
         return
 
     def get_state(self):
@@ -187,29 +188,29 @@ class ThreadSafeText(Tk.Text, OTClient):
         """ Transforms two TextOperations and adjusts the first for the length of the document"""
         try:
             size = max(get_doc_size(op1.ops), len(self.read()))
-            new_op1 = TextOperation(new_operation(*(list(op1.ops) + [size])))
-            new_op2 = TextOperation(new_operation(*(list(op2.ops) + [size])))
+            new_op1 = TextOperation(new_operation(*(list(op1.ops) + [size])), copy=False)
+            new_op2 = TextOperation(new_operation(*(list(op2.ops) + [size])), copy=False)
             return TextOperation.transform(new_op1, new_op2)
         except Exception as e:
             print("Error transforming {} and {}".format(new_op1, new_op2))
             raise e
 
     def transform_undo_stacks(self, operation):
-        """ Transforms operations in the undo_stack so their locations are adjusted after other
-            operations are applied to the text """
-        if len(self.undo_stack):
-            self.undo_stack = [self.transform(action, operation)[0] for action in self.undo_stack if len(action.ops)]
+        """ Logs an operation from another peer so that undo and redo operations are
+            transformed against it when they are used """
+        self.undo_stack.add_remote(operation)
+        self.redo_stack.add_remote(operation)
         return
 
     def add_to_undo_stacks(self, operation, document, undo=False, redo=False):
         """ Adds the inverse of an operation to the undo stack """
         # Keep track of operations for use in undo
         if not undo:
-            self.undo_stack = self.undo_stack[-self.max_undo_size:] + [operation.invert(document)]
+            self.undo_stack.push(operation.invert(document))
             if not redo:
-                self.redo_stack = []
+                self.redo_stack.clear()
         else:
-            self.redo_stack.append(operation.invert(document))
+            self.redo_stack.push(operation.invert(document))
         return
 
     def get_undo_operation(self):
@@ -253,11 +254,11 @@ class ThreadSafeText(Tk.Text, OTClient):
 
                 self.apply_server(operation)
 
-                if get_operation_size(message["operation"]) != 0:
+                # Move the other peers' markers and selections through the operation
 
-                    # If the operation is delete/insert, change the indexes of peers that are based after this one
+                self.adjust_peer_locations(self.active_peer, operation)
 
-                    self.adjust_peer_locations(self.active_peer, message["operation"])
+                if get_operation_size(message["operation"]) != 0:
 
                     # Move the peer marker
 
@@ -308,13 +309,21 @@ class ThreadSafeText(Tk.Text, OTClient):
 
         return
 
-    def handle_set_all(self, document, peer_tag_doc):
-        ''' Sets the contents of the text box and updates the location of peer markers '''
+    def handle_set_all(self, document, peer_runs, revision=0, operations=()):
+        ''' Sets the contents of the text box from a snapshot: the document at `revision`
+            and the [user_id, ops] operations made since then '''
 
         self.reset() # inherited from OTClient
 
         self.document = document
-        self.peer_tag_doc = peer_tag_doc
+        self.peer_tag_doc = Attribution(peer_runs)
+
+        for src_id, ops in operations:
+
+            self.document = TextOperation(ops, copy=False)(self.document)
+            self.peer_tag_doc.apply(ops, src_id)
+
+        self.revision = revision + len(operations)
 
         self.refresh()
 
@@ -373,76 +382,48 @@ class ThreadSafeText(Tk.Text, OTClient):
     # =====================================
 
     def adjust_peer_locations(self, peer, operation):
-        """ When a peer performs an operation, adjust the location of peers following it and update
-            the location of peer tags """
+        """ When a peer performs an operation, move the markers and selections of the other
+            peers in this buffer through it and update the location of peer tags """
 
-        shift = get_operation_size(operation)
-        index = get_operation_index(operation)
+        if not isinstance(operation, TextOperation):
 
-        peer_index = index - shift
+            operation = TextOperation(operation, copy=False)
 
-        # Un-comment to debug
+        others = [other for other in self.root.peers.values() if other != peer and other.in_same_buffer(peer)]
 
-        # if peer.get_index_num() != peer_index:
+        # Move every marker and selection index in one pass over the operation
 
-        #     print("{} index: {}, Op index: {}, shift: {} === {} ".format(str(peer), peer.get_index_num(), index, shift, peer_index))
+        indices = []
 
-        doc_size = len(self.read())
+        for other in others:
 
-        for other in self.root.peers.values():
+            indices.append(other.get_index_num())
+            indices.extend(other.get_select_indices())
 
-            if other != peer and other.in_same_buffer(peer):
+        indices = operation.transform_indices(indices)
 
-                other_index = other.get_index_num()
+        for i, other in enumerate(others):
 
-                # Moving whole selections
+            index, anchor, start, end = indices[i * 4:(i + 1) * 4]
 
-                if other.has_selection():
+            if other.has_selection():
 
-                    # If the selections overlap, de-highlight the deleted section
+                other.set_select_indices(anchor, start, end)
 
-                    if peer.has_selection():
+            if index != other.get_index_num():
 
-                        other.select_remove(peer.select_start(), peer.select_end())
+                other.move(self.parent.id, index)
 
-                    # Shift a selected area
-
-                    other.select_shift(peer_index, shift)
-
-                # If the other peer is *in* this peer's selection, move it
-
-                if peer.has_selection() and peer.select_contains( other_index ):
-        
-                    other.move(self.parent.id, peer.select_start())
+            # If it hasn't moved, just redraw (if on screen)
 
-                # Adjust the index if it comes after the operating peer index
-
-                elif other_index > peer_index:
-
-                    other.shift(shift)
-
-                # If behind, just redraw (if on screen)
-
-                else:
+            else:
 
-                    other.refresh()
+                other.refresh()
 
         self.update_colours()
 
         return
 
-    def create_peer_tag_doc(self, locations):
-        """ Re-creates the document of peer_id markers """
-        s = []
-        for peer_id, length in locations:
-            s.append("{}".format(get_peer_char(peer_id)) * int(length))
-        return "".join(s)
-
-    def get_peer_loc_ops(self, peer, ops):
-        """ Converts a list of operations on the main document to inserting the peer ID """
-        # return [str(peer.id) * len(val) if isinstance(val, str) else val for val in ops]
-        return [peer.char * len(val) if isinstance(val, str) else val for val in ops]
-
     def update_colours(self):
         """ Sets the peer tags in the text document """
 
@@ -452,7 +433,7 @@ class ThreadSafeText(Tk.Text, OTClient):
 
         for p_id, peer in self.root.peers.items():
 
-            processed.append(peer.char)
+            processed.append(p_id)
 
             self.update_peer_tag(p_id)
 
@@ -460,11 +441,11 @@ class ThreadSafeText(Tk.Text, OTClient):
 
         # If there are any other left over peers, keep their colours
 
-        for p_id in set(self.peer_tag_doc):
+        for p_id in self.peer_tag_doc.peers():
 
-            if str(p_id) not in processed:
+            if p_id not in processed:
 
-                self.update_peer_tag(get_peer_id_from_char(p_id))
+                self.update_peer_tag(p_id)
 
         return
 
@@ -485,7 +466,7 @@ class ThreadSafeText(Tk.Text, OTClient):
 
         self.tag_remove(text_tag, "1.0", Tk.END)
 
-        for start, end in get_peer_locs(get_peer_char(p_id), self.peer_tag_doc):
+        for start, end in self.peer_tag_doc.spans(int(p_id)):
 
             self.tag_add(text_tag, self.number_index_to_tcl(start), self.number_index_to_tcl(end))
 
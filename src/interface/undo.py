@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+
+from collections import deque
+from itertools import islice
+
+from ..utils import new_operation, get_doc_size
+from ..ot.text_operation import TextOperation
+
+class UndoStack(object):
+    """ A bounded stack of operations that undo (or redo) local edits.
+
+        Operations by other peers are added to a log with `add_remote` instead of
+        transforming every entry as they arrive. Each entry remembers how long the
+        log was when it was pushed and is only transformed against the operations
+        since then when it is popped. Log operations older than the oldest entry
+        are dropped.
+    """
+    def __init__(self, maxlen=50):
+        self.entries = deque(maxlen=maxlen) # (operation, number of remote operations before it)
+        self.remote  = deque()
+        self.offset  = 0 # number of remote operations dropped from the log
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, operation):
+        """ Adds an operation to the top of the stack """
+        self.entries.append((operation, self.offset + len(self.remote)))
+        self.trim()
+        return
+
+    def pop(self):
+        """ Removes the top operation and returns it transformed against the remote
+            operations added since it was pushed """
+        operation, epoch = self.entries.pop()
+        for remote in islice(self.remote, epoch - self.offset, None):
+            operation = transform(operation, remote)
+        self.trim()
+        return operation
+
+    def add_remote(self, operation):
+        """ Logs an operation from another peer that entries must be transformed against """
+        if len(self.entries):
+            self.remote.append(operation)
+        else:
+            self.offset += 1
+        return
+
+    def clear(self):
+        self.entries.clear()
+        self.trim()
+        return
+
+    def trim(self):
+        """ Drops remote operations that are older than every entry """
+        oldest = self.entries[0][1] if len(self.entries) else self.offset + len(self.remote)
+        while self.offset < oldest:
+            self.remote.popleft()
+            self.offset += 1
+        return
+
+def transform(operation, remote):
+    """ Transforms an undo operation against a remote operation, padding both to the
+        same document length first """
+    size = max(get_doc_size(operation.ops), get_doc_size(remote.ops))
+    operation = TextOperation(new_operation(*(list(operation.ops) + [size])), copy=False)
+    remote = TextOperation(new_operation(*(list(remote.ops) + [size])), copy=False)
+    return TextOperation.transform(operation, remote)[0]
@@ -1,4 +1,7 @@
 from __future__ import absolute_import
 
 from .server import *
-from .client import *
\ No newline at end of file
+from .headless import HeadlessClient
+
+# The Tk client, in .client, is imported by run-client.py. It isn't imported here
+# because it opens a window, so servers and headless clients don't need a display
@@ -0,0 +1,327 @@
+"""
+    Server/async_server.py
+    ----------------------
+
+    Runs a PolyServer with asyncio instead of a thread per client. All of the
+    clients and the message queue are handled by one event loop in a single
+    background thread, so a message is sent on as soon as it is read instead
+    of waiting for the queue to be polled. Used by `PolyServer(engine="asyncio")`
+    and needs Python 3.
+
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+
+from collections import OrderedDict
+from threading import Thread, Event
+
+from .server import RequestHandler, Client
+from .message import ConnectionError
+from .workers import BufferWorker, Dispatcher, get_worker_id
+from ..config import stdout
+
+
+class StreamSocket(object):
+    """ Wraps an asyncio StreamWriter with the socket methods used by RequestHandler
+        and Client. Writes are buffered by the event loop so they never block """
+    def __init__(self, writer):
+        self.writer = writer
+
+    def send(self, data):
+        self.writer.write(data)
+        return len(data)
+
+    def sendall(self, data):
+        self.writer.write(data)
+        return
+
+    def close(self):
+        self.writer.close()
+        return
+
+    def shutdown(self, how=None):
+        self.writer.transport.abort()
+        return
+
+
+class AsyncClient(Client):
+    """ Client whose outbox is written to its stream by a task in the event loop """
+    def start_sender(self):
+        self.ready = asyncio.Event()
+        self.outbox.notify = self.ready.set
+        self.sender = asyncio.ensure_future(self.send_loop())
+        return
+
+    async def send_loop(self):
+        """ Writes messages from the outbox to the stream, waiting for each write to
+            be drained so that the backlog builds up in the outbox """
+        writer = self.source.writer
+        while not (self.outbox.closed and len(self.outbox) == 0):
+            await self.ready.wait()
+            self.ready.clear()
+            data = self.outbox.get(timeout=0)
+            if len(data):
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                except Exception as e:
+                    self.report_send_error(e)
+                    self.outbox.close()
+                    break
+        self.source.close()
+        return
+
+
+class AsyncRequestHandler(RequestHandler):
+    """ Handles one client connection using an asyncio stream instead of a socket """
+    def __init__(self, server, stream, writer):
+        self.server  = server
+        self.stream  = stream
+        self.request = StreamSocket(writer)
+        self.client_address = writer.get_extra_info("peername")[:2]
+
+    def create_client(self, name, lang_choices):
+        return AsyncClient(self, name=name, lang_choices=lang_choices)
+
+    async def get_message(self):
+        data = await self.stream.read(self.server.bytes)
+        data = self.read(data)
+        return data
+
+    async def handle(self):
+        """ Same as RequestHandler.handle but awaits each message """
+
+        self.reader = None
+
+        # Password test, which may be split over more than one read
+
+        try:
+
+            packet = await self.get_message()
+
+            while len(packet) == 0:
+
+                packet = await self.get_message()
+
+        except ConnectionError as e:
+
+            self.refuse(e)
+
+            return
+
+        if self.authenticate(packet) < 0:
+
+            return
+
+        while self.server.running:
+
+            try:
+
+                packet = await self.get_message()
+
+                if packet is None:
+
+                    self.handle_client_lost()
+
+                    break
+
+            except asyncio.CancelledError:
+
+                raise
+
+            except Exception as e:
+
+                self.handle_client_lost()
+
+                break
+
+            self.handle_packet(packet)
+
+        return
+
+
+class AsyncBufferWorker(BufferWorker):
+    """ Handles the messages for one buffer in a task in the event loop. Up to
+        `cycle` messages that are already waiting are handled before letting
+        the other tasks run, so the clients' writers send them in one write """
+    cycle = 64
+    def __init__(self, server, buf_id, cursor_interval=None):
+        self.server = server
+        self.buf_id = buf_id
+        self.queue  = asyncio.Queue()
+        self.cursor_interval = cursor_interval
+        self.held     = OrderedDict()
+        self.deadline = None
+        self.coalesced = 0
+
+    async def join(self):
+        await self.queue.join()
+        return
+
+    async def run(self):
+        while self.server.running:
+            try:
+                msg = await asyncio.wait_for(self.queue.get(), self.get_timeout())
+            except asyncio.TimeoutError:
+                self.flush()
+                continue
+            self.handle(msg)
+
+            for i in range(self.cycle - 1):
+
+                if self.queue.empty():
+
+                    break
+
+                self.handle(self.queue.get_nowait())
+
+            # Let the other buffers and the clients' writers run before the next messages
+
+            await asyncio.sleep(0)
+        return
+
+
+class AsyncDispatcher(Dispatcher):
+    """ Same as Dispatcher but waits for the workers without blocking the loop """
+    async def dispatch(self, msg):
+        worker = self.workers.get(get_worker_id(msg, self.workers))
+
+        if worker is None:
+
+            for worker in self.workers.values():
+
+                await worker.join()
+
+            self.server.process_message(msg)
+
+            return
+
+        last = self.last.get(msg["src_id"])
+
+        if last is not None and last is not worker:
+
+            await last.join()
+
+        self.last[msg["src_id"]] = worker
+
+        worker.put(msg)
+
+        return
+
+
+class AsyncEngine(object):
+    """ Runs the event loop for a PolyServer in a background thread """
+    def __init__(self, server):
+        self.server  = server
+        self.loop    = asyncio.new_event_loop()
+        self.thread  = Thread(target=self.run)
+        self.thread.daemon = True
+        self.ready   = Event()
+        self.error   = None
+        self.tasks   = set()
+
+    def start(self):
+        """ Starts listening for connections. Raises any error from opening the socket """
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return
+
+    def stop(self):
+        """ Closes the listening socket and every connection and waits for the loop to finish """
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.thread.join(5)
+        return
+
+    def call(self, func, *args):
+        """ Calls a function in the event loop's thread and returns the result """
+        async def call():
+            return func(*args)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+        return
+
+    async def serve(self):
+
+        # The queues and event need to be made inside the loop
+
+        self.stopping = asyncio.Event()
+        self.server.msg_queue = asyncio.Queue()
+        self.server.workers = {i : AsyncBufferWorker(self.server, i, self.server.cursor_interval) for i in self.server.buffers}
+        self.server.dispatcher = AsyncDispatcher(self.server, self.server.workers)
+
+        try:
+
+            listener = await asyncio.start_server(self.handle_connection, self.server.ip_addr, self.server.port)
+
+        except Exception as e:
+
+            self.error = e
+            self.ready.set()
+            return
+
+        self.ready.set()
+
+        consumers = [asyncio.ensure_future(self.process_messages())]
+
+        consumers += [asyncio.ensure_future(worker.run()) for worker in self.server.workers.values()]
+
+        await self.stopping.wait()
+
+        listener.close()
+
+        for task in list(self.tasks) + consumers:
+
+            task.cancel()
+
+        await asyncio.gather(*(consumers + list(self.tasks)), return_exceptions=True)
+
+        await listener.wait_closed()
+
+        return
+
+    async def handle_connection(self, stream, writer):
+        """ Called by asyncio for each new connection """
+
+        task = asyncio.current_task() if hasattr(asyncio, "current_task") else asyncio.Task.current_task()
+
+        self.tasks.add(task)
+
+        try:
+
+            await AsyncRequestHandler(self.server, stream, writer).handle()
+
+        finally:
+
+            self.tasks.discard(task)
+
+            writer.close()
+
+        return
+
+    async def process_messages(self):
+        """ Passes each message on to the buffer workers as soon as it is added to the queue """
+
+        while self.server.running:
+
+            msg = await self.server.msg_queue.get()
+
+            try:
+
+                await self.server.dispatcher.dispatch(msg)
+
+            except Exception as e:
+
+                stdout("Error processing message {}: {}".format(msg, e))
+
+        return
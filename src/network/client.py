@@ -8,6 +8,8 @@ from .sender import *
 from .receiver import *
 from .message import *
 
+from ..ot.client import synchronized
+
 from time import sleep, time
 from hashlib import md5
 
@@ -44,6 +46,9 @@ class Client:
         self.name     = str(name if name is not None else hostname)
         self.args     = args
         self.id       = None
+        self.ipv6     = ipv6
+        self.password = password
+        self.joined   = False
 
         # Try and connect to server
 
@@ -101,7 +106,7 @@ class Client:
 
         # Send information about this client to the server
 
-        self.send( MSG_CONNECT(self.id, self.name, self.send.hostname, self.send.port, self.get_lang_choices()) )
+        self.join()
 
         # Give the recv / send a reference to the user-interface
         self.recv.ui = self.ui
@@ -109,6 +114,49 @@ class Client:
 
         self.ui.run()
 
+    def join(self):
+        """ Sends information about this client to the server, with the revision of each
+            buffer if we have joined before """
+        self.send( MSG_CONNECT(self.id, self.name, self.send.hostname, self.send.port, self.get_lang_choices(), self.get_revisions()) )
+        self.joined = True
+        return
+
+    def get_revisions(self):
+        """ Returns the revision of each buffer that has no operations waiting to be
+            acknowledged, so that the server only sends the operations we missed. The
+            other buffers are sent as a snapshot """
+        if not self.joined:
+            return {}
+        return {buf_id: buf.text.revision for buf_id, buf in self.ui.buffers.items() if buf.text.state is synchronized}
+
+    def reconnect(self):
+        """ Logs in to the server again after the connection was lost, keeping the
+            interface. If the server gives us a new id, our peer is moved to it """
+
+        for attr in (self.recv, self.send):
+
+            attr.kill()
+
+        self.send = Sender(self).connect(self.hostname, self.port, self.name, self.ipv6, self.password)
+
+        if not self.send.connected:
+
+            raise ConnectionError(self.send.error_message())
+
+        self.peers[self.send.conn_id] = self.peers.pop(self.id)
+
+        self.id = self.ui.local_peer.id = self.send.conn_id
+
+        self.recv = Receiver(self, self.send.conn)
+        self.recv.ui = self.ui
+        self.recv.start()
+
+        self.send.ui = self.ui
+
+        self.join()
+
+        return
+
     @staticmethod
     def read_configuration_file(filename):
         conf = {}
@@ -126,25 +174,37 @@ class Client:
         return [int(lang[0].is_true_lang()) for lang in self.lang.values()]
 
     def update_send(self):
-        """ Continually polls the queue and sends any messages to the server """
-        try:
-            while self.send.connected:
-                
-                try:
-                    
-                    msg = self.send_queue.get_nowait()
+        """ Continually polls the queue and sends the messages in it to the server as one batch """
+        messages = []
 
-                    self.send( msg )
+        try:
+            while True:
 
-                except ConnectionError as e:
-                    
-                    return print(e)
-                
-                self.ui.root.update_idletasks()
+                messages.append(self.send_queue.get_nowait())
                 
         # Break when the queue is empty
         except queue.Empty:
             pass
+
+        if len(messages) and self.send.connected:
+
+            try:
+
+                self.send.send_batch(messages)
+
+            except ConnectionError as e:
+
+                # Buffers with operations in the lost batch are sent a snapshot when we join again
+
+                try:
+
+                    self.reconnect()
+
+                except (ConnectionError, ConnectionRefusedError) as e:
+
+                    return print(e)
+
+            self.ui.root.update_idletasks()
             
         # Recursive call
         self.ui.root.after(30, self.update_send)
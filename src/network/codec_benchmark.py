@@ -0,0 +1,83 @@
+"""
+    Server/codec_benchmark.py
+    -------------------------
+
+    Compares the formats the server can send messages in. For keystroke
+    operations, cursor moves and selections it prints the average size of
+    a message as <...> text, a JSON frame and a binary frame, and the time
+    to encode and decode one in microseconds. Messages are decoded from one
+    buffer holding all of them, as they are read from a busy connection.
+
+    Run with `python -m src.network.codec_benchmark [--count N]` from the
+    root directory. See `src/ot/benchmark.py` for the OT engine.
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import random
+import timeit
+
+from .message import MESSAGE, MSG_OPERATION, MSG_SET_MARK, MSG_SELECT, FrameReader, NetworkMessageReader
+from ..ot.benchmark import keystroke
+
+
+def time_each(func, items, repeat=5):
+    """ Returns the best time in seconds to call func(items), per item """
+    return min(timeit.repeat(lambda: func(items), number=1, repeat=repeat)) / len(items)
+
+
+def run_codec(count=2000, length=4096, seed=0):
+    """ Prints the size of each kind of message in each format and the time to
+        encode and decode it """
+
+    rng = random.Random(seed)
+
+    def select():
+        start = rng.randint(0, length)
+        return MSG_SELECT(rng.randint(0, 15), start, min(length, start + rng.randint(1, 40)), 0)
+
+    kinds = [
+        ("keystroke", lambda: MSG_OPERATION(rng.randint(0, 15), keystroke(length, rng).ops, rng.randint(0, 100000))),
+        ("set_mark", lambda: MSG_SET_MARK(rng.randint(0, 15), rng.randint(0, length), 0)),
+        ("select", select),
+    ]
+
+    formats = [
+        ("<...>", MESSAGE.bytes, NetworkMessageReader),
+        ("frame", MESSAGE.frame, FrameReader),
+        ("binary", MESSAGE.pack, FrameReader),
+    ]
+
+    def encode_all(encode):
+        def run(msgs):
+            for msg in msgs:
+                msg.encoded = {} # messages keep their encoding, so start again each time
+                encode(msg)
+        return run
+
+    print("{:<10} {:<8} {:>12} {:>12} {:>12}".format("message", "format", "bytes", "encode (us)", "decode (us)"))
+
+    for name, make in kinds:
+
+        msgs = [make() for _ in range(count)]
+
+        for form, encode, reader in formats:
+            data = b"".join(encode(msg) for msg in msgs)
+            encode_time = time_each(encode_all(encode), msgs)
+            decode_time = min(timeit.repeat(lambda: reader().feed(data), number=1, repeat=5)) / count
+            print("{:<10} {:<8} {:>12.1f} {:>12.2f} {:>12.2f}".format(name, form, len(data) / float(count), encode_time * 1e6, decode_time * 1e6))
+
+    return
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark for the message formats")
+    parser.add_argument("--count", type=int, default=2000, help="number of messages of each kind")
+
+    args = parser.parse_args()
+
+    run_codec(count=args.count)
@@ -0,0 +1,426 @@
+"""
+    Client/headless.py
+    ------------------
+
+    A client with no interface, for bots, session recorders, spectator
+    relays and tests. It joins a session like the Tk client but keeps each
+    buffer's text, peer tags and OT state, and the other peers, in plain
+    Python:
+
+        client = HeadlessClient("bot").connect("localhost", 57890)
+        client.on_operation(lambda buf_id, src_id, operation: ...)
+        client.insert(0, 0, "d1 >> play('x-o-')\n")
+        client.evaluate(0, 1)
+
+    Messages are read in a background thread. Callbacks are called from that
+    thread, or from the thread making a local edit, while holding the
+    client's lock, so they see the documents as they were just after the
+    message and can make edits of their own.
+
+"""
+
+from __future__ import absolute_import
+
+import socket
+from collections import deque
+from threading import Thread, RLock, Event
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+from .message import *
+from .sender import Sender
+from ..ot.client import Client as OTClient, synchronized
+from ..ot.text_operation import TextOperation
+from ..ot.attribution import Attribution
+from ..interpreter import DEFAULT_INTERPRETERS
+
+
+class Document(OTClient):
+    """ The client's copy of one buffer """
+    def __init__(self, client, buf_id):
+        OTClient.__init__(self, 0)
+        self.client   = client
+        self.buf_id   = buf_id
+        self.text     = ""
+        self.peer_tag_doc = Attribution()
+        self.index    = 0    # the client's cursor
+        self.author   = None # id of the peer whose operation is being applied
+        self.applied  = None
+        self.sent     = deque() # time each operation waiting to be acknowledged was sent
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return len(self.text)
+
+    def set_all(self, document, peer_runs, revision=0, operations=()):
+        """ Sets the document from a snapshot in a MSG_SET_ALL or MSG_RESET. Any
+            operations waiting to be acknowledged are dropped by the server """
+        self.reset()
+        self.text = document
+        self.peer_tag_doc = Attribution(peer_runs)
+        for src_id, ops in operations:
+            self.text = TextOperation(ops, copy=False)(self.text)
+            self.peer_tag_doc.apply(ops, src_id)
+        self.revision = revision + len(operations)
+        self.index = min(self.index, len(self.text))
+        self.sent.clear()
+        return
+
+    def edit(self, operation):
+        """ Applies an operation made by the client and sends it when the server is ready for it """
+        self.text = operation(self.text)
+        self.peer_tag_doc.apply(operation.ops, self.client.id)
+        self.apply_client(operation)
+        return
+
+    def receive(self, src_id, operation):
+        """ Applies an operation from another peer, transformed against any of ours
+            that the server hasn't acknowledged, and returns what was applied """
+        self.author = src_id
+        self.applied = None
+        self.apply_server(operation)
+        return self.applied
+
+    def acknowledge(self):
+        """ Called when one of our operations comes back from the server. Returns
+            how long it took """
+        self.server_ack()
+        return clock() - self.sent.popleft()
+
+    def send_operation(self, revision, operation):
+        msg = MSG_OPERATION(self.client.id, operation.ops, revision)
+        msg.set_buf_id(self.buf_id)
+        self.sent.append(clock())
+        self.client.send(msg)
+        return
+
+    def apply_operation(self, operation):
+        self.text = operation(self.text)
+        self.peer_tag_doc.apply(operation.ops, self.author)
+        self.index = operation.transform_index(self.index)
+        self.applied = operation
+        return
+
+    def is_synchronized(self):
+        """ True if none of our operations are waiting to be acknowledged """
+        return self.state is synchronized
+
+    def get_lines(self, start, end):
+        """ Returns the text of lines `start` to `end`, counting from 1, which is
+            what is evaluated for a MSG_EVALUATE_BLOCK """
+        if start == end:
+            end += 1
+        return "\n".join(self.text.split("\n")[start - 1:end - 1])
+
+
+class Peer(object):
+    """ Another client in the session and where its cursor is """
+    def __init__(self, id, name="", hostname="", port=0, lang_choices=(), **kwargs):
+        self.id       = id
+        self.name     = name
+        self.hostname = hostname
+        self.port     = port
+        self.lang_choices = lang_choices
+        self.buf_id   = 0
+        self.index    = 0
+        self.select   = (0, 0)
+        self.connected = True
+
+    def __repr__(self):
+        return "<Peer {}: {}>".format(self.id, self.name)
+
+
+class HeadlessClient(object):
+    """ Joins a session and keeps each buffer's document up to date without an interface """
+    def __init__(self, name="headless", lang_choices=None):
+        self.name      = name
+        self.lang_choices = list(lang_choices) if lang_choices is not None else [0] * len(DEFAULT_INTERPRETERS)
+
+        self.id        = None
+        self.sender    = None
+        self.is_alive  = False # checked by the Sender
+        self.lock      = RLock()
+        self.joined    = Event()
+        self.buffers   = {} # buf_id to Document
+        self.peers     = {} # client id to Peer
+
+        self.callbacks = {"operation" : [], "evaluate" : [], "message" : []}
+
+        self.handles = {}
+
+        self.add_handle(MSG_CONNECT,         self.handle_connect)
+        self.add_handle(MSG_OPERATION,       self.handle_operation)
+        self.add_handle(MSG_SET_MARK,        self.handle_set_mark)
+        self.add_handle(MSG_SELECT,          self.handle_select)
+        self.add_handle(MSG_EVALUATE_BLOCK,  self.handle_evaluate)
+        self.add_handle(MSG_EVALUATE_STRING, self.handle_evaluate_str)
+        self.add_handle(MSG_REMOVE,          self.handle_remove)
+        self.add_handle(MSG_KILL,            self.handle_kill)
+        self.add_handle(MSG_SET_ALL,         self.handle_set_all)
+        self.add_handle(MSG_RESET,           self.handle_set_all)
+        self.add_handle(MSG_REQUEST_ACK,     self.handle_request_ack)
+
+    # Connection
+    # ==========
+
+    def connect(self, host="localhost", port=57890, password="", framed=True, timeout=10):
+        """ Logs in and joins the session, waiting up to `timeout` seconds to be sent
+            the contents of the buffers. If the client has joined before, it gives
+            the revisions it has so the server can send only what it missed """
+
+        self.sender = Sender(self).connect(host, port, self.name, password=password, framed=framed)
+
+        if not self.sender.connected:
+
+            raise ConnectionError(self.sender.error_message())
+
+        self.id = self.sender.conn_id
+
+        self.is_alive = True
+
+        self.joined.clear()
+
+        self.reader = FrameReader() if self.sender.framed else NetworkMessageReader()
+
+        self.thread = Thread(target=self.listen, args=(self.sender, self.reader))
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.send(MSG_CONNECT(self.id, self.name, self.sender.hostname, self.sender.port, self.lang_choices, self.get_revisions()))
+
+        if timeout is not None and not self.joined.wait(timeout):
+
+            self.kill()
+
+            raise ConnectionError("Timed out waiting for the contents of the session")
+
+        return self
+
+    def get_revisions(self):
+        """ Returns the revision of each buffer that has no operations waiting to be
+            acknowledged. Any that are lost when the connection closes are not in the
+            server's history, so the other buffers are sent as a snapshot """
+        with self.lock:
+            return {buf_id: doc.revision for buf_id, doc in self.buffers.items() if doc.is_synchronized()}
+
+    def kill(self):
+        """ Closes the connection. It is shut down first so that the server, and
+            the thread reading from it, see it close straight away """
+        self.is_alive = False
+        if self.sender is not None:
+            try:
+                self.sender.conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.sender.kill()
+        return
+
+    def send(self, msg):
+        with self.lock:
+            self.sender.send(msg)
+        return
+
+    def listen(self, sender, reader):
+        """ Reads and handles messages until the connection is closed """
+
+        while self.is_alive and sender is self.sender:
+
+            try:
+
+                packet = reader.feed(sender.conn.recv(65536))
+
+            except (EmptyMessageError, socket.error):
+
+                break
+
+            for msg in packet:
+
+                self.handle(msg)
+
+        if sender is self.sender:
+
+            self.is_alive = False
+
+        return
+
+    # Message handling
+    # ================
+
+    def add_handle(self, msg_cls, func):
+        """ Associates a received message class with a method or function """
+        self.handles[msg_cls.type] = func
+        return
+
+    def handle(self, message):
+        """ Passes the message onto the correct handler, then to any `on_message` callbacks """
+        with self.lock:
+            handler = self.handles.get(message.type)
+            if handler is not None:
+                handler(message)
+            self.call("message", message)
+        return
+
+    def call(self, event, *args):
+        for func in self.callbacks[event]:
+            func(*args)
+        return
+
+    def handle_connect(self, message):
+        if message["src_id"] != self.id:
+            self.peers[message["src_id"]] = Peer(message["src_id"], **message.dict())
+        return
+
+    def handle_remove(self, message):
+        peer = self.peers.get(message["src_id"])
+        if peer is not None:
+            peer.connected = False
+        return
+
+    def handle_kill(self, message):
+        self.kill()
+        return
+
+    def handle_request_ack(self, message):
+        if message["flag"] == 1:
+            self.send(MSG_CONNECT_ACK(self.id))
+        return
+
+    def handle_set_all(self, message):
+        # Servers that number our operations from their own history transform them
+        # without reordering inserts, so we must do the same
+        canonical = not self.sender.capabilities & CAP_REVISIONS
+        for buf_id, snapshot in message["buffers"].items():
+            doc = self.get_document(int(buf_id))
+            doc.canonical = canonical
+            doc.set_all(*read_snapshot(snapshot))
+        for peer_id, location in message["peers"].items():
+            peer = self.peers.get(int(peer_id))
+            if peer is not None:
+                peer.buf_id, peer.index = location
+        self.joined.set()
+        return
+
+    def handle_operation(self, message):
+        doc = self.get_document(message["buf_id"])
+        if message["src_id"] == self.id:
+            doc.acknowledge()
+            return
+        operation = doc.receive(message["src_id"], TextOperation(message["operation"]))
+        self.move_peer(message)
+        if operation is not None:
+            self.call("operation", message["buf_id"], message["src_id"], operation)
+        return
+
+    def handle_set_mark(self, message):
+        self.move_peer(message, message["index"])
+        return
+
+    def handle_select(self, message):
+        peer = self.move_peer(message)
+        if peer is not None:
+            peer.select = (message["start"], message["end"])
+        return
+
+    def handle_evaluate(self, message):
+        code = self.get_document(message["buf_id"]).get_lines(message["start"], message["end"])
+        self.call("evaluate", message["buf_id"], message["src_id"], code)
+        return
+
+    def handle_evaluate_str(self, message):
+        self.call("evaluate", message["buf_id"], message["src_id"], message["string"])
+        return
+
+    def move_peer(self, message, index=None):
+        """ Moves a peer to the buffer of a message and to `index`, if given """
+        peer = self.peers.get(message["src_id"])
+        if peer is not None:
+            peer.buf_id = message["buf_id"]
+            if index is not None:
+                peer.index = index
+        return peer
+
+    def get_document(self, buf_id):
+        if buf_id not in self.buffers:
+            self.buffers[buf_id] = Document(self, buf_id)
+        return self.buffers[buf_id]
+
+    # Callbacks
+    # =========
+
+    def on_operation(self, func):
+        """ Calls func(buf_id, src_id, operation) with each TextOperation applied to a
+            document, including the client's own edits """
+        self.callbacks["operation"].append(func)
+        return func
+
+    def on_evaluate(self, func):
+        """ Calls func(buf_id, src_id, code) when a peer evaluates some code """
+        self.callbacks["evaluate"].append(func)
+        return func
+
+    def on_message(self, func):
+        """ Calls func(message) with every message received, after it is handled """
+        self.callbacks["message"].append(func)
+        return func
+
+    # Editing
+    # =======
+
+    def get_text(self, buf_id=0):
+        return self.get_document(buf_id).text
+
+    def edit(self, buf_id, operation):
+        """ Applies a TextOperation to a document and sends it to the server """
+        with self.lock:
+            self.get_document(buf_id).edit(operation)
+            self.call("operation", buf_id, self.id, operation)
+        return
+
+    def insert(self, buf_id, index, text):
+        """ Inserts text at `index` in a buffer """
+        with self.lock:
+            length = len(self.get_document(buf_id))
+            self.edit(buf_id, TextOperation().retain(index).insert(text).retain(length - index))
+        return
+
+    def delete(self, buf_id, index, length=1):
+        """ Deletes `length` characters from `index` in a buffer """
+        with self.lock:
+            total = len(self.get_document(buf_id))
+            self.edit(buf_id, TextOperation().retain(index).delete(length).retain(total - index - length))
+        return
+
+    def set_mark(self, buf_id, index):
+        """ Moves the client's cursor """
+        with self.lock:
+            self.get_document(buf_id).index = index
+            self.send_to_buffer(buf_id, MSG_SET_MARK(self.id, index, reply=0))
+        return
+
+    def select(self, buf_id, start, end):
+        self.send_to_buffer(buf_id, MSG_SELECT(self.id, start, end, reply=0))
+        return
+
+    def evaluate(self, buf_id, start, end=None):
+        """ Evaluates lines `start` to `end`, counting from 1, on every client """
+        self.send_to_buffer(buf_id, MSG_EVALUATE_BLOCK(self.id, start, start if end is None else end))
+        return
+
+    def evaluate_string(self, buf_id, string):
+        self.send_to_buffer(buf_id, MSG_EVALUATE_STRING(self.id, string))
+        return
+
+    def send_to_buffer(self, buf_id, msg):
+        msg.set_buf_id(buf_id)
+        self.send(msg)
+        return
+
+    def is_synchronized(self):
+        """ True if the server has acknowledged every operation the client sent """
+        with self.lock:
+            return all(doc.is_synchronized() for doc in self.buffers.values())
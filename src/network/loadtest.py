@@ -0,0 +1,374 @@
+"""
+    Server/loadtest.py
+    ------------------
+
+    Simulates performers typing in a session to find out how many a
+    PolyServer can keep up with. Each performer is a HeadlessClient, using
+    frames or the <...> format with --legacy, that sends keystrokes, cursor
+    moves, selections and evaluations at random times, at the given rates.
+
+    At the end of the run the performers stop typing and wait for their
+    operations to be acknowledged and for everyone else's to arrive. Then
+    it prints:
+
+    - throughput: keystrokes and operations sent, and messages received,
+      per second
+    - latency: the 50th, 90th and 99th percentile and maximum time for an
+      operation to come back from the server (ack) and to reach the other
+      performers (delivery), in milliseconds
+    - convergence: whether every copy of each buffer has the same text,
+      including the server's if it was started by the load test
+
+    Run with `python -m src.network.loadtest --clients 8 --serve` from the
+    root directory to start a server on loopback for the test, or give the
+    --host and --port of a server that is already running.
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import random
+from threading import Thread
+from time import sleep
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+from .headless import HeadlessClient
+from .message import MSG_OPERATION
+
+KEYS = "abcdefghijklmnopqrstuvwxyz      ()[]=.,+*0123456789" # mostly letters and spaces, like code
+
+RATES = {
+    "keystrokes"  : 5.0,  # per second, per performer
+    "cursors"     : 0.5,
+    "selections"  : 0.2,
+    "evaluations" : 0.1,
+}
+
+
+class Performer(HeadlessClient):
+    """ One simulated client. `perform` sends random edits, cursor moves, selections
+        and evaluations to one buffer """
+    def __init__(self, name, buf_id=0, rates=RATES, backspace=0.15, seed=None):
+        HeadlessClient.__init__(self, name)
+        self.buf_id     = buf_id
+        self.rates      = rates
+        self.backspace  = backspace # chance of a keystroke being a delete
+        self.rng        = random.Random(seed)
+        self.performers = {} # client id to Performer, to look up when operations were sent
+
+        self.sent       = {} # buf_id to the time each operation was sent
+        self.acked      = {} # buf_id to number of operations acknowledged
+        self.received   = {} # (src_id, buf_id) to number of operations
+        self.counts     = {key: 0 for key in list(rates) + ["messages"]}
+        self.ack        = []
+        self.delivery   = []
+
+    def handle(self, message):
+        self.counts["messages"] += 1
+        HeadlessClient.handle(self, message)
+        return
+
+    def send(self, msg):
+        """ Records when each operation is sent """
+        if isinstance(msg, MSG_OPERATION):
+            self.sent.setdefault(msg["buf_id"], []).append(clock())
+        HeadlessClient.send(self, msg)
+        return
+
+    def handle_operation(self, message):
+        """ Records how long the operation took to come back from the server or,
+            if it is another performer's, to get here """
+
+        HeadlessClient.handle_operation(self, message)
+
+        buf_id = message["buf_id"]
+
+        if message["src_id"] == self.id:
+
+            count = self.acked.get(buf_id, 0)
+
+            self.acked[buf_id] = count + 1
+
+            self.ack.append(clock() - self.sent[buf_id][count])
+
+            return
+
+        # The nth operation received from a performer is the nth one it sent
+
+        key = (message["src_id"], buf_id)
+
+        count = self.received.get(key, 0)
+
+        self.received[key] = count + 1
+
+        performer = self.performers.get(message["src_id"])
+
+        sent = performer.sent.get(buf_id, []) if performer is not None else []
+
+        if count < len(sent):
+
+            self.delivery.append(clock() - sent[count])
+
+        return
+
+    def perform(self, duration):
+        """ Sends each kind of message at random times, at its rate per second, for
+            `duration` seconds """
+
+        actions = [(rate, getattr(self, "send_" + name)) for name, rate in self.rates.items() if rate > 0]
+
+        if not actions:
+
+            return
+
+        start = clock()
+
+        due = [start + self.rng.expovariate(rate) for rate, action in actions]
+
+        while self.is_alive:
+
+            i = min(range(len(due)), key=due.__getitem__)
+
+            if due[i] > start + duration:
+
+                break
+
+            wait = due[i] - clock()
+
+            if wait > 0:
+
+                sleep(wait)
+
+            with self.lock:
+
+                actions[i][1]()
+
+            due[i] += self.rng.expovariate(actions[i][0])
+
+        return
+
+    def send_keystrokes(self):
+        """ Types a character, or deletes the one before the cursor """
+        doc = self.get_document(self.buf_id)
+        index = min(doc.index, len(doc))
+        if index > 0 and self.rng.random() < self.backspace:
+            self.delete(self.buf_id, index - 1)
+            doc.index = index - 1
+        else:
+            self.insert(self.buf_id, index, "\n" if self.rng.random() < 0.05 else self.rng.choice(KEYS))
+            doc.index = index + 1
+        self.counts["keystrokes"] += 1
+        return
+
+    def send_cursors(self):
+        self.set_mark(self.buf_id, self.rng.randint(0, len(self.get_document(self.buf_id))))
+        self.counts["cursors"] += 1
+        return
+
+    def send_selections(self):
+        length = len(self.get_document(self.buf_id))
+        start = self.rng.randint(0, length)
+        self.select(self.buf_id, start, min(length, start + self.rng.randint(1, 40)))
+        self.counts["selections"] += 1
+        return
+
+    def send_evaluations(self):
+        """ Evaluates the line the cursor is on """
+        doc = self.get_document(self.buf_id)
+        self.evaluate(self.buf_id, doc.text.count("\n", 0, doc.index) + 1)
+        self.counts["evaluations"] += 1
+        return
+
+    def count(self, key):
+        """ Returns the number of messages of a kind sent, or "operations" sent, or "messages" received """
+        if key == "operations":
+            with self.lock:
+                return sum(len(times) for times in self.sent.values())
+        return self.counts[key]
+
+    def is_settled(self):
+        """ True if the performer has no operations waiting to be acknowledged and has
+            received every operation the other performers sent """
+        with self.lock:
+            if not self.is_synchronized():
+                return False
+            for performer in self.performers.values():
+                for buf_id, times in list(performer.sent.items()):
+                    if performer is not self and self.received.get((performer.id, buf_id), 0) < len(times):
+                        return False
+        return True
+
+
+def percentiles(times):
+    """ Returns the 50th, 90th and 99th percentile and the maximum of a list of times
+        in milliseconds """
+    if not times:
+        return (0, 0, 0, 0)
+    times = sorted(times)
+    def get(p):
+        return times[min(len(times) - 1, (len(times) * p) // 100)] * 1000
+    return (get(50), get(90), get(99), times[-1] * 1000)
+
+
+def run(clients=4, host="localhost", port=57890, password="", duration=10.0, rates=RATES, buffers=1,
+        framed=True, serve=False, engine="threads", settle=10.0, seed=0):
+    """ Runs a load test and prints the results. Returns True if every copy of each
+        buffer ended up the same """
+
+    server = None
+
+    if serve:
+
+        from .server import PolyServer
+
+        server = PolyServer(password=password, port=port, engine=engine)
+
+        server.listen()
+
+        host = "127.0.0.1"
+
+    performers = []
+
+    try:
+
+        for i in range(clients):
+
+            performer = Performer("performer-{}".format(i), buf_id=i % buffers, rates=rates, seed=seed + i)
+
+            performers.append(performer.connect(host, port, password, framed))
+
+        ids = {performer.id: performer for performer in performers}
+
+        for performer in performers:
+
+            performer.performers = ids
+
+        print("{} performers connected to {}:{}, sending for {}s".format(clients, host, port, duration))
+
+        start = clock()
+
+        threads = [Thread(target=performer.perform, args=(duration,)) for performer in performers]
+
+        for thread in threads:
+
+            thread.start()
+
+        for thread in threads:
+
+            thread.join()
+
+        elapsed = clock() - start
+
+        # Wait for the operations still on their way
+
+        deadline = clock() + settle
+
+        while not all(performer.is_settled() for performer in performers) and clock() < deadline:
+
+            sleep(0.05)
+
+        settled = clock() - start - elapsed
+
+        report(performers, elapsed)
+
+        converged = check_convergence(performers, server)
+
+        print("settled in {:.2f}s, {}".format(settled, "converged" if converged else "NOT converged"))
+
+        return converged
+
+    finally:
+
+        for performer in performers:
+
+            performer.kill()
+
+        if server is not None:
+
+            server.kill()
+
+
+def report(performers, elapsed):
+    """ Prints the throughput and latency of the performers' messages """
+
+    print()
+
+    for key in list(RATES) + ["operations", "messages"]:
+
+        total = sum(performer.count(key) for performer in performers)
+
+        print("{:<12} {:>8} {:>10.1f}/s".format(key, total, total / elapsed))
+
+    print()
+
+    print("{:<12} {:>8} {:>8} {:>8} {:>8} {:>8}".format("latency (ms)", "count", "p50", "p90", "p99", "max"))
+
+    for name in ("ack", "delivery"):
+
+        times = [t for performer in performers for t in getattr(performer, name)]
+
+        print("{:<12} {:>8} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}".format(name, len(times), *percentiles(times)))
+
+    print()
+
+    return
+
+
+def check_convergence(performers, server=None):
+    """ Prints any buffer that isn't the same for every performer, and the server if
+        given, and returns True if there are none """
+
+    converged = True
+
+    buf_ids = sorted(set(buf_id for performer in performers for buf_id in performer.buffers))
+
+    for buf_id in buf_ids:
+
+        documents = set(performer.get_text(buf_id) for performer in performers)
+
+        if server is not None:
+
+            documents.add(str(server.buffers[buf_id].document))
+
+        if len(documents) > 1:
+
+            print("buffer {} has {} different versions".format(buf_id, len(documents)))
+
+            converged = False
+
+    return converged
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Load test for the Troop server")
+    parser.add_argument("-c", "--clients", type=int, default=4, help="number of performers (default 4)")
+    parser.add_argument("-H", "--host", default="localhost", help="address of the server (default localhost)")
+    parser.add_argument("-P", "--port", type=int, default=57890, help="port of the server (default 57890)")
+    parser.add_argument("-p", "--password", default="", help="server password")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds to send messages for (default 10)")
+    parser.add_argument("-b", "--buffers", type=int, default=1, help="number of buffers to spread the performers over (default 1)")
+    parser.add_argument("--settle", type=float, default=10.0, help="most seconds to wait for operations after sending stops (default 10)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy", action="store_true", help="use the <...> message format instead of frames")
+    parser.add_argument("--serve", action="store_true", help="start a server on loopback for the test")
+    parser.add_argument("--engine", default="threads", choices=("threads", "asyncio"), help="engine of the server started by --serve")
+
+    for name, rate in RATES.items():
+        parser.add_argument("--" + name, type=float, default=rate, help="{} per second per performer (default {})".format(name, rate))
+
+    args = parser.parse_args()
+
+    rates = {name: getattr(args, name) for name in RATES}
+
+    converged = run(args.clients, args.host, args.port, args.password, args.duration, rates, args.buffers,
+                    not args.legacy, args.serve, args.engine, args.settle, args.seed)
+
+    sys.exit(0 if converged else 1)
@@ -5,13 +5,98 @@
     Messages are sent as a series of arguments surrounnded by
     <arrows><like><so>.
 
+    Fields added to a message type since then are listed in its
+    `extensions` and are left out of this format, so older clients can
+    still read and write it.
+
+    Clients that start their connection with a handshake (FRAME_MAGIC, the
+    protocol version and the capability flags they support) send and
+    receive frames instead: a 4 byte length followed by the message's
+    values as a JSON array. The server replies to the password with the
+    4 digit client id as usual followed by the capability flags that both
+    sides support. With CAP_BINARY, types with a `binary` field list
+    (operations and cursor updates) are sent in a compact binary form
+    instead of JSON, starting with the type number:
+
+        <type><msg_id><buf_id><src_id><field>...
+
+    where numbers are varints, operations are a count followed by tagged
+    varints for retains/deletes and length-prefixed UTF-8 for inserts.
+
+    With CAP_BATCH, a batch frame's payload is a zero byte followed by other
+    frames, so that a burst of messages can be sent in one write.
+
+    With CAP_REVISIONS, each buffer's snapshot in MSG_SET_ALL and MSG_RESET
+    is its text, peer runs, revision and the operations to apply after it,
+    and operations are numbered from the start of the server's history.
+    Other clients, including every <...> client, are sent the text and a
+    string with the peer character of each character, and number their
+    operations from that snapshot. `read_snapshot` reads either.
+
+    With CAP_DELTA, a reconnecting client can give its last revision in each
+    buffer in its MSG_CONNECT and is only sent the operations it missed.
+
+    CAP_DELTA is only used along with CAP_REVISIONS. A server that doesn't
+    know a client's protocol version closes the connection, and the client
+    logs in again without the handshake.
+
+    With CAP_COMPRESS, MSG_SET_ALL and MSG_RESET are sent in binary form with
+    each buffer's snapshot as zlib-compressed JSON.
+
 """
 
 from __future__ import absolute_import
 
 import re
-import inspect
 import json
+import zlib
+import struct
+
+from itertools import groupby
+
+from ..utils import get_peer_char, get_peer_id_from_char
+
+FRAME_MAGIC  = b"\x00PF"
+FRAME_HEADER = struct.Struct("!I")
+
+from itertools import groupby
+
+from ..utils import get_peer_char, get_peer_id_from_char
+
+BATCH_TAG = 0
+
+# Handshake
+
+HANDSHAKE        = struct.Struct("!3sBI") # magic, protocol version, capability flags
+HANDSHAKE_REPLY  = struct.Struct("!I")    # capability flags, after the client id
+PROTOCOL_VERSION = 1
+
+CAP_BINARY    = 1
+CAP_BATCH     = 2
+CAP_DELTA     = 4
+CAP_REVISIONS = 8
+CAP_COMPRESS  = 16
+
+CAPABILITIES = CAP_BINARY | CAP_BATCH | CAP_DELTA | CAP_REVISIONS | CAP_COMPRESS # supported by this version
+
+def shared_capabilities(capabilities):
+    """ Returns the capabilities in `capabilities` that this version supports, leaving
+        out the ones that need CAP_REVISIONS if it isn't there """
+    capabilities &= CAPABILITIES
+    if not capabilities & CAP_REVISIONS:
+        capabilities &= ~CAP_DELTA
+    return capabilities
+
+def handshake(capabilities=CAPABILITIES):
+    """ Returns the bytes a client starts its connection with to use frames """
+    return HANDSHAKE.pack(FRAME_MAGIC, PROTOCOL_VERSION, capabilities)
+
+def batch_frames(frames):
+    """ Returns a list of encoded frames as a single batch frame """
+    if len(frames) == 1:
+        return frames[0]
+    data = b"".join(frames)
+    return FRAME_HEADER.pack(len(data) + 1) + bytearray([BATCH_TAG]) + data
 
 def escape_chars(s):
     return s.replace(">", "\>").replace("<", "\<")
@@ -65,7 +150,7 @@ class NetworkMessageReader:
 
             # This tells us how many following items are arguments of this message
 
-            j = len(cls.header())
+            j = len(cls.legacy_schema)
 
             try:
 
@@ -106,30 +191,156 @@ class NetworkMessageReader:
         return pkg
 
 
+class FrameReader:
+    """ Reads length-prefixed frames. Data is added to a buffer and each complete frame
+        is decoded once, so large messages split over many reads aren't scanned again.
+        If `handshake` is True, the data must start with a handshake, which sets
+        `version` and `capabilities` """
+    def __init__(self, handshake=False):
+        self.buffer    = bytearray()
+        self.handshake = handshake
+        self.version   = None
+        self.capabilities = 0
+
+    def feed(self, data):
+        """ Adds data read from the connection and returns the complete messages in it """
+
+        if len(data) == 0:
+
+            raise EmptyMessageError()
+
+        self.buffer.extend(data)
+
+        if self.handshake:
+
+            if len(self.buffer) < HANDSHAKE.size:
+
+                return []
+
+            magic, self.version, self.capabilities = HANDSHAKE.unpack_from(self.buffer)
+
+            if magic != FRAME_MAGIC:
+
+                raise ConnectionError("Invalid handshake")
+
+            if self.version != PROTOCOL_VERSION:
+
+                raise ConnectionError("Unsupported protocol version {}".format(self.version))
+
+            del self.buffer[:HANDSHAKE.size]
+
+            self.handshake = False
+
+        pkg, start = [], 0
+
+        while len(self.buffer) - start >= FRAME_HEADER.size:
+
+            size, = FRAME_HEADER.unpack_from(self.buffer, start)
+
+            end = start + FRAME_HEADER.size + size
+
+            if len(self.buffer) < end:
+
+                break
+
+            self.decode(self.buffer[start + FRAME_HEADER.size:end], pkg)
+
+            start = end
+
+        del self.buffer[:start]
+
+        return pkg
+
+    def decode(self, payload, pkg):
+        """ Adds the message, or messages in a batch, in a frame's payload to `pkg` """
+
+        if payload[0] == ord("["):
+
+            pkg.append(MESSAGE.from_values(json.loads(payload.decode("utf-8"))))
+
+        elif payload[0] == BATCH_TAG:
+
+            i = 1
+
+            while i < len(payload):
+
+                size, = FRAME_HEADER.unpack_from(payload, i)
+
+                i += FRAME_HEADER.size
+
+                self.decode(payload[i:i + size], pkg)
+
+                i += size
+
+        else:
+
+            pkg.append(BINARY_CODECS[payload[0]].decode(payload))
+
+        return
+
+
 class MESSAGE(object):
-    """ Abstract base class """
-    data = {}
-    keys = []
+    """ Abstract base class. Each message type's `schema`, the names of the values
+        sent for it in order, is worked out from its `__init__` when the module
+        is imported. Its `legacy_schema` leaves out the `extensions` """
+    __slots__ = ("data", "keys", "encoded")
     type = None
+    schema = ('type', 'msg_id', 'buf_id', 'src_id')
+    legacy_schema = schema
+    extensions = () # fields older clients don't know about: the last arguments of `__init__`, with defaults
+    binary = None # (field name, kind) pairs if the message has a binary form
+    capability = CAP_BINARY # needed by a client to be sent the binary form
     def __init__(self, src_id, msg_id=0, buf_id=0):
         self.data = {'src_id' : int(src_id), "type" : self.type, "msg_id": msg_id, "buf_id": buf_id}
-        self.keys = ['type', 'msg_id', 'buf_id', 'src_id']
+        self.keys = self.schema # only copied if a key is added
+        self.encoded = {} # cached results of `bytes` and `frame`
 
     def __str__(self):
-        return "".join([self.format(item) for item in self])
+        return "".join([self.format(self.data[key]) for key in self.keys if key not in self.extensions])
 
     def set_msg_id(self, value):
         self.data["msg_id"] = int(value)
+        self.encoded = {}
 
     def set_buf_id(self, value):
         self.data["buf_id"] = int(value)
+        self.encoded = {}
 
     @staticmethod
     def format(value):
         return "<{}>".format(escape_chars(json.dumps(value)))
 
     def bytes(self):
-        return str(self).encode("utf-8")
+        """ Returns the message encoded for sending. This is only done once, so the
+            same bytes are sent to every client, until a field is changed """
+        if "text" not in self.encoded:
+            self.encoded["text"] = str(self).encode("utf-8")
+        return self.encoded["text"]
+
+    def frame(self):
+        """ Like `bytes` but returns the message as a length-prefixed frame """
+        if "frame" not in self.encoded:
+            payload = json.dumps(list(self)).encode("utf-8")
+            self.encoded["frame"] = FRAME_HEADER.pack(len(payload)) + payload
+        return self.encoded["frame"]
+
+    def pack(self, capabilities=CAPABILITIES):
+        """ Like `frame` but uses the binary form of the message if it has one and
+            it is in the `capabilities` of the client it is sent to """
+        if self.binary is None or not capabilities & self.capability:
+            return self.frame()
+        if "pack" not in self.encoded:
+            payload = BINARY_CODECS[self.type].encode(self)
+            self.encoded["pack"] = FRAME_HEADER.pack(len(payload)) + payload
+        return self.encoded["pack"]
+
+    @staticmethod
+    def from_values(values):
+        """ Creates a message from a list of values in the order they are sent """
+        msg = MESSAGE_TYPE[int(values[0])](*values[3:])
+        msg.set_msg_id(values[1])
+        msg.set_buf_id(values[2])
+        return msg
 
     def raw_string(self):
         return "<{}>".format(self.type) + "".join(["<{}>".format(repr(item)) for item in self])
@@ -154,9 +365,10 @@ class MESSAGE(object):
         return self.data[key]
 
     def __setitem__(self, key, value):
-        if key not in self.keys:
-            self.keys.append(key)
+        if key not in self.data:
+            self.keys = self.keys + (key,)
         self.data[key] = value
+        self.encoded = {}
 
     def __contains__(self, key):
         return key in self.data
@@ -183,62 +395,74 @@ class MESSAGE(object):
 
     @classmethod
     def header(cls):
-        return ['type', 'msg_id', 'buf_id'] + inspect.getargspec(cls.__init__).args[1:]
+        return list(cls.schema)
 
 # Define types of message
         
 class MSG_CONNECT(MESSAGE):
     type = 1
-    def __init__(self, src_id, name, hostname, port, lang_choices=[]):
+    __slots__ = ()
+    extensions = ("revisions",)
+    def __init__(self, src_id, name, hostname, port, lang_choices=[], revisions={}):
         MESSAGE.__init__(self, src_id)
-        self['name']         = str(name)
-        self['hostname']     = str(hostname)
-        self['port']         = int(port)
-        self['lang_choices'] = list(lang_choices)
+        self.data['name']         = str(name)
+        self.data['hostname']     = str(hostname)
+        self.data['port']         = int(port)
+        self.data['lang_choices'] = list(lang_choices)
+        self.data['revisions']    = {int(buf_id): int(rev) for buf_id, rev in revisions.items()} # buf_id to last revision seen when reconnecting
 
 class MSG_OPERATION(MESSAGE):
     type = 2
+    __slots__ = ()
+    binary = (("operation", "ops"), ("revision", "int"))
     def __init__(self, src_id, operation, revision):
         MESSAGE.__init__(self, src_id)
-        self["operation"] = [str(item) if not isinstance(item, int) else item for item in operation]
-        self["revision"]  = int(revision)
+        self.data["operation"] = [str(item) if not isinstance(item, int) else item for item in operation]
+        self.data["revision"]  = int(revision)
 
 class MSG_SET_MARK(MESSAGE):
     type = 3
+    __slots__ = ()
+    binary = (("index", "int"), ("reply", "int"))
     def __init__(self, src_id, index, reply=1):
         MESSAGE.__init__(self, src_id)
-        self['index'] = int(index)
-        self['reply'] = int(reply)
+        self.data['index'] = int(index)
+        self.data['reply'] = int(reply)
 
 class MSG_PASSWORD(MESSAGE):
     type = 4
+    __slots__ = ()
     def __init__(self, src_id, password, name):
         MESSAGE.__init__(self, src_id)
-        self['password']=str(password)
-        self['name']=str(name)
+        self.data['password']=str(password)
+        self.data['name']=str(name)
 
 class MSG_REMOVE(MESSAGE):
     type = 5
+    __slots__ = ()
     def __init__(self, src_id):
         MESSAGE.__init__(self, src_id)
 
 class MSG_EVALUATE_STRING(MESSAGE):
     type = 6
+    __slots__ = ()
     def __init__(self, src_id, string, reply=1):
         MESSAGE.__init__(self, src_id)
-        self['string']=str(string)
-        self['reply']=int(reply)
+        self.data['string']=str(string)
+        self.data['reply']=int(reply)
 
 class MSG_EVALUATE_BLOCK(MESSAGE):
     type = 7
+    __slots__ = ()
     def __init__(self, src_id, start, end, reply=1):
         MESSAGE.__init__(self, src_id)
-        self['start']=int(start)
-        self['end']=int(end)
-        self['reply']=int(reply)
+        self.data['start']=int(start)
+        self.data['end']=int(end)
+        self.data['reply']=int(reply)
 
 class MSG_GET_ALL(MESSAGE):
     type = 8
+    __slots__ = ()
     def __init__(self, src_id):
         MESSAGE.__init__(self, src_id)
 
@@ -252,53 +476,70 @@ class MSG_GET_ALL(MESSAGE):
 
 class MSG_SET_ALL(MESSAGE):
     type = 9
+    __slots__ = ()
+    binary = (("buffers", "snapshots"), ("peers", "json"))
+    capability = CAP_COMPRESS
     def __init__(self, src_id, buffers, peers):
         MESSAGE.__init__(self, src_id)
-        self['buffers'] = buffers # dict of buf_id to (doc, peer_tag_doc)
-        self['peers']   = peers   # dict of client_id to (buf_id, index)
+        self.data['buffers'] = buffers # dict of buf_id to snapshot, see read_snapshot
+        self.data['peers']   = peers   # dict of client_id to (buf_id, index)
 
 class MSG_SELECT(MESSAGE):
     type = 10
+    __slots__ = ()
+    binary = (("start", "int"), ("end", "int"), ("reply", "int"))
     def __init__(self, src_id, start, end, reply=1):
         MESSAGE.__init__(self, src_id)
-        self['start']=int(start)
-        self['end']=int(end)
-        self['reply']=int(reply)
+        self.data['start']=int(start)
+        self.data['end']=int(end)
+        self.data['reply']=int(reply)
 
 class MSG_RESET(MSG_SET_ALL):
     type = 11 
+    __slots__ = ()
 
 class MSG_KILL(MESSAGE):
     type = 12
+    __slots__ = ()
     def __init__(self, src_id, string):
         MESSAGE.__init__(self, src_id)
-        self['string']=str(string)
+        self.data['string']=str(string)
 
 class MSG_CONNECT_ACK(MESSAGE):
     type = 13
+    __slots__ = ()
     def __init__(self, src_id, reply=0):
         MESSAGE.__init__(self, src_id)
-        self["reply"] = reply
+        self.data["reply"] = reply
 
 class MSG_REQUEST_ACK(MESSAGE):
     type = 14
+    __slots__ = ()
     def __init__(self, src_id, flag, reply=0):
         MESSAGE.__init__(self, src_id)
-        self['flag'] = int(flag)
-        self["reply"] = reply
+        self.data['flag'] = int(flag)
+        self.data["reply"] = reply
 
 class MSG_CONSOLE(MESSAGE):
     type = 15
+    __slots__ = ()
     def __init__(self, src_id, text):
         MESSAGE.__init__(self, src_id)
-        self['text'] = str(text)
+        self.data['text'] = str(text)
 
 class MSG_LANG_LEADER(MESSAGE):
     type = 16
+    __slots__ = ()
     def __init__(self, src_id, flags):
         MESSAGE.__init__(self, src_id)
-        self['flags'] = list(flags)
+        self.data['flags'] = list(flags)
  
+def get_schema(cls):
+    """ Returns the names of the values sent for a message type: the header followed
+        by the arguments of its `__init__` """
+    code = cls.__init__.__code__
+    return ('type', 'msg_id', 'buf_id') + code.co_varnames[1:code.co_argcount]
+
 # Create a dictionary of message type to message class 
 
 MESSAGE_TYPE = {msg.type : msg for msg in [
@@ -322,6 +563,163 @@ MESSAGE_TYPE = {msg.type : msg for msg in [
     ]
 }
 
+for cls in MESSAGE_TYPE.values():
+    cls.schema = get_schema(cls)
+    cls.legacy_schema = tuple(key for key in cls.schema if key not in cls.extensions)
+
+# Snapshots
+
+def legacy_snapshot(text, runs):
+    """ Returns a buffer's text and a string with the peer character of each character,
+        which is the snapshot sent to clients without CAP_REVISIONS """
+    return (text, "".join(get_peer_char(peer_id) * length for peer_id, length in runs))
+
+def read_snapshot(snapshot):
+    """ Returns the (text, peer runs, revision, operations) of a snapshot in either form """
+    if len(snapshot) == 2:
+        text, peer_chars = snapshot
+        runs = [[get_peer_id_from_char(char), len(list(chars))] for char, chars in groupby(peer_chars)]
+        return text, runs, 0, []
+    return tuple(snapshot)
+
+# Binary encoding
+
+def write_varint(out, value):
+    """ Appends a signed integer to a bytearray as a zigzag-encoded varint """
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return
+
+def read_varint(data, i):
+    """ Returns the signed integer at `data[i]` and the index after it """
+    value, shift = 0, 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1 if not value & 1 else -((value + 1) >> 1)), i
+
+def write_ops(out, ops):
+    """ Appends a list of retain (int > 0), delete (int < 0) and insert (str) ops. Each
+        op is a varint of its size and a 2 bit tag, followed by the UTF-8 of inserts """
+    write_varint(out, len(ops))
+    for op in ops:
+        if isinstance(op, int):
+            write_varint(out, op * 4 if op > 0 else -op * 4 + 1)
+        else:
+            text = op.encode("utf-8")
+            write_varint(out, len(text) * 4 + 2)
+            out.extend(text)
+    return
+
+def read_ops(data, i):
+    count, i = read_varint(data, i)
+    ops = []
+    for _ in range(count):
+        value, i = read_varint(data, i)
+        size, tag = value >> 2, value & 3
+        if tag == 0:
+            ops.append(size)
+        elif tag == 1:
+            ops.append(-size)
+        else:
+            ops.append(bytes(data[i:i + size]).decode("utf-8"))
+            i += size
+    return ops, i
+
+def write_bytes(out, data):
+    write_varint(out, len(data))
+    out.extend(data)
+    return
+
+def read_bytes(data, i):
+    size, i = read_varint(data, i)
+    return bytes(data[i:i + size]), i + size
+
+def write_json(out, value):
+    write_bytes(out, json.dumps(value).encode("utf-8"))
+    return
+
+def read_json(data, i):
+    value, i = read_bytes(data, i)
+    return json.loads(value.decode("utf-8")), i
+
+def write_snapshots(out, buffers):
+    """ Appends a dict of buf_id to snapshot. Each snapshot is compressed, or the
+        bytes from when it was last compressed are used if it is a Snapshot """
+    write_varint(out, len(buffers))
+    for buf_id, snapshot in buffers.items():
+        write_varint(out, int(buf_id))
+        if not isinstance(snapshot, Snapshot):
+            snapshot = Snapshot(snapshot)
+        write_bytes(out, snapshot.compress())
+    return
+
+def read_snapshots(data, i):
+    count, i = read_varint(data, i)
+    buffers = {}
+    for _ in range(count):
+        buf_id, i = read_varint(data, i)
+        value, i = read_bytes(data, i)
+        buffers[buf_id] = json.loads(zlib.decompress(value).decode("utf-8"))
+    return buffers, i
+
+BINARY_KINDS = {
+    "int"       : (write_varint, read_varint),
+    "ops"       : (write_ops, read_ops),
+    "json"      : (write_json, read_json),
+    "snapshots" : (write_snapshots, read_snapshots),
+}
+
+class Snapshot(tuple):
+    """ A buffer's snapshot (see read_snapshot) to send in a MSG_SET_ALL or
+        MSG_RESET. It is sent as a list in JSON, and its compressed form is kept
+        so that sending it to more than one client only compresses it once """
+    def compress(self):
+        if not hasattr(self, "compressed"):
+            self.compressed = zlib.compress(json.dumps(self).encode("utf-8"))
+        return self.compressed
+
+class BinaryCodec(object):
+    """ Encodes and decodes one message type using the `binary` field list of its
+        class, which is looked up once when the codec is made """
+    def __init__(self, cls):
+        self.cls     = cls
+        self.names   = [name for name, kind in cls.binary]
+        self.writers = [BINARY_KINDS[kind][0] for name, kind in cls.binary]
+        self.readers = [BINARY_KINDS[kind][1] for name, kind in cls.binary]
+
+    def encode(self, msg):
+        data = msg.data
+        out = bytearray([self.cls.type])
+        write_varint(out, data["msg_id"])
+        write_varint(out, data["buf_id"])
+        write_varint(out, data["src_id"])
+        for name, write in zip(self.names, self.writers):
+            write(out, data[name])
+        return bytes(out)
+
+    def decode(self, data):
+        msg_id, i = read_varint(data, 1)
+        buf_id, i = read_varint(data, i)
+        src_id, i = read_varint(data, i)
+        args = []
+        for read in self.readers:
+            value, i = read(data, i)
+            args.append(value)
+        msg = self.cls(src_id, *args)
+        msg.set_msg_id(msg_id)
+        msg.set_buf_id(buf_id)
+        return msg
+
+BINARY_CODECS = {cls.type : BinaryCodec(cls) for cls in MESSAGE_TYPE.values() if cls.binary is not None}
+
 # Exceptions
 
 class EmptyMessageError(Exception):
@@ -7,36 +7,65 @@ except ImportError:
 
 from ..utils import *
 
-from ..ot.server import Server, MemoryBackend
+from ..ot.server import Server, MemoryBackend, HistoryTruncatedError
 from ..ot.text_operation import TextOperation, IncompatibleOperationError as OTError
+from ..ot.rope import Rope
+from ..ot.attribution import Attribution
+
+from .message import Snapshot, legacy_snapshot
 
 class ThreadedServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     pass
 
 class TextHandler(Server):
-    """ Class for handling Operational Transformation for each buffer """
-    def __init__(self):
-        # self.document = ""
+    """ Class for handling Operational Transformation for each buffer. Keyword
+        arguments are used to configure the MemoryBackend's history size. If
+        a backend is given, e.g. a FileBackend, the document is restored
+        from its history """
+    def __init__(self, backend=None, **history_options):
+        # self.document = Rope()
         # self.backend = MemoryBackend()
-        Server.__init__(self, "", MemoryBackend())
-
-        # Document relating to peer chars
-        self.peer_tag_doc = ""
-
-
-    def receive_message(self, message):
+        if backend is None:
+            backend = MemoryBackend(**history_options)
+        Server.__init__(self, Rope(), backend)
+
+        # Run-length index of which peer wrote each character
+        self.peer_tag_doc = Attribution()
+
+        # Snapshots made at the current revision, so they are only encoded once
+        self.snapshots = {}
+        self.snapshot_revision = None
+
+        self.restore()
+
+    def restore(self):
+        """ Rebuilds the document and peer tags from the backend's newest checkpoint
+            and the operations saved after it """
+        revision, document = self.backend.get_checkpoint()
+        if document is not None:
+            text, runs = document
+            self.document = Rope(text)
+            self.peer_tag_doc = Attribution(runs)
+        for user_id, op in self.backend.get_authored_operations(revision):
+            self.apply_operation(user_id, op)
+        return
+
+
+    def receive_message(self, message, canonical=True):
+        """ Applies the operation in a MSG_OPERATION and returns the message to send to
+            the other clients. `canonical` is passed on to `receive_operation` """
         
         # Apply to document
         
         try:
         
-            op = self.receive_operation(message["src_id"], message["revision"], TextOperation(message["operation"]))
+            op = self.receive_operation(message["src_id"], message["revision"], TextOperation(message["operation"], copy=False), canonical)
         
         # debug
         
         except OTError as err:
         
-            print(self.document, message["operation"])
+            print(str(self.document), message["operation"])
         
             raise err
 
@@ -49,35 +78,73 @@ class TextHandler(Server):
         
         message["operation"] = op.ops
 
-        # Apply to peer tags
-
-        peer_op = TextOperation([get_peer_char(message["src_id"]) * len(val) if isinstance(val, str) else val for val in op.ops])
-        self.peer_tag_doc = peer_op(self.peer_tag_doc)
-
         return message
 
-    def get_contents(self):
-        # return [self.document, self.get_client_ranges()]
-        return (self.document, self.peer_tag_doc)
+    def apply_operation(self, user_id, operation):
+        """ Applies an operation to the document and the peer tags """
+        Server.apply_operation(self, user_id, operation)
+        self.peer_tag_doc.apply(operation.ops, user_id)
+        return
+
+    def get_snapshot(self):
+        """ Returns the text and peer runs of the newest checkpoint, its revision and a
+            list of [user_id, ops] operations to apply after it, for clients with
+            CAP_REVISIONS """
+        return self.get_cached("snapshot", self.make_snapshot)
+
+    def make_snapshot(self):
+        revision, document = self.backend.get_checkpoint()
+        if document is None:
+            self.save_checkpoint()
+            revision, document = self.backend.get_checkpoint()
+        text, runs = document
+        operations = [[user_id, op.ops] for user_id, op in self.backend.get_authored_operations(revision)]
+        return Snapshot((text, runs, revision, operations))
+
+    def get_cached(self, key, make):
+        """ Returns the Snapshot made by `make` at the current revision, making it if
+            needed, so joins and resets at the same revision share its encoding """
+        if self.snapshot_revision != self.get_revision():
+            self.snapshots = {}
+            self.snapshot_revision = self.get_revision()
+        if key not in self.snapshots:
+            self.snapshots[key] = make()
+        return self.snapshots[key]
+
+    def get_legacy_contents(self):
+        """ Returns the document and a string with the peer character of each character,
+            for clients without CAP_REVISIONS """
+        return self.get_cached("legacy", self.make_legacy_contents)
+
+    def make_legacy_contents(self):
+        return Snapshot(legacy_snapshot(str(self.document), self.get_client_ranges()))
+
+    def get_operations_since(self, revision):
+        """ Returns a list of (user_id, operation) tuples that bring a client at `revision`
+            up to date, or None if they are no longer all in the history """
+        if revision is None or revision > self.get_revision():
+            return None
+        try:
+            return list(self.backend.get_authored_operations(revision))
+        except HistoryTruncatedError:
+            return None
+
+    def snapshot(self):
+        return (str(self.document), self.get_client_ranges())
 
     def get_client_ranges(self):
-        """ Converts the peer_tag_doc into pairs of tuples to be reconstructed by the client """
-        if len(self.peer_tag_doc) == 0:
-            return []
-        else:
-            data = []
-            p_char = self.peer_tag_doc[0]
-            count = 1
-            for char in self.peer_tag_doc[1:]:
-                if char != p_char:
-                    data.append((get_peer_id_from_char(p_char), int(count)))
-                    p_char = char
-                    count = 1
-                else:
-                    count += 1
-            if count > 0:
-                data.append((get_peer_id_from_char(p_char), int(count)))
-            return data
-
-    def clear_history(self):
-        self.backend = MemoryBackend()
\ No newline at end of file
+        """ Returns the peer_tag_doc as a list of [peer_id, length] runs to be reconstructed by the client """
+        return self.peer_tag_doc.runs()
+
+    def close(self):
+        """ Makes sure any saved history is written to disk """
+        self.backend.close()
+        return
+
+    def add_client(self, client_id):
+        """ Waits for a client to acknowledge operations from now on before evicting them """
+        self.backend.acknowledge(client_id, self.get_revision())
+
+    def remove_client(self, client_id):
+        """ Stops waiting for a client to acknowledge operations """
+        self.backend.remove_user(client_id)
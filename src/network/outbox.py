@@ -0,0 +1,146 @@
+"""
+    Server/outbox.py
+    ----------------
+
+    Each client connected to the server has an Outbox of messages waiting
+    to be sent to it, which is emptied by that client's own writer. This
+    means a client on a slow connection only holds up its own messages.
+
+    When the messages waiting for a client go over the high-water mark,
+    older cursor updates (MSG_SET_MARK and MSG_SELECT) that have been
+    replaced by newer ones from the same peer are dropped. If that isn't
+    enough the outbox refuses the message and the client is disconnected.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import deque
+from threading import Condition
+
+from .message import MESSAGE, MSG_SET_MARK, MSG_SELECT
+
+COALESCE_TYPES = (MSG_SET_MARK, MSG_SELECT)
+
+
+class Outbox(object):
+    """ Bounded queue of encoded messages for one client. `high_water` is the most
+        bytes that can be waiting (None for no limit), `notify` is called
+        whenever there is something new for the writer to do, `encode`
+        returns the bytes to send for a message and `batch` joins a list of
+        encoded messages to be sent in one write """
+    def __init__(self, high_water=None, notify=None, encode=MESSAGE.bytes, batch=b"".join):
+        self.high_water = high_water
+        self.notify     = notify
+        self.encode     = encode
+        self.batch      = batch
+        self.messages   = deque() # (message, bytes) tuples
+        self.nbytes     = 0
+        self.closed     = False
+        self.condition  = Condition()
+
+        # Metrics
+
+        self.peak_bytes    = 0
+        self.sent_messages = 0
+        self.sent_bytes    = 0
+        self.coalesced     = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def put(self, message):
+        """ Adds a message to the outbox. Returns False if the outbox is over its
+            high-water mark even after coalescing cursor updates """
+        data = self.encode(message)
+
+        with self.condition:
+
+            if self.closed:
+
+                return True
+
+            if self.is_full(len(data)):
+
+                self.coalesce(message)
+
+                if self.is_full(len(data)):
+
+                    return False
+
+            self.messages.append((message, data))
+            self.nbytes += len(data)
+            self.peak_bytes = max(self.peak_bytes, self.nbytes)
+            self.condition.notify()
+
+        if self.notify is not None:
+
+            self.notify()
+
+        return True
+
+    def is_full(self, size):
+        """ True if adding `size` bytes would go over the high-water mark. A single
+            message is always accepted by an empty outbox, however big it is """
+        return self.high_water is not None and len(self.messages) > 0 and self.nbytes + size > self.high_water
+
+    def coalesce(self, message):
+        """ Removes cursor updates that are followed by a newer one from the same peer,
+            including `message` itself """
+        seen = set()
+        if isinstance(message, COALESCE_TYPES):
+            seen.add((message.type, message["src_id"]))
+        kept = deque()
+        for item in reversed(self.messages):
+            queued = item[0]
+            if isinstance(queued, COALESCE_TYPES):
+                key = (queued.type, queued["src_id"])
+                if key in seen:
+                    self.nbytes -= len(item[1])
+                    self.coalesced += 1
+                    continue
+                seen.add(key)
+            kept.appendleft(item)
+        self.messages = kept
+        return
+
+    def get(self, timeout=None):
+        """ Returns all of the waiting messages joined together as bytes, waiting up
+            to `timeout` seconds for a message if there are none. Returns an empty
+            string if there is nothing to send """
+        with self.condition:
+
+            if not self.messages and not self.closed:
+
+                self.condition.wait(timeout)
+
+            data = self.batch([item[1] for item in self.messages]) if self.messages else b""
+
+            self.sent_messages += len(self.messages)
+            self.sent_bytes += len(data)
+
+            self.messages.clear()
+            self.nbytes = 0
+
+        return data
+
+    def close(self):
+        """ Stops accepting messages. The writer should send what is left and stop """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.notify is not None:
+            self.notify()
+        return
+
+    def metrics(self):
+        """ Returns a dict describing the client's backlog and what has been sent """
+        with self.condition:
+            return {
+                "queued_messages" : len(self.messages),
+                "queued_bytes"    : self.nbytes,
+                "peak_bytes"      : self.peak_bytes,
+                "sent_messages"   : self.sent_messages,
+                "sent_bytes"      : self.sent_bytes,
+                "coalesced"       : self.coalesced,
+            }
@@ -34,7 +34,7 @@ class Receiver:
         self.running = False
         self.bytes = 2048
 
-        self.reader = NetworkMessageReader()
+        self.reader = FrameReader() if client.send.framed else NetworkMessageReader()
 
         # Information about other clients
 
@@ -13,6 +13,7 @@ from ..config import *
 from ..utils import *
 
 import socket
+import struct
 from hashlib import md5
 
 class Sender:
@@ -32,6 +33,8 @@ class Sender:
         self.conn      = None
         self.conn_id   = None
         self.connected = False
+        self.framed    = False
+        self.capabilities = 0
         self.connection_errors = {
             ERR_LOGIN_FAIL : "Login attempt failed",
             ERR_MAX_LOGINS : "Failed to connect: Maximum number of users connected. Please try again later.",
@@ -40,11 +43,17 @@ class Sender:
 
         self.ui        = None
 
-    def connect(self, hostname, port=57890, username="", using_ipv6=False, password=""):
+    def connect(self, hostname, port=57890, username="", using_ipv6=False, password="", framed=True):
         """ Connects to the master Troop server and
-            start a listening instance on this machine """
+            start a listening instance on this machine. If `framed`
+            is True we start with a handshake and messages are sent
+            as frames using the capabilities the server shares with
+            us, otherwise as <...> strings. Servers that don't know
+            the handshake are connected to again without it """
         if not self.connected:
 
+            self.framed = framed
+
             # Get details of remote
             self.hostname = hostname
             self.port     = int(port)
@@ -80,9 +89,34 @@ class Sender:
 
             self.conn_msg = MSG_PASSWORD(-1, md5(password.encode("utf-8")).hexdigest(), self.name)
 
+            # Starting with the handshake tells the server we are sending frames
+
+            self.capabilities = 0
+
+            if self.framed:
+
+                self.conn.sendall(handshake())
+
             self.send( self.conn_msg )
 
-            self.conn_id   = int(self.conn.recv(4)) # careful here
+            try:
+
+                self.conn_id = int(self.recv(4)) # careful here
+
+                if self.framed:
+
+                    self.capabilities, = HANDSHAKE_REPLY.unpack(self.recv(HANDSHAKE_REPLY.size))
+
+            except (ValueError, struct.error, socket.error):
+
+                if not self.framed:
+
+                    raise
+
+                self.conn.close()
+
+                return self.connect(hostname, port, username, using_ipv6, password, framed=False)
+
             self.connected = bool(self.conn_id >= 0)
             
         return self
@@ -90,14 +124,45 @@ class Sender:
     def send(self, message):
         return self.__call__(message)
 
+    def send_batch(self, messages):
+        """ Sends a list of messages to the server in one write """
+        data = [self.encode(message) for message in messages]
+        if self.capabilities & CAP_BATCH:
+            return self.write(batch_frames(data))
+        else:
+            return self.write(b"".join(data))
+
+    def encode(self, message):
+        """ Returns a message encoded the way the server expects """
+        if not self.framed:
+            return message.bytes()
+        elif self.capabilities & (CAP_BINARY | CAP_COMPRESS):
+            return message.pack(self.capabilities)
+        else:
+            return message.frame()
+
+    def recv(self, size):
+        """ Reads exactly `size` bytes from the server, or fewer if the connection closes """
+        data = b""
+        while len(data) < size:
+            chunk = self.conn.recv(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
     def error_message(self):
         return self.connection_errors.get(self.conn_id, "Connected successfully")
 
     def __call__(self, message):
+        """ Send a message to the server """
+        return self.write(self.encode(message))
+
+    def write(self, data):
         """ Send data to the server """
         try:
 
-            self.conn.sendall(message.bytes())
+            self.conn.sendall(data)
 
         except Exception as e:
 
@@ -10,6 +10,7 @@ try:
 except:
     import Queue as queue
 
+import errno
 import socket
 import sys
 import time
@@ -17,13 +18,18 @@ import os.path
 import json
 
 from datetime import datetime
+from functools import partial
 from time import sleep
 from getpass import getpass
 from hashlib import md5
 from threading import Thread
 
-from .network_utils import ThreadedServer, TextHandler
+from .network_utils import ThreadedServer, TextHandler, HistoryTruncatedError
+from ..ot.file_backend import FileBackend
+from ..ot.text_operation import TextOperation
 from .message import *
+from .outbox import Outbox
+from .workers import BufferWorker, Dispatcher
 
 from ..config import *
 from ..utils import *
@@ -33,14 +39,54 @@ class PolyServer(ThreadedServer):
     """
         This the master Server instance. Other peers on the
         network connect to it and send their keypress information
-        to the server, which then sends it on to the others
+        to the server, which then sends it on to the others.
+
+        Each buffer keeps at most `history_length` operations (or
+        `history_bytes` bytes of operations) plus a checkpoint of the
+        document every `checkpoint_interval` operations. Use None for
+        no limit. If `history_dir` is given, each buffer's history is also
+        saved to a log file in that directory and the documents are
+        restored from it when the server is restarted.
+
+        With `engine="threads"` each client is handled by its own thread.
+        With `engine="asyncio"` (Python 3 only) all clients are handled by
+        one event loop running in a single thread.
+
+        Messages for each client wait in its own outbox until its writer
+        can send them. If more than `outbox_size` bytes are waiting, older
+        cursor updates are dropped and then the client is disconnected.
+
+        Operations and cursor updates for each buffer are handled by a
+        worker for that buffer, so busy buffers don't hold up the others.
+        Each worker sends on only the newest cursor update from each client
+        every `cursor_interval` seconds (use None to send every update).
     """
     bytes  = 2048
-    def __init__(self, password="", port=57890, log=False, debug=False):
+    def __init__(self, password="", port=57890, log=False, debug=False, history_length=1024, history_bytes=1048576, checkpoint_interval=256, history_dir=None, engine="threads", outbox_size=4194304, cursor_interval=0.016):
 
         # Dict of IDs to OTServer instances
 
-        self.buffers = {i : TextHandler() for i in DEFAULT_INTERPRETERS}
+        history_options = {
+            "max_operations"      : history_length,
+            "max_bytes"           : history_bytes,
+            "checkpoint_interval" : checkpoint_interval
+        }
+
+        if history_dir is None:
+
+            self.buffers = {i : TextHandler(**history_options) for i in DEFAULT_INTERPRETERS}
+
+        else:
+
+            if not os.path.isdir(history_dir):
+
+                os.makedirs(history_dir)
+
+            self.buffers = {i : TextHandler(FileBackend(os.path.join(history_dir, "buffer-{}.log".format(i)), **history_options)) for i in DEFAULT_INTERPRETERS}
+
+        # Most bytes that can be waiting to be sent to one client
+
+        self.outbox_size = outbox_size
 
         # Dict of IDs to first user to connect using that language
 
@@ -67,13 +113,27 @@ class PolyServer(ThreadedServer):
 
             pass
 
-        ThreadedServer.__init__(self, (self.ip_addr, self.port), RequestHandler)
+        # The asyncio engine opens its own listening socket
+
+        if engine == "asyncio":
+
+            from .async_server import AsyncEngine
+
+            self.async_engine = AsyncEngine(self)
+
+        elif engine == "threads":
+
+            self.async_engine = None
+
+        else:
+
+            raise ValueError("Unknown server engine: {!r}".format(engine))
+
+        ThreadedServer.__init__(self, (self.ip_addr, self.port), RequestHandler, bind_and_activate=self.async_engine is None)
 
         # Reference to the thread that is listening for new connections
         self.server_thread = Thread(target=self.serve_forever)
 
-        self.waiting_for_ack = False # Flagged True after new connected client
-
         # self.text_constraint = MSG_CONSTRAINT(-1, 0) # default
         
         # Dict of IDs to Client instances
@@ -96,6 +156,11 @@ class PolyServer(ThreadedServer):
         self.msg_queue = queue.Queue()
         self.msg_queue_thread = Thread(target=self.update_send)
 
+        # Messages for each buffer are passed on to that buffer's worker
+        self.cursor_interval = cursor_interval
+        self.workers = {i : BufferWorker(self, i, cursor_interval) for i in self.buffers}
+        self.dispatcher = Dispatcher(self, self.workers)
+
         # Set up log for logging a performance
 
         if log:
@@ -133,33 +198,17 @@ class PolyServer(ThreadedServer):
         """ Returns the client instance based on the id  """
         return self.clients[client_id]
 
+    def get_client_metrics(self):
+        """ Returns a dict of client id to a dict of outbox metrics, e.g. the number of
+            bytes waiting to be sent """
+        return { int(client.id): client.outbox.metrics() for client in list(self.clients.values()) }
+
     def get_client_locs(self):
         return { int(client.id): (int(client.buf_id), int(client.index)) for client in list(self.clients.values()) }
 
     # def get_text_constraint(self):
     #     return self.text_constraint
 
-    def get_contents(self):
-        """ Returns a list with 2 items: dict of buffer index and contents (doc and peer_doc), and
-            dict of client index and buf_id/index """
-        return [{int(index): buf.get_contents() for index, buf in self.buffers.items()}, self.get_client_locs()]
-
-    def update_all_clients(self):
-        """ Sends a reset message with the contents from the server to make sure new user starts the  same  """
-
-        msg = MSG_RESET(-1, *self.get_contents())
-
-        for client in list(self.clients.values()):
-
-            # Tell other clients about the new connection
-
-            if client.connected:
-
-                client.send(msg)
-                # client.send(self.get_text_constraint())
-
-        return
-
     def update_language_leaders(self, client):
         """ Update the language leaders dict and send a message to the client """
 
@@ -196,16 +245,141 @@ class PolyServer(ThreadedServer):
 
         text = self.buffers[message["buf_id"]]
 
-        new_message = text.receive_message(message)
+        # Clients without CAP_REVISIONS number their operations from their last snapshot
+
+        client = self.clients[message["src_id"]]
+
+        base = client.revision_base.get(int(message["buf_id"]))
+
+        if base:
+
+            message["revision"] += base
+
+        # Clients with CAP_REVISIONS transform without reordering inserts, so their operations
+        # can be transformed against the composed history in one go
+
+        canonical = not client.handler.capabilities & CAP_REVISIONS
+
+        try:
+
+            new_message = text.receive_message(message, canonical)
+
+        except HistoryTruncatedError:
+
+            # The client is too far behind for its operation to be transformed, so
+            # drop it and send the client the document as it is now
+
+            self.resync_client(message["src_id"], message["buf_id"])
+
+            return
 
         if new_message is not None:
 
-            # Get location of peer
+            # Move the other clients' cursors in this buffer through the operation
+
+            operation = TextOperation(message["operation"], copy=False)
+
+            others = [client for client in list(self.clients.values()) if client.id != message["src_id"] and client.buf_id == int(message["buf_id"])]
+
+            indices = operation.transform_indices([client.get_index() for client in others])
+
+            for client, index in zip(others, indices):
+
+                client.set_index(message["buf_id"], index)
+
+            # Move the author's cursor too, after any text it inserted at its location
+
             client = self.clients[message["src_id"]]
-            client.set_index(message["buf_id"], get_operation_index(message["operation"]))
+            client.set_index(message["buf_id"], operation.transform_index(client.get_index(), bias=1))
 
         return new_message
 
+    def join_client(self, client_id, revisions=None):
+        """ Adds a new client to the session. This is a session-wide message so every
+            buffer is up to date: the other clients are told about the new one and it
+            is sent a snapshot of each buffer, which the following operations apply
+            to. Nothing is sent to the other clients' buffers.
+
+            A reconnecting client can give the last revision it saw in each buffer as
+            `revisions`, counted from the last snapshot it was sent, and is only sent
+            the operations since then, if the server still has them, instead of a
+            snapshot """
+
+        client = self.clients.get(client_id)
+
+        if client is None or client.connected or client.outbox.closed:
+
+            return
+
+        self.update_language_leaders(client)
+
+        client.handler.connect_clients(client)
+
+        if not client.handler.capabilities & CAP_DELTA:
+
+            revisions = None
+
+        revisions = revisions or {}
+
+        buffers = {}
+
+        for buf_id, buf in self.buffers.items():
+
+            # Get the operations before the client's acknowledgement is moved on and they can be evicted
+
+            revision = revisions.get(int(buf_id))
+
+            base = client.revision_base.get(int(buf_id))
+
+            if revision is None or base is None:
+
+                operations = None
+
+            else:
+
+                operations = buf.get_operations_since(revision + base)
+
+            buf.add_client(client.id)
+
+            if operations is None:
+
+                buffers[int(buf_id)] = self.get_snapshot(client, buf_id)
+
+                continue
+
+            # Send the missing operations as if they had just been made
+
+            for i, (user_id, operation) in enumerate(operations):
+
+                msg = MSG_OPERATION(user_id, operation.ops, revision + i)
+
+                msg.set_buf_id(buf_id)
+
+                client.send(msg)
+
+        client.send(MSG_SET_ALL(-1, buffers, self.get_client_locs()))
+
+        client.connected = True
+
+        return
+
+    def resync_client(self, client_id, buf_id):
+        """ Sends a client the current contents of a buffer """
+        client = self.clients[client_id]
+        client.send(MSG_SET_ALL(-1, {int(buf_id): self.get_snapshot(client, buf_id)}, self.get_client_locs()))
+        return
+
+    def get_snapshot(self, client, buf_id):
+        """ Returns the snapshot of a buffer to send to a client. Clients without
+            CAP_REVISIONS are sent the document as it is now and number their
+            operations from its revision, which is kept to translate them """
+        buf = self.buffers[buf_id]
+        if client.handler.capabilities & CAP_REVISIONS:
+            client.revision_base[int(buf_id)] = 0
+            return buf.get_snapshot()
+        client.revision_base[int(buf_id)] = buf.get_revision()
+        return buf.get_legacy_contents()
+
     def handle_set_mark(self, message):
         """ Handles a new MSG_SET_MARK by updating the client model's index """
         client = self.clients[message["src_id"]]
@@ -220,9 +394,7 @@ class PolyServer(ThreadedServer):
 
     def start(self):
 
-        self.running = True
-        self.server_thread.start()
-        self.msg_queue_thread.start()
+        self.listen()
 
         stdout("Server running @ {} on port {}\n".format(self.ip_pub, self.port))
 
@@ -241,6 +413,23 @@ class PolyServer(ThreadedServer):
                 break
         return
 
+    def listen(self):
+        """ Starts accepting connections and handling messages in the background
+            and returns. Use `kill` to stop """
+
+        self.running = True
+
+        if self.async_engine is not None:
+
+            self.async_engine.start()
+
+        else:
+
+            self.server_thread.start()
+            self.msg_queue_thread.start()
+
+        return
+
     def get_next_id(self):
         """ Increases the ID counter and returns it. If it goes over the maximum number allowed, it tries to go to back to the start and 
             checks if that client is connected. If all clients are connected, it returns -1, signalling the client to terminate """
@@ -254,53 +443,6 @@ class PolyServer(ThreadedServer):
                 return ERR_MAX_LOGINS # error message for max clients exceeded                   
         return self.last_id
 
-    def clear_history(self):
-        """ Removes revision history - make sure clients' revision numbers reset """
-        for buf in self.buffers.values():
-            buf.clear_history()
-        self.msg_queue = queue.Queue()
-        return
-
-    def wait_for_ack(self, flag):
-        """ Sets flag to disregard messages that are not MSG_CONNECT_ACK until all clients have responded """
-        if flag == True:
-        
-            self.waiting_for_ack = True
-            self.acknowledged_clients = []
-
-        for client in list(self.clients.values()):
-
-            if client.connected:
-
-                client.send(MSG_REQUEST_ACK(-1, int(flag)))
-
-        return
-
-    def connect_ack(self, message):
-        """ Handle response from clients confirming the new connected client """
-        
-        client_id = message["src_id"]
-        
-        self.acknowledged_clients.append(client_id)
-
-        # When we have all clients acknowledged, stop waiting
-        
-        if all([client_id in self.acknowledged_clients for client_id in self.connected_clients()]):
-
-            # Send set_text to all to reset the text
-
-            self.update_all_clients()
-
-            # Stop waiting
-        
-            self.waiting_for_ack = False
-            
-            self.acknowledged_clients = []
-            
-            self.wait_for_ack(False)
-        
-        return
-
     def connected_clients(self):
         """ Returns a list of all the connected clients_id's """
         return (client_id for client_id, client in self.clients.items() if client.connected)
@@ -315,46 +457,77 @@ class PolyServer(ThreadedServer):
         return conf['host'], int(conf['port'])
 
     def update_send(self):
-        """ This continually sends any operations to clients
+        """ This continually passes messages from the queue on to the buffer workers
         """
 
+        for worker in self.workers.values():
+
+            worker.start()
+
         while self.running:
 
+            # Block until there is a message, waking up now and then to check we are still running
+
             try:
 
-                msg = self.msg_queue.get_nowait()
+                msg = self.msg_queue.get(timeout=0.5)
 
-                # If logging is set to true, store the message info
+            except queue.Empty:
 
-                if self.is_logging:
+                continue
 
-                    self.log_file.write("%.4f" % time.clock() + " " + repr(str(msg)) + "\n")
+            # An error in a session-wide message is handled here, so it doesn't stop the thread
 
-                # Store the response of the messages
-                
-                if isinstance(msg, MSG_OPERATION):
+            try:
 
-                    msg = self.handle_operation(msg)
+                self.dispatcher.dispatch(msg)
 
-                elif isinstance(msg, MSG_SET_MARK):
+            except Exception as e:
 
-                    msg = self.handle_set_mark(msg)
+                stdout("Error processing message {}: {}".format(msg, e))
 
-                # elif isinstance(msg, MSG_CONSTRAINT):
+        return
 
-                #     self.text_constraint = msg
+    def process_message(self, msg):
+        """ Handles a message taken from the queue and sends the response to the clients """
 
-                self.respond(msg)
+        # If logging is set to true, store the message info
 
-            except queue.Empty:
+        if self.is_logging:
 
-                sleep(0.01)
+            self.log_file.write("%.4f" % time.clock() + " " + repr(str(msg)) + "\n")
+
+        # Store the response of the messages
+        
+        if isinstance(msg, MSG_OPERATION):
+
+            msg = self.handle_operation(msg)
+
+        elif isinstance(msg, MSG_SET_MARK):
+
+            msg = self.handle_set_mark(msg)
+
+        elif isinstance(msg, MSG_CONNECT):
+
+            msg = self.join_client(msg["src_id"], msg["revisions"])
+
+        elif isinstance(msg, MSG_REMOVE):
+
+            msg = self.leave_client(msg)
+
+        # elif isinstance(msg, MSG_CONSTRAINT):
+
+        #     self.text_constraint = msg
+
+        self.respond(msg)
 
         return
 
     def respond(self, msg):
         """ Update all clients with a message. Only sends back messages to
-            a client if the `reply` flag is nonzero. """
+            a client if the `reply` flag is nonzero. The message is encoded
+            once for each framing and the same bytes are queued for every
+            client using it: no fields differ between recipients. """
 
         if msg is None:
 
@@ -368,11 +541,9 @@ class PolyServer(ThreadedServer):
 
                     # Send to all other clients and the sender if "reply" flag is true
 
-                    if not self.waiting_for_ack:
+                    if (client.id != msg['src_id']) or ('reply' not in msg.data) or (msg['reply'] == 1):
 
-                        if (client.id != msg['src_id']) or ('reply' not in msg.data) or (msg['reply'] == 1):
-
-                            client.send(msg)
+                        client.send(msg)
 
                 except DeadClientError as err:
 
@@ -392,20 +563,65 @@ class PolyServer(ThreadedServer):
 
             self.clients[client_id].disconnect()
 
-        # Notify other clients
-
-        for client in list(self.clients.values()):
+        # The other clients are told once the messages before this have been handled
 
-            if client.connected:
-                   
-                client.send(MSG_REMOVE(client_id))
+        self.msg_queue.put_nowait(MSG_REMOVE(client_id))
 
         return
+
+    def leave_client(self, msg):
+        """ Stops the buffers waiting for a client that has disconnected to acknowledge
+            operations, and returns the message to tell the other clients. The operations
+            since each buffer's newest checkpoint are always kept, so a client that
+            reconnects soon is still only sent what it missed """
+
+        client = self.clients.get(msg["src_id"])
+
+        if client is None or client.connected:
+
+            return
+
+        for buf in self.buffers.values():
+
+            buf.remove_client(client.id)
+
+        return msg
         
     def kill(self):
         """ Properly terminates the server """
         if self.log_file is not None: self.log_file.close()
 
+        if self.async_engine is not None:
+
+            self.async_engine.call(self.disconnect_all)
+
+        else:
+
+            self.disconnect_all()
+
+        sleep(0.5)
+        
+        self.running = False
+
+        if self.async_engine is not None:
+
+            self.async_engine.stop()
+
+        else:
+
+            self.shutdown()
+
+        self.server_close()
+
+        for buf in self.buffers.values():
+
+            buf.close()
+        
+        return
+
+    def disconnect_all(self):
+        """ Tells every client the server is closing and disconnects them """
+
         outgoing = MSG_KILL(-1, "Warning: Server manually killed by keyboard interrupt. Please close the application")
 
         for client in list(self.clients.values()):
@@ -416,12 +632,6 @@ class PolyServer(ThreadedServer):
 
                 client.force_disconnect()
 
-        sleep(0.5)
-        
-        self.running = False
-        self.shutdown()
-        self.server_close()
-        
         return
 
     def write(self, string):
@@ -443,6 +653,7 @@ class PolyServer(ThreadedServer):
 class RequestHandler(socketserver.BaseRequestHandler):
     name = None
     client_name = ""
+    capabilities = 0
 
     def client(self):        
         return self.get_client(self.get_client_id())
@@ -504,19 +715,57 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
             self.client_id = ERR_LOGIN_FAIL
 
-        # Send back the user_id as a 4 digit number
+        # Send back the user_id as a 4 digit number, followed by the capabilities
+        # we share if the client started with a handshake
 
         reply = "{:04d}".format( self.client_id ).encode()
 
+        if isinstance(self.reader, FrameReader):
+
+            self.capabilities = shared_capabilities(self.reader.capabilities)
+
+            reply += HANDSHAKE_REPLY.pack(self.capabilities)
+
         self.request.send(reply)
 
         return self.client_id
 
+    def refuse(self, error):
+        """ Closes a connection that started with a handshake we can't use, such as one
+            for another protocol version. The client then logs in again without it """
+        stdout("Refused connection from {}: {}".format(self.client_address[0], error))
+        return
+
     def get_message(self):
         data = self.request.recv(self.server.bytes)
-        data = self.reader.feed(data)
+        data = self.read(data)
         return data
 
+    def read(self, data):
+        """ Returns the messages in data read from the client. The first data read
+            decides whether the client is sending frames or <...> messages """
+        if self.reader is None:
+            if data[:1] == FRAME_MAGIC[:1]:
+                self.reader = FrameReader(handshake=True)
+            else:
+                self.reader = NetworkMessageReader()
+        return self.reader.feed(data)
+
+    def get_encoder(self):
+        """ Returns the function used to encode messages sent to this client """
+        if not isinstance(self.reader, FrameReader):
+            return MESSAGE.bytes
+        elif self.capabilities & (CAP_BINARY | CAP_COMPRESS):
+            return partial(MESSAGE.pack, capabilities=self.capabilities)
+        else:
+            return MESSAGE.frame
+
+    def get_batcher(self):
+        """ Returns the function used to join messages that are sent to this client in one write """
+        if self.capabilities & CAP_BATCH:
+            return batch_frames
+        return b"".join
+
     def handle_client_lost(self, verbose=True):
         """ Terminates cleanly """
         if verbose:
@@ -525,27 +774,39 @@ class RequestHandler(socketserver.BaseRequestHandler):
         return
 
     def handle_connect(self, msg):
-        """ Stores information about the new client. Wait for acknowledgement from all connected peers before continuing processing messages """
+        """ Stores information about the new client. It isn't sent any messages until the
+            messages already in the queue have been handled and it has joined the session """
         assert isinstance(msg, MSG_CONNECT)
 
         # Create the client and connect to other clients
 
         if self.client_address not in list(self.server.clients.values()):
 
-            new_client = Client(self, name=msg['name'], lang_choices=msg['lang_choices']) # decide leader? TODO
+            old_client = self.server.clients.get(self.client_id)
+
+            new_client = self.create_client(name=msg['name'], lang_choices=msg['lang_choices']) # decide leader? TODO
 
-            self.server.update_language_leaders(new_client)
+            # A re-connecting user's revisions are counted from the snapshots sent to it before
+
+            if old_client is not None:
+
+                new_client.revision_base = old_client.revision_base
+
+            new_client.connected = False
 
             self.client_name = new_client.name
-           
-            self.connect_clients(new_client) # Contacts other clients
 
-            # Don't accept more messages while connecting
+            self.server.clients[new_client.id] = new_client
 
-            self.server.wait_for_ack(True)
+            # Joins the session when the message is processed by the server
+
+            self.server.msg_queue.put_nowait(msg)
            
             return new_client
 
+    def create_client(self, name, lang_choices):
+        return Client(self, name=name, lang_choices=lang_choices)
+
     def leader(self):
         """ Returns the peer client that is "leading" """
         return self.server.leader()
@@ -556,16 +817,29 @@ class RequestHandler(socketserver.BaseRequestHandler):
             self.client_address = (address, port)
         """
 
-        # This takes strings read from the socket and returns json objects
+        # This takes strings read from the socket and returns json objects. It is
+        # created when the first data is read, depending on the client's framing
 
-        self.reader = NetworkMessageReader()
+        self.reader = None
         
         # self.messages  = []
         # self.msg_count = 0
 
-        # Password test
+        # Password test, which may be split over more than one read
+
+        try:
 
-        packet = self.get_message()
+            packet = self.get_message()
+
+            while len(packet) == 0:
+
+                packet = self.get_message()
+
+        except ConnectionError as e:
+
+            self.refuse(e)
+
+            return
 
         if self.authenticate(packet) < 0:
 
@@ -595,27 +869,32 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
                 break
 
-            for msg in packet:
+            self.handle_packet(packet)
 
-                if isinstance(msg, MSG_CONNECT):
+        return
+
+    def handle_packet(self, packet):
+        """ Handles connection messages and adds any other messages to the send queue """
 
-                    # Add the new client
+        for msg in packet:
 
-                    new_client = self.handle_connect(msg)
+            if isinstance(msg, MSG_CONNECT):
 
-                    # Clear server history
+                # Add the new client
 
-                    self.server.clear_history()
+                new_client = self.handle_connect(msg)
 
-                elif self.server.waiting_for_ack and isinstance(msg, MSG_CONNECT_ACK):
+            elif isinstance(msg, MSG_CONNECT_ACK):
 
-                    self.server.connect_ack(msg)
+                # Older clients acknowledge new connections but the server no longer waits for them
 
-                elif not self.server.waiting_for_ack:
+                continue
+
+            else:
 
-                    # Add any other messages to the send queue
+                # Add any other messages to the send queue
 
-                    self.server.msg_queue.put(msg)
+                self.server.msg_queue.put_nowait(msg)
 
         return
 
@@ -670,16 +949,15 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
         return
 
-    def update_client(self):
-        """ Send all the previous operations to the client to keep it up to date """
+# Keeps information about each connected client
 
-        client = self.client()
-        client.send(MSG_SET_ALL(-1, *self.server.get_contents()))
-        # client.send(self.server.get_text_constraint())
+# Errors from writing to a socket that has been closed at either end
 
-        return
-    
-# Keeps information about each connected client
+CLOSED_ERRNOS = (errno.EBADF, errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED, errno.ENOTCONN, errno.ESHUTDOWN)
+
+def is_closed_error(error):
+    """ Returns True if a socket error means that the connection was closed """
+    return isinstance(error, (socket.error, OSError)) and getattr(error, "errno", None) in CLOSED_ERRNOS
 
 class Client:
     bytes = PolyServer.bytes
@@ -712,9 +990,59 @@ class Client:
 
         self.messages = []
 
+        # Revision of each buffer that the client numbers its operations from: when it
+        # was last sent a snapshot of it, or 0 with CAP_REVISIONS
+
+        self.revision_base = {}
+
+        # Messages waiting to be sent, which are written by another thread
+
+        self.outbox = Outbox(self.handler.server.outbox_size, encode=self.handler.get_encoder(), batch=self.handler.get_batcher())
+
+        self.start_sender()
+
+    def start_sender(self):
+        self.sender = Thread(target=self.send_loop)
+        self.sender.daemon = True
+        self.sender.start()
+        return
+
+    def send_loop(self):
+        """ Writes messages from the outbox to the socket until the client disconnects,
+            then closes the socket """
+        while not (self.outbox.closed and len(self.outbox) == 0):
+            data = self.outbox.get(timeout=0.5)
+            if len(data):
+                try:
+                    self.source.sendall(data)
+                except Exception as e:
+                    self.report_send_error(e)
+                    self.outbox.close()
+                    break
+        self.abort()
+        return
+
+    def report_send_error(self, error):
+        """ Prints an error from writing to the client unless it is just the connection
+            being closed by the client or the server """
+        if self.connected and not is_closed_error(error):
+            stdout("Error sending to client {}: {}".format(self.id, error))
+        return
+
+    def abort(self):
+        """ Closes the socket without waiting for messages to be sent """
+        try:
+            self.source.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        self.source.close()
+        return
+
     def disconnect(self):
+        """ Stops accepting messages. The socket is closed once the messages already
+            in the outbox have been sent """
         self.connected = False
-        self.source.close()
+        self.outbox.close()
 
     def connect(self, socket):
         self.connected = True
@@ -735,10 +1063,12 @@ class Client:
         return repr(self.address)
 
     def send(self, message):
-        try:
-            self.source.sendall(message.bytes())
-        except Exception as e:
-            print(e)
+        """ Adds a message to the outbox. Raises DeadClientError if the client is so
+            far behind that its outbox is full """
+        if not self.outbox.put(message):
+            stdout("Client '{}' is not reading messages fast enough".format(self.name))
+            self.outbox.close()
+            self.abort()
             raise DeadClientError(self.hostname)
         return
 
@@ -754,4 +1084,3 @@ class Client:
         #return self.address != other
         #return self.hostname != other
         return (self.hostname, self.name) != other
-
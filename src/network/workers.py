@@ -0,0 +1,175 @@
+"""
+    Server/workers.py
+    -----------------
+
+    The server handles the messages for each buffer in its own worker so that
+    a burst of operations in one buffer doesn't hold up the others. Messages
+    for one buffer are handled in the order they arrive. Messages that affect
+    the whole session wait for every worker to finish before being handled.
+
+    Cursor updates (MSG_SET_MARK and MSG_SELECT) are held by the worker for
+    up to `cursor_interval` seconds and only the newest from each client is
+    sent on. Any other message sends the held updates first, so operations
+    and cursor updates are never reordered.
+
+"""
+
+from __future__ import absolute_import
+
+try:
+    import queue
+except:
+    import Queue as queue
+
+from collections import OrderedDict
+from threading import Thread
+from time import time
+
+from .message import MSG_OPERATION, MSG_SET_MARK, MSG_SELECT
+from .outbox import COALESCE_TYPES
+from ..config import stdout
+
+BUFFER_TYPES = (MSG_OPERATION, MSG_SET_MARK, MSG_SELECT)
+
+
+def get_worker_id(msg, workers):
+    """ Returns the buffer id of the worker that should handle `msg`, or None if
+        it is a message for the whole session """
+    if isinstance(msg, BUFFER_TYPES) and msg["buf_id"] in workers:
+        return msg["buf_id"]
+    return None
+
+
+class BufferWorker(object):
+    """ Handles the messages for one buffer in its own thread """
+    def __init__(self, server, buf_id, cursor_interval=None):
+        self.server = server
+        self.buf_id = buf_id
+        self.queue  = queue.Queue()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+
+        # Cursor updates waiting to be sent, by (type, client id)
+
+        self.cursor_interval = cursor_interval
+        self.held     = OrderedDict()
+        self.deadline = None
+        self.coalesced = 0
+
+    def start(self):
+        self.thread.start()
+        return
+
+    def put(self, msg):
+        self.queue.put_nowait(msg)
+        return
+
+    def join(self):
+        """ Blocks until every message given to the worker has been handled """
+        self.queue.join()
+        return
+
+    def run(self):
+        while self.server.running:
+            try:
+                msg = self.queue.get(timeout=self.get_timeout())
+            except queue.Empty:
+                self.flush()
+                continue
+            self.handle(msg)
+        return
+
+    def get_timeout(self):
+        """ Returns how long to wait for the next message before sending held cursor updates """
+        if self.deadline is None:
+            return 0.5
+        return max(0, self.deadline - time())
+
+    def handle(self, msg):
+        """ Holds on to cursor updates and processes any other message, after first
+            sending the held updates """
+        if self.cursor_interval and isinstance(msg, COALESCE_TYPES):
+            self.hold(msg)
+        else:
+            self.flush()
+            self.process(msg)
+        if self.deadline is not None and time() >= self.deadline:
+            self.flush()
+        return
+
+    def hold(self, msg):
+        """ Keeps a cursor update to be sent later, replacing an older one from the
+            same client. A held message isn't marked as done until it is sent or
+            replaced, so `join` waits for it """
+        key = (msg.type, msg["src_id"])
+        if key in self.held:
+            del self.held[key]
+            self.queue.task_done()
+            self.coalesced += 1
+        self.held[key] = msg
+        if self.deadline is None:
+            self.deadline = time() + self.cursor_interval
+        return
+
+    def flush(self):
+        """ Sends the held cursor updates """
+        while len(self.held):
+            key, msg = self.held.popitem(last=False)
+            self.process(msg)
+        self.deadline = None
+        return
+
+    def process(self, msg):
+        try:
+            self.server.process_message(msg)
+        except Exception as e:
+            stdout("Error processing message {}: {}".format(msg, e))
+        finally:
+            self.queue.task_done()
+        return
+
+
+class Dispatcher(object):
+    """ Passes messages on to a worker for each buffer. A client's messages stay in
+        order because a message for a different buffer to the client's last one
+        waits for that buffer's worker to catch up first.
+
+        That wait, and the wait for every worker before a session-wide message,
+        happens in the dispatcher, so it holds up every other client's messages
+        too until the old buffer's backlog is handled (head-of-line blocking).
+        Switching buffers is rare next to typing so this is accepted to keep
+        each client's messages in order. Errors from session-wide messages are
+        raised to the caller, which keeps dispatching """
+    def __init__(self, server, workers):
+        self.server  = server
+        self.workers = workers
+        self.last    = {} # client id to the worker given its last message
+
+    def dispatch(self, msg):
+        buf_id = get_worker_id(msg, self.workers)
+
+        if buf_id is None:
+
+            # Session-wide messages are handled once everything before them has been
+
+            for worker in self.workers.values():
+
+                worker.join()
+
+            self.server.process_message(msg)
+
+            return
+
+        worker = self.workers[buf_id]
+
+        last = self.last.get(msg["src_id"])
+
+        if last is not None and last is not worker:
+
+            last.join()
+
+        self.last[msg["src_id"]] = worker
+
+        worker.put(msg)
+
+        return
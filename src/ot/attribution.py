@@ -0,0 +1,85 @@
+"""Keeps track of which peer wrote each character of a document as a
+run-length encoded list of (peer_id, length) runs. Runs are stored in a treap
+(see `rope.py`) so an operation can be applied with O(log n) splices, and
+neighbouring runs by the same peer are always merged.
+"""
+
+from .rope import Treap
+
+
+class Attribution(Treap):
+    """Run-length index of the peer id for each character of a document."""
+
+    def __init__(self, runs=()):
+        Treap.__init__(self)
+        self.root = self._build([(int(peer_id), int(length)) for peer_id, length in runs])
+
+    def __repr__(self):
+        return "Attribution({!r})".format(self.runs())
+
+    def __eq__(self, other):
+        return isinstance(other, Attribution) and self.runs() == other.runs()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def apply(self, ops, peer_id):
+        """Applies the ops of a text operation, marking any inserted text as
+        written by `peer_id`, and returns self.
+        """
+        pos = 0
+        for op in ops:
+            if isinstance(op, int):
+                if op > 0:
+                    pos += op
+                else:
+                    self.delete(pos, -op)
+            else:
+                self._insert(pos, peer_id, len(op))
+                pos += len(op)
+        return self
+
+    def insert(self, pos, peer_id, length):
+        """Marks `length` new characters at `pos` as written by `peer_id`."""
+        return self._insert(pos, peer_id, length)
+
+    def runs(self):
+        """Returns a list of [peer_id, length] runs, e.g. to make a snapshot.
+        """
+        return [[node.piece, node.length] for node, _, _ in self.nodes()]
+
+    def spans(self, peer_id):
+        """Yields (start, end) index tuples of the text written by `peer_id`.
+        """
+        pos = 0
+        for node, _, _ in self.nodes():
+            if node.piece == peer_id:
+                yield (pos, pos + node.length)
+            pos += node.length
+        return
+
+    def peers(self):
+        """Returns the set of peer ids that have text in the document."""
+        return set(node.piece for node, _, _ in self.nodes())
+
+    def count(self, peer_id):
+        """Returns the number of characters written by `peer_id`."""
+        return sum(node.length for node, _, _ in self.nodes() if node.piece == peer_id)
+
+    def _cut(self, peer_id, offset):
+        return peer_id, peer_id
+
+    def _join(self, a, len_a, b, len_b):
+        return a if a == b else None
+
+    def _splice_insert(self, node, offset, peer_id, length):
+        if node.piece != peer_id:
+            return False
+        node.length += length
+        return True
+
+    def _splice_delete(self, node, offset, length):
+        node.length -= length
+        return True
@@ -0,0 +1,208 @@
+"""
+    ot/benchmark.py
+    ---------------
+
+    Benchmarks for the OT engine. Each benchmark prints the number of calls
+    per second and the 50th and 99th percentile time of a single call:
+
+    - keystrokes: the fast path for single inserts and deletes against the
+      general transform and compose algorithms
+    - operations: applying operations to strings and ropes, compose,
+      transform and invert on documents from 1 KB to 1 MB
+    - server: Server.receive_operation with 1 to 16 authors typing at the
+      same time, so each operation is transformed against the others
+
+    Run with `python -m src.ot.benchmark [keystrokes|operations|server]`
+    from the root directory. See `fuzz.py` for checking that the results
+    are still correct.
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import random
+import timeit
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+from .text_operation import TextOperation
+from .server import Server, MemoryBackend
+from .rope import Rope
+from .fuzz import random_string, random_operation
+
+DOC_SIZES = (1024, 16384, 262144, 1048576)
+AUTHORS   = (1, 2, 4, 8, 16)
+
+
+def keystroke(length, rng=random):
+    """Returns a random single character insert or delete, like the operations
+    made by `utils.new_operation`, for a document of the given length.
+    """
+    index = rng.randint(0, length)
+    if length > 0 and index < length and rng.random() < 0.3:
+        return TextOperation().retain(index).delete(1).retain(length - index - 1)
+    return TextOperation().retain(index).insert(rng.choice("abcdefgh ")).retain(length - index)
+
+
+def make_pairs(count, length, rng=random):
+    """Returns a list of (a, b) keystroke pairs for the same document, and a
+    list of (a, b) pairs where b applies to the result of a.
+    """
+    concurrent, consecutive = [], []
+    for _ in range(count):
+        a = keystroke(length, rng)
+        concurrent.append((a, keystroke(length, rng)))
+        consecutive.append((a, keystroke(length + a.len_difference(), rng)))
+    return concurrent, consecutive
+
+
+def time_per_call(func, pairs, repeat=5):
+    """Returns the best time in seconds to call func(a, b) for one pair."""
+    def run():
+        for a, b in pairs:
+            func(a, b)
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / len(pairs)
+
+
+def time_calls(func, args):
+    """Calls func(*arg) for each item in args and returns a list of the time
+    each call took in seconds.
+    """
+    times = []
+    for arg in args:
+        start = clock()
+        func(*arg)
+        times.append(clock() - start)
+    return times
+
+
+def summary(times):
+    """Returns (calls per second, p50, p99) for a list of call times, with the
+    percentiles in microseconds.
+    """
+    times = sorted(times)
+    total = sum(times)
+    rate = len(times) / total if total > 0 else float("inf")
+    p50 = times[len(times) // 2]
+    p99 = times[min(len(times) - 1, (len(times) * 99) // 100)]
+    return rate, p50 * 1e6, p99 * 1e6
+
+
+def print_header(*columns):
+    print("{:<24} {:>12} {:>12} {:>12}".format(*columns))
+
+
+def print_row(name, times):
+    print("{:<24} {:>12.0f} {:>12.1f} {:>12.1f}".format(name, *summary(times)))
+
+
+def run_keystrokes(count=10000, length=4096, seed=0):
+    """Prints the time per call of transform and compose on keystroke ops."""
+    concurrent, consecutive = make_pairs(count, length, random.Random(seed))
+
+    rows = [
+        ("transform", TextOperation.transform, TextOperation._transform, concurrent),
+        ("compose", TextOperation.compose, TextOperation._compose, consecutive),
+    ]
+
+    print("{:<10} {:>12} {:>12} {:>8}".format("", "fast (us)", "general (us)", "speedup"))
+
+    for name, fast, general, pairs in rows:
+        fast_time = time_per_call(fast, pairs)
+        general_time = time_per_call(general, pairs)
+        print("{:<10} {:>12.2f} {:>12.2f} {:>7.1f}x".format(name, fast_time * 1e6, general_time * 1e6, general_time / fast_time))
+
+    return
+
+
+def run_operations(sizes=DOC_SIZES, count=1000, seed=0):
+    """Prints the speed of applying, composing, transforming and inverting
+    operations for documents of each size. Half of the operations are
+    keystrokes and the rest edit the whole document.
+    """
+    rng = random.Random(seed)
+
+    print_header("operation", "calls/s", "p50 (us)", "p99 (us)")
+
+    for size in sizes:
+
+        print("-- {} KB".format(size // 1024))
+
+        doc = random_string(size, rng)
+        calls = max(10, count * 1024 // size)
+
+        ops = [random_operation(size, rng, keystroke=rng.random() < 0.5) for _ in range(calls)]
+        others = [random_operation(size, rng, keystroke=rng.random() < 0.5) for _ in range(calls)]
+        nexts = [random_operation(size + op.len_difference(), rng, keystroke=rng.random() < 0.5) for op in ops]
+
+        print_row("apply (str)", time_calls(lambda op: op(doc), [(op,) for op in ops]))
+
+        # Consecutive keystrokes edit one rope in place
+        rope, length, strokes = Rope(doc), size, []
+        for _ in range(calls):
+            strokes.append((keystroke(length, rng),))
+            length += strokes[-1][0].len_difference()
+        print_row("apply keystroke (rope)", time_calls(lambda op: op(rope), strokes))
+
+        print_row("compose", time_calls(TextOperation.compose, zip(ops, nexts)))
+        print_row("transform", time_calls(TextOperation.transform, zip(ops, others)))
+        print_row("invert", time_calls(lambda op: op.invert(doc), [(op,) for op in ops]))
+
+    return
+
+
+def run_server(sizes=DOC_SIZES, authors=AUTHORS, rounds=200, seed=0):
+    """Prints the speed of Server.receive_operation when several authors type
+    at once. In each round every author sends a keystroke made at the same
+    revision, so the n-th one is transformed against the n - 1 before it.
+    """
+    rng = random.Random(seed)
+
+    print_header("authors", "ops/s", "p50 (us)", "p99 (us)")
+
+    for size in sizes:
+
+        print("-- {} KB".format(size // 1024))
+
+        for count in authors:
+
+            server = Server(Rope(random_string(size, rng)), MemoryBackend())
+            times = []
+
+            for _ in range(rounds):
+                revision, length = server.get_revision(), len(server.document)
+                ops = [(user_id, revision, keystroke(length, rng)) for user_id in range(count)]
+                times.extend(time_calls(server.receive_operation, ops))
+
+            print_row("{} author(s)".format(count), times)
+
+    return
+
+
+BENCHMARKS = {
+    "keystrokes" : run_keystrokes,
+    "operations" : run_operations,
+    "server"     : run_server,
+}
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks for the OT engine")
+    parser.add_argument("benchmarks", nargs="*", help="any of {} (default: all)".format(", ".join(sorted(BENCHMARKS))))
+
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {!r}".format(name))
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print("== {}".format(name))
+        BENCHMARKS[name]()
+        print()
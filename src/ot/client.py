@@ -6,10 +6,14 @@ class Client(object):
     """Handles the client part of the OT synchronization protocol. Transforms
     incoming operations from the server, buffers operations from the user and
     sends them to the server at the right time.
+
+    Set `canonical` to False to transform without reordering inserts, for
+    servers that transform against their composed history in one go.
     """
 
-    def __init__(self, revision):
+    def __init__(self, revision, canonical=True):
         self.revision = revision
+        self.canonical = canonical
         self.state = synchronized
 
     def reset(self):
@@ -90,7 +94,7 @@ class AwaitingConfirm(object):
         #  to the client's
         #  current document)
         Operation = self.outstanding.__class__
-        (outstanding_p, operation_p) = Operation.transform(self.outstanding, operation)
+        (outstanding_p, operation_p) = Operation.transform(self.outstanding, operation, canonical=client.canonical)
         client.apply_operation(operation_p)
         return AwaitingConfirm(outstanding_p)
 
@@ -110,7 +114,7 @@ class AwaitingWithBuffer(object):
 
     def apply_client(self, client, operation):
         # Compose the user's changes onto the buffer
-        newBuffer = self.buffer.compose(operation)
+        newBuffer = self.buffer.compose(operation, canonical=client.canonical)
         return AwaitingWithBuffer(self.outstanding, newBuffer)
 
     def apply_server(self, client, operation):
@@ -131,8 +135,8 @@ class AwaitingWithBuffer(object):
         #
         # * operation_p
         Operation = self.outstanding.__class__
-        (outstanding_p, operation_p) = Operation.transform(self.outstanding, operation)
-        (buffer_p, operation_pp) = Operation.transform(self.buffer, operation_p)
+        (outstanding_p, operation_p) = Operation.transform(self.outstanding, operation, canonical=client.canonical)
+        (buffer_p, operation_pp) = Operation.transform(self.buffer, operation_p, canonical=client.canonical)
         client.apply_operation(operation_pp)
         return AwaitingWithBuffer(outstanding_p, buffer_p)
 
@@ -0,0 +1,317 @@
+"""
+    ot/file_backend.py
+    ------------------
+
+    Backend that appends every operation and checkpoint to a log file so
+    that a document's history survives the server crashing.
+
+    Each record in the log is a header followed by a UTF-8 JSON payload:
+
+        kind      1 byte   RECORD_OPERATION or RECORD_CHECKPOINT
+        length    4 bytes  size of the payload
+        crc       4 bytes  CRC-32 of the payload
+        revision  8 bytes
+
+    Operation payloads are [user_id, ops] and checkpoint payloads are the
+    document snapshot. A torn or corrupt record at the end of the file is
+    dropped when the log is opened.
+
+    Each checkpoint starts a new log holding the checkpoint and the
+    operations still in memory, so the log stays about as big as the
+    history kept in memory. The new log is written and synced next to the
+    old one and then renamed over it, so a crash leaves one or the other.
+
+"""
+
+from __future__ import absolute_import
+
+import errno
+import json
+import os
+import struct
+import zlib
+
+from array import array
+from threading import Thread, Lock, Event
+
+from .server import MemoryBackend, HistoryTruncatedError
+from .text_operation import TextOperation
+from ..config import stdout
+
+RECORD_OPERATION  = 1
+RECORD_CHECKPOINT = 2
+
+HEADER = struct.Struct("<BIIQ")
+
+replace = getattr(os, "replace", os.rename)
+
+
+def pack_record(kind, revision, payload):
+    """Returns a record as bytes."""
+    data = json.dumps(payload).encode("utf-8")
+    return HEADER.pack(kind, len(data), zlib.crc32(data) & 0xffffffff, revision) + data
+
+
+def remove(path):
+    """Removes a file if it exists."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class FileBackend(MemoryBackend):
+    """Saves operations to an append-only log file as well as keeping a ring of
+    recent operations in memory. Operations evicted from memory since the last
+    checkpoint are read from the log using an index of record offsets.
+
+    Writes are flushed to the operating system straight away but `fsync` is
+    only called, by a background thread, once `commit_size` records are
+    waiting or `commit_interval` seconds have passed. A burst of typing costs
+    one disk sync and the thread saving operations, which is the event loop
+    with the asyncio engine, never waits for the disk. New logs are written
+    by the same thread.
+    """
+
+    def __init__(self, path, max_operations=1024, max_bytes=None, checkpoint_interval=None, commit_interval=0.05, commit_size=64):
+        MemoryBackend.__init__(self, max_operations=max_operations, max_bytes=max_bytes, checkpoint_interval=checkpoint_interval)
+
+        self.path = path
+        self.commit_interval = commit_interval
+        self.commit_size = commit_size
+
+        self.lock = Lock()
+        self.file = open(path, "a+b")
+        self.pending = 0
+        self.closed = False
+        self.rotation = None # new log waiting to be written by the commit thread
+        self.generation = 0  # changed whenever the log is replaced
+
+        # A new log that wasn't renamed before a crash is incomplete
+
+        remove(path + ".new")
+
+        self.index = array("Q") # file offset of each operation record
+        self.first_revision = 0 # revision of the first operation in the log
+
+        self.recover()
+
+        self.wake = Event()
+        self.full = Event()
+        self.stop = Event()
+        self.commit_thread = Thread(target=self.commit_loop)
+        self.commit_thread.daemon = True
+        self.commit_thread.start()
+
+    # Reading and writing records
+
+    def write_record(self, kind, revision, payload):
+        """Appends a record to the log, adding operations to the index, and wakes
+        the commit thread to sync it."""
+        record = pack_record(kind, revision, payload)
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            self.file.write(record)
+            self.file.flush()
+            if kind == RECORD_OPERATION:
+                self.index.append(offset)
+            self.pending += 1
+            full = self.pending >= self.commit_size
+        if full:
+            self.full.set()
+        self.wake.set()
+        return
+
+    def read_record(self, offset):
+        """Returns the (kind, revision, payload) of the record at an offset."""
+        with self.lock:
+            return self._read_record(offset)
+
+    def _read_record(self, offset):
+        self.file.seek(offset)
+        kind, length, crc, revision = HEADER.unpack(self.file.read(HEADER.size))
+        data = self.file.read(length)
+        return kind, revision, json.loads(data.decode("utf-8"))
+
+    def recover(self):
+        """Builds the index from the log file and loads the newest checkpoint and
+        the operations after it into memory.
+        """
+        size = os.path.getsize(self.path)
+        offset = 0
+        checkpoint = None
+        authors = {}
+
+        self.file.seek(0)
+
+        while offset + HEADER.size <= size:
+            kind, length, crc, revision = HEADER.unpack(self.file.read(HEADER.size))
+            data = self.file.read(length)
+            if len(data) < length or zlib.crc32(data) & 0xffffffff != crc:
+                break
+            if kind == RECORD_OPERATION:
+                if len(self.index) == 0:
+                    self.first_revision = revision
+                self.index.append(offset)
+                authors[json.loads(data.decode("utf-8"))[0]] = revision
+            elif kind == RECORD_CHECKPOINT:
+                checkpoint = (revision, offset)
+            offset += HEADER.size + length
+
+        # Drop anything after the last complete record
+
+        if offset < size:
+            self.file.truncate(offset)
+
+        if checkpoint is None:
+            revision = self.first_revision
+        else:
+            revision, document = checkpoint[0], self.read_record(checkpoint[1])[2]
+            self.checkpoint = (revision, document)
+
+        self.offset = revision
+
+        for i in range(revision - self.first_revision, len(self.index)):
+            MemoryBackend.save_operation(self, *self.read_operation(self.first_revision + i))
+
+        self.last_operation = authors
+
+        return
+
+    def commit(self):
+        """Forces any written records to disk. The lock isn't held while syncing so
+        records can still be written."""
+        with self.lock:
+            if not self.pending or self.closed:
+                return
+            self.pending = 0
+            fd = os.dup(self.file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return
+
+    def commit_loop(self):
+        """Syncs records and writes new logs until `close` is called. Errors are
+        logged rather than ending the thread, so later records are still synced."""
+        while not self.stop.is_set():
+            self.wake.wait()
+            self.wake.clear()
+            self.full.wait(self.commit_interval)
+            self.full.clear()
+            try:
+                self.commit()
+                self.rotate()
+            except Exception as e:
+                stdout("Error writing history log {}: {}".format(self.path, e))
+        return
+
+    def prepare_rotation(self):
+        """Makes a new log from the newest checkpoint and the operations in memory
+        for the commit thread to write."""
+        revision, document = self.checkpoint
+        records = [pack_record(RECORD_CHECKPOINT, revision, document)]
+        index = array("Q")
+        size = len(records[0])
+        for i, (user_id, operation) in enumerate(MemoryBackend.get_authored_operations(self, self.offset)):
+            index.append(size)
+            records.append(pack_record(RECORD_OPERATION, self.offset + i, [user_id, operation.ops]))
+            size += len(records[-1])
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            # Records written after this point are copied to the new log when it replaces this one
+            self.rotation = (b"".join(records), index, self.offset, self.file.tell(), len(self.index), self.generation)
+        self.wake.set()
+        return
+
+    def rotate(self):
+        """Writes and syncs the new log, if there is one, then copies any records
+        written since it was made and renames it over the old log."""
+        with self.lock:
+            rotation, self.rotation = self.rotation, None
+        if rotation is None:
+            return
+        data, index, first_revision, tail, count, generation = rotation
+        path = self.path + ".new"
+        with open(path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            if self.closed or self.generation != generation:
+                remove(path)
+                return
+            self.file.seek(tail)
+            rest = self.file.read()
+            with open(path, "ab") as f:
+                f.write(rest)
+            index.extend(len(data) + offset - tail for offset in self.index[count:])
+            self.file.close()
+            replace(path, self.path)
+            self.file = open(self.path, "a+b")
+            self.index = index
+            self.first_revision = first_revision
+            self.generation += 1
+            self.pending += 1 # the copied records haven't been synced
+        self.wake.set()
+        return
+
+    def close(self):
+        """Stops the commit thread, waiting for any new log it is writing, then
+        syncs and closes the log."""
+        with self.lock:
+            self.rotation = None
+        self.stop.set()
+        self.wake.set()
+        self.full.set()
+        self.commit_thread.join()
+        self.commit()
+        with self.lock:
+            self.closed = True
+            self.file.close()
+        return
+
+    # Backend interface
+
+    def save_operation(self, user_id, operation):
+        """Save an operation in the log and in memory."""
+        self.write_record(RECORD_OPERATION, self.get_revision(), [user_id, operation.ops])
+        MemoryBackend.save_operation(self, user_id, operation)
+
+    def save_checkpoint(self, revision, document):
+        """Store a snapshot of the document in the log and start a new log from it."""
+        self.write_record(RECORD_CHECKPOINT, revision, document)
+        MemoryBackend.save_checkpoint(self, revision, document)
+        self.prepare_rotation()
+
+    def get_authored_operations(self, start, end=None):
+        """Return a list of (user_id, operation) tuples in a given range, reading
+        them from the log if they are no longer in memory.
+        """
+        self._check_range(start)
+        end = self.get_revision() if end is None else min(end, self.get_revision())
+        operations = [self.read_operation(revision) for revision in range(start, min(end, self.offset))]
+        if max(start, self.offset) < end:
+            operations.extend(MemoryBackend.get_authored_operations(self, max(start, self.offset), end))
+        return operations
+
+    def read_operation(self, revision):
+        """Returns the (user_id, operation) saved at a revision from the log."""
+        with self.lock:
+            # The commit thread may have started a new log since the range was checked
+            if revision < self.first_revision:
+                raise HistoryTruncatedError(revision, self.first_revision)
+            _, _, (user_id, ops) = self._read_record(self.index[revision - self.first_revision])
+        return user_id, TextOperation(ops, copy=False)
+
+    def _get_operation(self, revision):
+        if revision < self.offset:
+            return self.read_operation(revision)[1]
+        return MemoryBackend._get_operation(self, revision)
+
+    def _check_range(self, start):
+        if start < self.first_revision:
+            raise HistoryTruncatedError(start, self.first_revision)
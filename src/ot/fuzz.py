@@ -0,0 +1,190 @@
+"""
+    ot/fuzz.py
+    ----------
+
+    Randomised checks for the OT engine. Each check generates documents and
+    operations from a seeded random number generator and asserts that:
+
+    - transformed operations converge: b'(a(doc)) == a'(b(doc))
+    - compose is the same as applying both operations in turn
+    - invert undoes an operation
+    - applying an operation to a Rope gives the same text as to a string
+    - the fast paths for single inserts and deletes give the same result
+      as the general algorithms
+    - transforming against the server's composed history is the same as
+      transforming against each operation in turn, when neither reorders
+      inserts (canonical=False)
+    - transform_index moves a position the same way as transforming an
+      insert at that position, and transform_indices agrees with it
+
+    Run with `python -m src.ot.fuzz [--trials N] [--seed S]` from the root
+    directory. A failing trial prints the seed needed to repeat it.
+
+"""
+
+from __future__ import absolute_import, print_function
+
+import random
+
+from .text_operation import TextOperation, _simple
+from .rope import Rope
+from .server import MemoryBackend
+
+ALPHABET = "abcxyz \n"
+
+
+def random_string(length, rng=random):
+    return "".join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def random_operation(length, rng=random, keystroke=None):
+    """Returns a random operation for a document of the given length. If
+    `keystroke` is True the operation is a single insert or delete, if it is
+    None either kind may be returned.
+    """
+    if keystroke is None:
+        keystroke = rng.random() < 0.5
+
+    operation = TextOperation()
+
+    if keystroke:
+        index = rng.randint(0, length)
+        if index < length and rng.random() < 0.4:
+            count = rng.randint(1, min(3, length - index))
+            return operation.retain(index).delete(count).retain(length - index - count)
+        return operation.retain(index).insert(random_string(rng.randint(1, 3), rng)).retain(length - index)
+
+    pos = 0
+    while pos < length:
+        count = rng.randint(1, max(1, (length - pos) // 2))
+        kind = rng.random()
+        if kind < 0.2:
+            operation.insert(random_string(rng.randint(1, 4), rng))
+        elif kind < 0.5:
+            operation.delete(count)
+            pos += count
+        else:
+            operation.retain(count)
+            pos += count
+
+    if rng.random() < 0.3:
+        operation.insert(random_string(rng.randint(1, 4), rng))
+
+    return operation
+
+
+def check_transform(doc, a, b):
+    a_prime, b_prime = TextOperation.transform(a, b)
+    assert b_prime(a(doc)) == a_prime(b(doc)), "transform does not converge: {} {}".format(a, b)
+    if _simple(a.ops) is not None and _simple(b.ops) is not None:
+        general = TextOperation._transform(a, b)
+        assert (a_prime, b_prime) == general, "fast transform differs: {} {}".format(a, b)
+
+
+def check_compose(doc, a, b):
+    composed = a.compose(b)
+    assert composed(doc) == b(a(doc)), "compose is wrong: {} {}".format(a, b)
+    if _simple(a.ops) is not None and _simple(b.ops) is not None:
+        assert composed == a._compose(b), "fast compose differs: {} {}".format(a, b)
+
+
+def check_invert(doc, a):
+    assert a.invert(doc)(a(doc)) == doc, "invert is wrong: {}".format(a)
+
+
+def check_rope(doc, a):
+    assert str(a(Rope(doc))) == a(doc), "rope differs: {}".format(a)
+
+
+def check_indices(doc, a, indices):
+    for bias in (-1, 1):
+        moved = [a.transform_index(index, bias) for index in indices]
+        assert moved == a.transform_indices(indices, bias), "transform_indices differs: {} {}".format(a, indices)
+        for index, new_index in zip(indices, moved):
+            # Insert a marker character at the index and transform it with the
+            # operation, giving the marker priority if the bias is negative
+            marker = TextOperation().retain(index).insert("\0").retain(len(doc) - index)
+            if bias < 0:
+                marker, _ = TextOperation.transform(marker, a)
+            else:
+                _, marker = TextOperation.transform(a, marker)
+            assert marker(a(doc)).index("\0") == new_index, "transform_index is wrong: {} {} {}".format(a, index, bias)
+
+
+def check_history(rng, length=20, count=24):
+    """Saves a chain of operations in a MemoryBackend and checks that an
+    operation made at each revision transforms the same way against the
+    composed history as against each saved operation in turn. Both use the
+    non-canonical transform, as the canonical one is not compatible with
+    composition.
+    """
+    backend = MemoryBackend()
+    docs = [random_string(length, rng)]
+
+    for _ in range(count):
+        operation = random_operation(len(docs[-1]), rng)
+        backend.save_operation(None, operation)
+        docs.append(operation(docs[-1]))
+
+    for revision in range(count + 1):
+        operation = random_operation(len(docs[revision]), rng)
+        composed = backend.get_composed_operation(revision)
+        if composed is not None:
+            composed, _ = TextOperation.transform(operation, composed, canonical=False)
+        else:
+            composed = operation
+        sequential = operation
+        for concurrent in backend.get_operations(revision):
+            sequential, _ = TextOperation.transform(sequential, concurrent, canonical=False)
+        assert composed(docs[-1]) == sequential(docs[-1]), "composed history differs at revision {}".format(revision)
+
+    return
+
+
+def run(trials=1000, seed=None):
+    """Runs each check on `trials` random inputs. Raises AssertionError with
+    the seed of the trial that failed.
+    """
+    seed = random.randrange(2 ** 32) if seed is None else seed
+
+    for trial in range(trials):
+
+        rng = random.Random(seed + trial)
+
+        try:
+
+            doc = random_string(rng.randint(0, 40), rng)
+
+            a = random_operation(len(doc), rng)
+            b = random_operation(len(doc), rng)
+            c = random_operation(len(a(doc)), rng)
+
+            check_transform(doc, a, b)
+            check_compose(doc, a, c)
+            check_invert(doc, a)
+            check_rope(doc, a)
+            check_indices(doc, a, [rng.randint(0, len(doc)) for _ in range(4)])
+
+            if trial % 10 == 0:
+                check_history(rng)
+
+        except AssertionError as err:
+
+            raise AssertionError("{} (seed {})".format(err, seed + trial))
+
+    return seed
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Randomised checks for the OT engine")
+    parser.add_argument("--trials", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args()
+
+    seed = run(args.trials, args.seed)
+
+    print("{} trials passed (seed {})".format(args.trials, seed))
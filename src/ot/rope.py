@@ -0,0 +1,333 @@
+"""A rope is a balanced tree of text chunks that can be used in place of a
+string for a document that is edited one keystroke at a time. Inserts and
+deletes touch O(log n) nodes and the full string is only built when it is
+asked for, e.g. with `str(rope)`.
+
+The tree is a treap ordered by position: each node holds a "piece" and its
+length, and knows the total length of its subtree. `Treap` only deals with
+positions and lengths, subclasses say what a piece is.
+"""
+
+import random
+
+CHUNK_SIZE = 512
+
+
+class _Node(object):
+    __slots__ = ("piece", "length", "size", "priority", "left", "right")
+
+    def __init__(self, piece, length, priority=None):
+        self.piece    = piece
+        self.length   = length
+        self.size     = length # length of this whole subtree
+        self.priority = random.random() if priority is None else priority
+        self.left     = None
+        self.right    = None
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = node.length + _size(node.left) + _size(node.right)
+
+
+def _merge(a, b):
+    """Joins two trees where every item in `a` comes before every item in `b`.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+class Treap(object):
+    """Abstract base class for sequences stored as a treap of pieces. Subclasses
+    override `_cut`, `_join`, `_splice_insert` and `_splice_delete`.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def __len__(self):
+        return _size(self.root)
+
+    # Pieces
+    # ======
+
+    def _cut(self, piece, offset):
+        """Returns the two halves of `piece` split at `offset`."""
+        raise NotImplementedError
+
+    def _join(self, a, len_a, b, len_b):
+        """Returns a single piece made from `a` followed by `b`, or None if they
+        should stay as separate nodes.
+        """
+        return None
+
+    def _splice_insert(self, node, offset, piece, length):
+        """Inserts `piece` into a node in place. Returns False if the node should
+        be split instead.
+        """
+        return False
+
+    def _splice_delete(self, node, offset, length):
+        """Removes part of a node in place. Returns False if the node should be
+        split instead.
+        """
+        return False
+
+    # Tree operations
+    # ===============
+
+    def _split(self, node, pos):
+        """Returns two trees: the first `pos` items and the rest."""
+        if node is None:
+            return None, None
+
+        left_size = _size(node.left)
+
+        if pos <= left_size:
+            left, right = self._split(node.left, pos)
+            node.left = right
+            _update(node)
+            return left, node
+
+        pos -= left_size
+
+        if pos >= node.length:
+            left, right = self._split(node.right, pos - node.length)
+            node.right = left
+            _update(node)
+            return node, right
+
+        # Split the piece in this node. The new node takes this node's priority
+        # so that it is still higher than its children
+
+        head, tail = self._cut(node.piece, pos)
+
+        tail_node = _Node(tail, node.length - pos, node.priority)
+        tail_node.right = node.right
+        _update(tail_node)
+
+        node.piece  = head
+        node.length = pos
+        node.right  = None
+        _update(node)
+
+        return node, tail_node
+
+    def _concat(self, a, b):
+        """Merges two trees, joining the pieces either side of the seam if possible.
+        """
+        if a is None or b is None:
+            return _merge(a, b)
+
+        last = a
+        while last.right is not None:
+            last = last.right
+
+        first = b
+        while first.left is not None:
+            first = first.left
+
+        piece = self._join(last.piece, last.length, first.piece, first.length)
+
+        if piece is not None:
+
+            extra = first.length
+
+            _, b = self._split(b, extra)
+
+            last.piece   = piece
+            last.length += extra
+
+            node = a
+            while node is not None:
+                node.size += extra
+                node = node.right
+
+        return _merge(a, b)
+
+    def _build(self, pieces):
+        """Returns a tree made from a list of (piece, length) tuples."""
+        root = None
+        for piece, length in pieces:
+            if length > 0:
+                root = self._concat(root, _Node(piece, length))
+        return root
+
+    def _find(self, pos, inclusive):
+        """Returns the path from the root to the node containing `pos` and the
+        offset into that node. If `inclusive` is True, a position at the end of
+        a node is said to be in that node.
+        """
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            left_size = _size(node.left)
+            if pos < left_size or (inclusive and pos == left_size and node.left is not None):
+                node = node.left
+            elif pos < left_size + node.length or (inclusive and pos == left_size + node.length):
+                return path, pos - left_size
+            else:
+                pos -= left_size + node.length
+                node = node.right
+        return path, None
+
+    def _insert(self, pos, piece, length):
+        """Inserts a piece at `pos`."""
+        if length == 0:
+            return
+
+        path, offset = self._find(pos, inclusive=True)
+
+        if offset is not None and self._splice_insert(path[-1], offset, piece, length):
+            for node in path:
+                node.size += length
+            return
+
+        left, right = self._split(self.root, pos)
+        self.root = self._concat(self._concat(left, self._build(self._pieces(piece, length))), right)
+        return
+
+    def _pieces(self, piece, length):
+        """Returns a list of (piece, length) tuples for a newly inserted piece.
+        """
+        return [(piece, length)]
+
+    def delete(self, pos, length):
+        """Removes `length` items starting at `pos`."""
+        if length == 0:
+            return
+
+        path, offset = self._find(pos, inclusive=False)
+
+        if offset is not None and offset + length < path[-1].length and self._splice_delete(path[-1], offset, length):
+            for node in path:
+                node.size -= length
+            return
+
+        left, right = self._split(self.root, pos)
+        _, right = self._split(right, length)
+        self.root = self._concat(left, right)
+        return
+
+    def nodes(self, start=0, end=None):
+        """Yields (node, start, end) for every node overlapping the range, where
+        start and end are relative to the node's piece.
+        """
+        if end is None:
+            end = len(self)
+        stack, node, pos = [], self.root, 0
+        while stack or node is not None:
+            if node is not None:
+                # Skip subtrees that end before the range starts
+                if pos + _size(node) <= start:
+                    pos += _size(node)
+                    node = None
+                    continue
+                stack.append((node, pos))
+                node = node.left
+            else:
+                node, pos = stack.pop()
+                pos += _size(node.left)
+                if pos >= end:
+                    return
+                lo = max(start - pos, 0)
+                hi = min(end - pos, node.length)
+                if hi > lo:
+                    yield node, lo, hi
+                pos += node.length
+                node = node.right
+        return
+
+    def apply(self, ops):
+        """Applies a list of retain (positive int), insert (str) and delete (negative
+        int) ops in place and returns self. The ops are assumed to be the right
+        length for this sequence.
+        """
+        pos = 0
+        for op in ops:
+            if isinstance(op, int):
+                if op > 0:
+                    pos += op
+                else:
+                    self.delete(pos, -op)
+            else:
+                self._insert(pos, op, len(op))
+                pos += len(op)
+        return self
+
+
+class Rope(Treap):
+    """Mutable string made from chunks of at most `CHUNK_SIZE` characters."""
+
+    def __init__(self, text=""):
+        Treap.__init__(self)
+        self.root = self._build(self._pieces(text, len(text)))
+
+    def __str__(self):
+        return "".join(node.piece for node, _, _ in self.nodes())
+
+    def __repr__(self):
+        return "Rope({!r})".format(str(self))
+
+    def __getitem__(self, key):
+        """Returns a substring, using an int or a slice without a step."""
+        if isinstance(key, slice):
+            start, end, _ = key.indices(len(self))
+            if end <= start:
+                return ""
+            return "".join(node.piece[lo:hi] for node, lo, hi in self.nodes(start, end))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("Rope index out of range")
+        return self[key:key + 1]
+
+    def __eq__(self, other):
+        if isinstance(other, Rope):
+            return len(self) == len(other) and str(self) == str(other)
+        return str(self) == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def insert(self, pos, text):
+        """Inserts a string at `pos`."""
+        return self._insert(pos, text, len(text))
+
+    def _cut(self, piece, offset):
+        return piece[:offset], piece[offset:]
+
+    def _join(self, a, len_a, b, len_b):
+        if len_a + len_b <= CHUNK_SIZE:
+            return a + b
+        return None
+
+    def _pieces(self, text, length):
+        return [(text[i:i + CHUNK_SIZE], min(CHUNK_SIZE, length - i)) for i in range(0, length, CHUNK_SIZE)]
+
+    def _splice_insert(self, node, offset, text, length):
+        if node.length + length > CHUNK_SIZE:
+            return False
+        node.piece   = node.piece[:offset] + text + node.piece[offset:]
+        node.length += length
+        return True
+
+    def _splice_delete(self, node, offset, length):
+        node.piece   = node.piece[:offset] + node.piece[offset + length:]
+        node.length -= length
+        return True
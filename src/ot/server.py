@@ -1,25 +1,172 @@
 class MemoryBackend(object):
-    """Simple backend that saves all operations in the server's memory. This
-    causes the processe's heap to grow indefinitely.
+    """Simple backend that saves operations in the server's memory.
+
+    By default every operation is kept, which causes the processe's heap to
+    grow indefinitely. With `max_operations` and/or `max_bytes` set, only a
+    ring of recent operations is kept along with a checkpoint of the document:
+    an operation is evicted once it is older than the newest checkpoint and
+    either the limits are exceeded or every user has acknowledged it.
+    Revision numbers keep counting up from the first operation ever saved.
+    The operations are kept in lists with a moving start index, so evicting
+    is O(1) and any revision is found by indexing, and the lists are trimmed
+    once more than half of them has been evicted.
+
+    Blocks of 2**k operations starting at a multiple of 2**k are composed into
+    a single operation the first time they are needed, so that the operations
+    since any revision can be returned as O(log n) composed operations.
     """
 
-    def __init__(self, operations=[]):
-        self.operations = operations[:]
+    def __init__(self, operations=[], max_operations=None, max_bytes=None, checkpoint_interval=None):
+        self.max_operations = max_operations
+        self.max_bytes = max_bytes
+        self.checkpoint_interval = checkpoint_interval
+
+        self.clear()
+
+        for operation in operations:
+            self.save_operation(None, operation)
+
+    def clear(self):
+        """Remove all operations and checkpoints, starting again from revision 0."""
+        self.operations = []
+        self.authors = []
+        self.sizes = []
+        self.start = 0 # index in the lists of the first operation that hasn't been evicted
+        self.nbytes = 0
+        self.offset = 0 # revision of self.operations[self.start]
         self.last_operation = {}
+        self.composed = {} # (k, m) -> operations[m * 2**k:(m + 1) * 2**k] composed
+        self.purged = 0
+        self.checkpoint = (0, None) # (revision, document)
+        self.acknowledged = {} # user_id -> revision
+
+    def close(self):
+        """Release any resources held by the backend."""
+        return
+
+    def get_revision(self):
+        """Return the revision number of the next operation to be saved."""
+        return self.offset + len(self.operations) - self.start
 
     def save_operation(self, user_id, operation):
         """Save an operation in the database."""
-        self.last_operation[user_id] = len(self.operations)
+        self.last_operation[user_id] = self.get_revision()
         self.operations.append(operation)
+        self.authors.append(user_id)
+        self.sizes.append(_operation_size(operation))
+        self.nbytes += self.sizes[-1]
+        self._evict()
 
     def get_operations(self, start, end=None):
         """Return operations in a given range."""
-        return self.operations[start:end]
+        return [operation for _, operation in self.get_authored_operations(start, end)]
+
+    def get_authored_operations(self, start, end=None):
+        """Return a list of (user_id, operation) tuples in a given range."""
+        self._check_range(start)
+        i = self.start + start - self.offset
+        stop = None if end is None else self.start + max(end - self.offset, 0)
+        return list(zip(self.authors[i:stop], self.operations[i:stop]))
+
+    def get_composed_operation(self, start, end=None):
+        """Return the operations in a given range composed into one operation,
+        without moving inserts in front of deletes, or None if the range is
+        empty.
+        """
+        self._check_range(start)
+        end = self.get_revision() if end is None else min(end, self.get_revision())
+        operation = None
+        while start < end:
+            # Take the largest aligned block that starts here and fits in the range
+            k = 0
+            while start % (2 << k) == 0 and start + (2 << k) <= end:
+                k += 1
+            block = self._get_block(k, start >> k)
+            operation = block if operation is None else operation.compose(block, canonical=False)
+            start += 1 << k
+        return operation
+
+    def _get_block(self, k, m):
+        """Return the composition of operations[m * 2**k:(m + 1) * 2**k]."""
+        if k == 0:
+            return self._get_operation(m)
+        block = self.composed.get((k, m))
+        if block is None:
+            block = self._get_block(k - 1, 2 * m).compose(self._get_block(k - 1, 2 * m + 1), canonical=False)
+            self.composed[(k, m)] = block
+        return block
+
+    def _get_operation(self, revision):
+        return self.operations[self.start + revision - self.offset]
+
+    def _check_range(self, start):
+        if start < self.offset:
+            raise HistoryTruncatedError(start, self.offset)
 
     def get_last_revision_from_user(self, user_id):
         """Return the revision number of the last operation from a given user."""
         return self.last_operation.get(user_id, None)
 
+    # Checkpoints and eviction
+
+    def save_checkpoint(self, revision, document):
+        """Store a snapshot of the document as it was at a given revision."""
+        self.checkpoint = (revision, document)
+        self._evict()
+
+    def get_checkpoint(self):
+        """Return the newest checkpoint as a (revision, document) tuple, where
+        document is None if no checkpoint has been saved.
+        """
+        return self.checkpoint
+
+    def needs_checkpoint(self):
+        """Return True if operations can't be evicted (or have been kept for
+        `checkpoint_interval` operations) until a new checkpoint is saved.
+        """
+        if len(self.operations) == self.start:
+            return False
+        if self.checkpoint_interval is not None and self.get_revision() - self.checkpoint[0] >= self.checkpoint_interval:
+            return True
+        return self._over_limit()
+
+    def acknowledge(self, user_id, revision):
+        """Record that a user has seen every operation before `revision`."""
+        self.acknowledged[user_id] = revision
+        self._evict()
+
+    def remove_user(self, user_id):
+        """Stop waiting for a user to acknowledge operations."""
+        self.acknowledged.pop(user_id, None)
+        self._evict()
+
+    def _over_limit(self):
+        return ((self.max_operations is not None and len(self.operations) - self.start > self.max_operations) or
+                (self.max_bytes is not None and self.nbytes > self.max_bytes))
+
+    def _evict(self):
+        # Without any limits, keep the whole history
+        if self.max_operations is None and self.max_bytes is None:
+            return
+        acknowledged = min(self.acknowledged.values()) if self.acknowledged else self.get_revision()
+        while self.offset < self.checkpoint[0] and (self.offset < acknowledged or self._over_limit()):
+            self.operations[self.start] = self.authors[self.start] = None
+            self.nbytes -= self.sizes[self.start]
+            self.start += 1
+            self.offset += 1
+        if self.start > 64 and self.start * 2 > len(self.operations):
+            del self.operations[:self.start], self.authors[:self.start], self.sizes[:self.start]
+            self.start = 0
+        # Drop composed blocks that start before the first operation now and then
+        if self.offset - self.purged > max(64, len(self.operations) - self.start):
+            self.composed = {(k, m): block for (k, m), block in self.composed.items() if (m << k) >= self.offset}
+            self.purged = self.offset
+
+
+def _operation_size(operation):
+    """Rough number of bytes used by an operation."""
+    return sum(len(op) if isinstance(op, str) else 8 for op in operation)
+
 
 class Server(object):
     """Receives operations from clients, transforms them against all
@@ -30,10 +177,16 @@ class Server(object):
         self.document = document
         self.backend = backend
 
-    def receive_operation(self, user_id, revision, operation):
+    def receive_operation(self, user_id, revision, operation, canonical=True):
         """Transforms an operation coming from a client against all concurrent
         operation, applies it to the current document and returns the operation
-        to send to the clients.
+        to send to the clients. Raises HistoryTruncatedError if the operations
+        since `revision` are no longer in the backend.
+
+        Clients that transform with `canonical` set to False can have their
+        operations transformed against all the concurrent operations composed
+        into one. Other clients' operations are transformed against each of them
+        in turn, so that the server gets the same result as the client.
         """
 
         last_by_user = self.backend.get_last_revision_from_user(user_id)
@@ -42,12 +195,47 @@ class Server(object):
 
         Operation = operation.__class__
 
-        concurrent_operations = self.backend.get_operations(revision)
-        for concurrent_operation in concurrent_operations:
-            (operation, _) = Operation.transform(operation, concurrent_operation)
+        if canonical:
+            for concurrent_operation in self.backend.get_operations(revision):
+                (operation, _) = Operation.transform(operation, concurrent_operation)
+        else:
+            concurrent_operation = self.backend.get_composed_operation(revision)
+            if concurrent_operation is not None:
+                (operation, _) = Operation.transform(operation, concurrent_operation, canonical=False)
 
-        self.document = operation(self.document)
+        self.apply_operation(user_id, operation)
 
         self.backend.save_operation(user_id, operation)
-        
+        self.backend.acknowledge(user_id, revision)
+
+        if self.backend.needs_checkpoint():
+            self.save_checkpoint()
+
         return operation
+
+    def apply_operation(self, user_id, operation):
+        """Applies an operation from a user to the current document."""
+        self.document = operation(self.document)
+
+    def get_revision(self):
+        """Returns the revision number of the current document."""
+        return self.backend.get_revision()
+
+    def snapshot(self):
+        """Returns a copy of the current document to store in a checkpoint."""
+        return str(self.document)
+
+    def save_checkpoint(self):
+        """Stores a snapshot of the current document in the backend, allowing it
+        to evict older operations.
+        """
+        self.backend.save_checkpoint(self.get_revision(), self.snapshot())
+
+
+class HistoryTruncatedError(Exception):
+    """The operations since a revision have been evicted from the backend."""
+
+    def __init__(self, revision, first_revision):
+        Exception.__init__(self, "Revision {} is older than the first revision in history ({})".format(revision, first_revision))
+        self.revision = revision
+        self.first_revision = first_revision
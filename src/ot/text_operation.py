@@ -6,6 +6,8 @@
 #   Represented by positive ints.
 # * Delete ops: Delete the next n characters. Represented by negative ints.
 
+from .rope import Rope
+
 
 def _is_retain(op):
     return isinstance(op, int) and op > 0
@@ -47,11 +49,170 @@ def _shorten_ops(a, b):
     return (None, _shorten(b, len_a))
 
 
+def _simple(ops):
+    """Returns (index, op, length) if `ops` is a single insert or delete op with
+    retains either side, e.g. a keystroke, where `length` is the length of the
+    document it applies to. Returns None for any other operation.
+    """
+
+    n = len(ops)
+    if n == 0 or n > 3:
+        return None
+
+    op = ops[0]
+    index = 0
+    if isinstance(op, int) and op > 0:
+        if n == 1:
+            return None
+        index = op
+        op = ops[1]
+    elif n == 3:
+        return None
+
+    tail = 0
+    if n - (index > 0) == 2:
+        tail = ops[-1]
+        if not (isinstance(tail, int) and tail > 0):
+            return None
+
+    if isinstance(op, str):
+        return (index, op, index + tail)
+    if op < 0:
+        return (index, op, index - op + tail)
+    return None
+
+
+def _single(index, op, length):
+    """Returns an operation that inserts or deletes at `index` in a document of
+    the given length. A delete is given as a negative int.
+    """
+
+    if not op:
+        return TextOperation([length] if length else [], copy=False)
+
+    tail = length - index if isinstance(op, str) else length - index + op
+    ops = [index, op, tail] if index else [op, tail]
+    if not tail:
+        ops.pop()
+    return TextOperation(ops, copy=False)
+
+
+def _transform_simple(a, b):
+    """`TextOperation.transform` for two operations returned by `_simple`. Uses
+    index arithmetic instead of iterating over the ops but gives exactly the
+    same result, including which insert goes first when two are at the same
+    index. Neither result has an insert next to a delete, so it is the same
+    whether or not the result is canonical.
+    """
+
+    index_a, op_a, length = a
+    index_b, op_b, _ = b
+
+    if isinstance(op_a, str):
+
+        if isinstance(op_b, str):
+            if index_a <= index_b:
+                return (_single(index_a, op_a, length + len(op_b)),
+                        _single(index_b + len(op_a), op_b, length + len(op_a)))
+            return (_single(index_a + len(op_b), op_a, length + len(op_b)),
+                    _single(index_b, op_b, length + len(op_a)))
+
+        # Insert and delete
+        end_b = index_b - op_b
+        if index_a <= index_b:
+            return (_single(index_a, op_a, length + op_b),
+                    _single(index_b + len(op_a), op_b, length + len(op_a)))
+        if index_a >= end_b:
+            return (_single(index_a + op_b, op_a, length + op_b),
+                    _single(index_b, op_b, length + len(op_a)))
+        # The text is inserted inside the deleted range so the delete is split
+        return (_single(index_b, op_a, length + op_b),
+                TextOperation().retain(index_b).delete(index_a - index_b).retain(len(op_a)).delete(end_b - index_a).retain(length - end_b))
+
+    if isinstance(op_b, str):
+        (b_prime, a_prime) = _transform_simple(b, a)
+        return (a_prime, b_prime)
+
+    # Two deletes: each one only removes what the other one hasn't
+    end_a = index_a - op_a
+    end_b = index_b - op_b
+    overlap = max(0, min(end_a, end_b) - max(index_a, index_b))
+
+    if index_a <= index_b:
+        start_a = index_a
+    elif index_a >= end_b:
+        start_a = index_a + op_b
+    else:
+        start_a = index_b
+
+    if index_b <= index_a:
+        start_b = index_b
+    elif index_b >= end_a:
+        start_b = index_b + op_a
+    else:
+        start_b = index_a
+
+    return (_single(start_a, op_a + overlap, length + op_b),
+            _single(start_b, op_b + overlap, length + op_a))
+
+
+def _compose_simple(a, b, canonical=True):
+    """`TextOperation.compose` for two operations returned by `_simple`, where
+    `b` applies to the result of `a`. Returns None if the ops partly overlap,
+    in which case the general algorithm is used.
+    """
+
+    index_a, op_a, length = a
+    index_b, op_b, _ = b
+
+    # Only used where an insert can come straight after a delete
+    insert = TextOperation.insert if canonical else TextOperation._insert
+
+    if isinstance(op_a, str):
+        end_a = index_a + len(op_a)
+
+        if isinstance(op_b, str):
+            if index_a <= index_b <= end_a:
+                offset = index_b - index_a
+                return _single(index_a, op_a[:offset] + op_b + op_a[offset:], length)
+            if index_b < index_a:
+                return TextOperation().retain(index_b)._insert(op_b).retain(index_a - index_b)._insert(op_a).retain(length - index_a)
+            return TextOperation().retain(index_a)._insert(op_a).retain(index_b - end_a)._insert(op_b).retain(length - index_b + len(op_a))
+
+        end_b = index_b - op_b
+        if index_a <= index_b and end_b <= end_a:
+            # The delete only removes inserted text
+            return _single(index_a, op_a[:index_b - index_a] + op_a[end_b - index_a:], length)
+        if end_b <= index_a:
+            return insert(TextOperation().retain(index_b).delete(op_b).retain(index_a - end_b), op_a).retain(length - index_a)
+        if index_b >= end_a:
+            return TextOperation().retain(index_a)._insert(op_a).retain(index_b - end_a).delete(op_b).retain(length - end_b + len(op_a))
+        return None
+
+    end_a = index_a - op_a
+
+    if isinstance(op_b, str):
+        if index_b < index_a:
+            return TextOperation().retain(index_b)._insert(op_b).retain(index_a - index_b).delete(op_a).retain(length - end_a)
+        return insert(TextOperation().retain(index_a).delete(op_a).retain(index_b - index_a), op_b).retain(length - end_a - index_b + index_a)
+
+    end_b = index_b - op_b
+    if index_b <= index_a <= end_b:
+        return _single(index_b, op_a + op_b, length)
+    if end_b < index_a:
+        return TextOperation().retain(index_b).delete(op_b).retain(index_a - end_b).delete(op_a).retain(length - end_a)
+    return TextOperation().retain(index_a).delete(op_a).retain(index_b - index_a).delete(op_b).retain(length - end_b + op_a)
+
+
 class TextOperation(object):
-    """Diff between two strings."""
+    """Diff between two strings. The list of ops is copied unless `copy` is
+    False, which can be used when the caller won't change the list afterwards.
+    """
+
+    __slots__ = ("ops",)
 
-    def __init__(self, ops=[]):
-        self.ops = ops[:]
+    def __init__(self, ops=[], copy=True):
+        self.ops = ops[:] if copy else ops
 
     def __repr__(self):
         return "O({})".format(self.ops)
@@ -110,6 +271,22 @@ class TextOperation(object):
             self.ops.append(s)
         return self
 
+    def _insert(self, s):
+        """Inserts the given string without moving it in front of a delete op
+        that comes before it. `compose` and `transform` build their results with
+        this when `canonical` is False, so that transforming against a composed
+        operation gives the same result as transforming against each of its
+        parts in turn.
+        """
+
+        if len(s) == 0:
+            return self
+        if len(self.ops) > 0 and isinstance(self.ops[-1], str):
+            self.ops[-1] += s
+        else:
+            self.ops.append(s)
+        return self
+
     def delete(self, d):
         """Deletes a given number of characters at the current cursor position."""
 
@@ -124,7 +301,12 @@ class TextOperation(object):
         return self
 
     def __call__(self, doc):
-        """Apply this operation to a string, returning a new string."""
+        """Apply this operation to a string, returning a new string. A `Rope` is
+        edited in place and returned instead.
+        """
+
+        if isinstance(doc, Rope):
+            return self._apply_to_rope(doc)
 
         i = 0
         parts = []
@@ -147,6 +329,83 @@ class TextOperation(object):
 
         return ''.join(parts)
 
+    def _apply_to_rope(self, rope):
+        """Apply this operation to a `Rope` without building the whole string."""
+
+        length = 0
+        for op in self:
+            if isinstance(op, int):
+                length += op if op > 0 else -op
+
+        if length > len(rope):
+            raise IncompatibleOperationError("Cannot apply operation: operation is too long.")
+        if length < len(rope):
+            raise IncompatibleOperationError("Cannot apply operation: operation is too short.")
+
+        return rope.apply(self.ops)
+
+    def transform_index(self, index, bias=-1):
+        """Returns where a position in the document, e.g. a cursor, is after this
+        operation is applied. A position inside deleted text moves to the start
+        of the deletion. If text is inserted at the position, a negative `bias`
+        keeps it before the new text and a positive `bias` moves it after.
+        """
+
+        pos = shift = 0
+
+        for op in self.ops:
+            if isinstance(op, str):
+                if index < pos or (index == pos and bias < 0):
+                    return index + shift
+                shift += len(op)
+            elif op > 0:
+                if index < pos + op:
+                    return index + shift
+                pos += op
+            else:
+                if index < pos - op:
+                    return pos + shift
+                pos -= op
+                shift += op
+
+        return min(index, pos) + shift
+
+    def transform_indices(self, indices, bias=-1):
+        """Returns a list of positions moved through this operation in the same
+        way as `transform_index`, in a single pass over the ops.
+        """
+
+        order = sorted(range(len(indices)), key=indices.__getitem__)
+        result = list(indices)
+
+        i = 0
+        pos = shift = 0
+
+        for op in self.ops:
+            if i == len(order):
+                break
+            if isinstance(op, str):
+                while i < len(order) and (indices[order[i]] < pos or (indices[order[i]] == pos and bias < 0)):
+                    result[order[i]] = indices[order[i]] + shift
+                    i += 1
+                shift += len(op)
+            elif op > 0:
+                while i < len(order) and indices[order[i]] < pos + op:
+                    result[order[i]] = indices[order[i]] + shift
+                    i += 1
+                pos += op
+            else:
+                while i < len(order) and indices[order[i]] < pos - op:
+                    result[order[i]] = pos + shift
+                    i += 1
+                pos -= op
+                shift += op
+
+        for j in order[i:]:
+            result[j] = min(indices[j], pos) + shift
+
+        return result
+
     def invert(self, doc):
         """Make an operation that does the opposite. When you apply an operation
         to a string and then the operation generated by this operation, you
@@ -169,14 +428,31 @@ class TextOperation(object):
 
         return inverse
 
-    def compose(self, other):
+    def compose(self, other, canonical=True):
         """Combine two consecutive operations into one that has the same effect
-        when applied to a document.
+        when applied to a document. If `canonical` is False, inserts are left
+        where they are instead of being moved in front of deletes.
+        """
+
+        a = _simple(self.ops)
+        if a is not None:
+            b = _simple(other.ops)
+            if b is not None and b[2] == a[2] + (len(a[1]) if isinstance(a[1], str) else a[1]):
+                operation = _compose_simple(a, b, canonical)
+                if operation is not None:
+                    return operation
+
+        return self._compose(other, canonical)
+
+    def _compose(self, other, canonical=True):
+        """The general algorithm for `compose`, which iterates over the ops of
+        both operations.
         """
 
         iter_a = iter(self)
         iter_b = iter(other)
         operation = TextOperation()
+        insert = operation.insert if canonical else operation._insert
 
         a = b = None
         while True:
@@ -194,7 +470,7 @@ class TextOperation(object):
                 a = None
                 continue
             if _is_insert(b):
-                operation.insert(b)
+                insert(b)
                 b = None
                 continue
 
@@ -208,7 +484,7 @@ class TextOperation(object):
             if _is_retain(a) and _is_retain(b):
                 operation.retain(min_len)
             elif _is_insert(a) and _is_retain(b):
-                operation.insert(a[:min_len])
+                insert(a[:min_len])
             elif _is_retain(a) and _is_delete(b):
                 operation.delete(min_len)
             # remaining case: _is_insert(a) and _is_delete(b)
@@ -220,16 +496,38 @@ class TextOperation(object):
         return operation
 
     @staticmethod
-    def transform(operation_a, operation_b):
+    def transform(operation_a, operation_b, canonical=True):
         """Transform two operations a and b to a' and b' such that b' applied
         after a yields the same result as a' applied after b. Try to preserve
         the operations' intentions in the process.
+
+        With `canonical` set to False, inserts in a' and b' are not moved in
+        front of deletes. Transforming against a composed operation then gives
+        the same result as transforming against each of its parts in turn, as
+        long as both sides use it, but the result can differ from the canonical
+        one when inserts tie at the same index.
+        """
+
+        a = _simple(operation_a.ops)
+        if a is not None:
+            b = _simple(operation_b.ops)
+            if b is not None and a[2] == b[2]:
+                return _transform_simple(a, b)
+
+        return TextOperation._transform(operation_a, operation_b, canonical)
+
+    @staticmethod
+    def _transform(operation_a, operation_b, canonical=True):
+        """The general algorithm for `transform`, which iterates over the ops of
+        both operations.
         """
 
         iter_a = iter(operation_a)
         iter_b = iter(operation_b)
         a_prime = TextOperation()
         b_prime = TextOperation()
+        insert_a = a_prime.insert if canonical else a_prime._insert
+        insert_b = b_prime.insert if canonical else b_prime._insert
         a = b = None
 
         while True:
@@ -243,13 +541,13 @@ class TextOperation(object):
                 break
 
             if _is_insert(a):
-                a_prime.insert(a)
+                insert_a(a)
                 b_prime.retain(len(a))
                 a = None
                 continue
             if _is_insert(b):
                 a_prime.retain(len(b))
-                b_prime.insert(b)
+                insert_b(b)
                 b = None
                 continue
 
@@ -100,10 +100,6 @@ def get_doc_size(ops):
             total += (value * -1)
     return total
 
-import re
-def get_peer_locs(n, text):
-    return ( (match.start(), match.end()) for match in re.finditer("{}+".format(n), text))
-
 def get_peer_char(id_num):
     """ Returns the ID character to identify a peer """
     return PEER_CHARS[id_num]
@@ -0,0 +1,72 @@
+"""
+    Tests for the run-length peer Attribution: merging neighbouring runs by the
+    same peer, splitting them for inserts and deletes, and applying operations.
+"""
+
+from __future__ import absolute_import
+
+import random
+import unittest
+
+from src.ot.attribution import Attribution
+
+
+def expand(attribution):
+    return [peer_id for peer_id, length in attribution.runs() for _ in range(length)]
+
+
+class AttributionTest(unittest.TestCase):
+
+    def test_runs_by_the_same_peer_are_merged(self):
+        self.assertEqual(Attribution([[1, 2], [1, 3], [2, 1]]).runs(), [[1, 5], [2, 1]])
+
+    def test_insert_into_own_run_splices(self):
+        a = Attribution([[1, 4]])
+        a.insert(2, 1, 3)
+        self.assertEqual(a.runs(), [[1, 7]])
+
+    def test_insert_splits_another_peers_run(self):
+        a = Attribution([[1, 4]])
+        a.insert(2, 2, 3)
+        self.assertEqual(a.runs(), [[1, 2], [2, 3], [1, 2]])
+
+    def test_insert_next_to_run_merges(self):
+        a = Attribution([[1, 2], [2, 2]])
+        a.insert(2, 2, 1)
+        self.assertEqual(a.runs(), [[1, 2], [2, 3]])
+        a.insert(2, 1, 1)
+        self.assertEqual(a.runs(), [[1, 3], [2, 3]])
+
+    def test_delete_joins_runs_either_side(self):
+        a = Attribution([[1, 2], [2, 3], [1, 2]])
+        a.delete(2, 3)
+        self.assertEqual(a.runs(), [[1, 4]])
+
+    def test_apply(self):
+        a = Attribution([[1, 5]])
+        a.apply([2, "xy", -1, 2], 3)
+        self.assertEqual(a.runs(), [[1, 2], [3, 2], [1, 2]])
+        self.assertEqual(list(a.spans(3)), [(2, 4)])
+        self.assertEqual(a.peers(), {1, 3})
+        self.assertEqual(a.count(1), 4)
+
+    def test_random_edits_match_list(self):
+        rng = random.Random(2)
+        a, expected = Attribution(), []
+        for _ in range(500):
+            pos = rng.randint(0, len(expected))
+            if expected and pos < len(expected) and rng.random() < 0.4:
+                length = rng.randint(1, len(expected) - pos)
+                a.delete(pos, length)
+                del expected[pos:pos + length]
+            else:
+                peer_id, length = rng.randint(0, 3), rng.randint(1, 5)
+                a.insert(pos, peer_id, length)
+                expected[pos:pos] = [peer_id] * length
+            self.assertEqual(expand(a), expected)
+        runs = a.runs()
+        self.assertTrue(all(x[0] != y[0] for x, y in zip(runs, runs[1:])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+    Tests for the binary codec: varints, operations and snapshots round-trip,
+    and every message type with a binary form decodes to the same message.
+"""
+
+from __future__ import absolute_import
+
+import random
+import unittest
+
+from src.network.message import (MSG_OPERATION, MSG_SET_MARK, MSG_SELECT, MSG_SET_ALL, MSG_RESET, BINARY_CODECS,
+                                 CAP_BINARY, CAP_COMPRESS, FrameReader, Snapshot, write_varint, read_varint,
+                                 write_ops, read_ops, write_snapshots, read_snapshots, read_snapshot, legacy_snapshot)
+from src.ot.fuzz import random_operation
+
+
+class VarintTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        values = [0, 1, -1, 63, -64, 64, -65, 127, 128, 2 ** 31, -2 ** 31, 2 ** 63, -2 ** 63 - 1]
+        out = bytearray()
+        for value in values:
+            write_varint(out, value)
+        i, read = 0, []
+        while i < len(out):
+            value, i = read_varint(out, i)
+            read.append(value)
+        self.assertEqual(read, values)
+
+    def test_small_values_use_one_byte(self):
+        for value in (0, 1, -1, 63, -64):
+            out = bytearray()
+            write_varint(out, value)
+            self.assertEqual(len(out), 1, value)
+
+
+class OpsTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            ops = random_operation(rng.randint(0, 60), rng).ops
+            out = bytearray()
+            write_ops(out, ops)
+            self.assertEqual(read_ops(bytes(out), 0), (ops, len(out)))
+
+    def test_unicode_inserts(self):
+        ops = [3, u"café ♪", -2, 1]
+        out = bytearray()
+        write_ops(out, ops)
+        self.assertEqual(read_ops(bytes(out), 0)[0], ops)
+
+
+class MessageTest(unittest.TestCase):
+
+    def check(self, msg, capabilities=CAP_BINARY):
+        data = msg.pack(capabilities)
+        self.assertNotEqual(data[4:5], b"[", "expected the binary form")
+        self.assertEqual(FrameReader().feed(data), [msg])
+
+    def test_messages_with_binary_form(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            msg = rng.choice([
+                MSG_OPERATION(rng.randint(0, 50), random_operation(rng.randint(0, 50), rng).ops, rng.randint(0, 10 ** 6)),
+                MSG_SET_MARK(rng.randint(0, 50), rng.randint(0, 10 ** 5), rng.randint(0, 1)),
+                MSG_SELECT(rng.randint(0, 50), rng.randint(-1, 500), rng.randint(-1, 500), rng.randint(0, 1)),
+            ])
+            msg.set_buf_id(rng.randint(0, 3))
+            msg.set_msg_id(rng.randint(0, 10 ** 5))
+            self.check(msg)
+
+    def test_types_with_binary_form(self):
+        self.assertEqual(sorted(BINARY_CODECS), sorted(cls.type for cls in (MSG_OPERATION, MSG_SET_MARK, MSG_SELECT, MSG_SET_ALL, MSG_RESET)))
+
+    def test_snapshots(self):
+        buffers = {0: Snapshot(("text", [[1, 4]], 7, [[2, [4, "!"]]])), 3: ("", [], 0, [])}
+        for cls in (MSG_SET_ALL, MSG_RESET):
+            msg = cls(-1, buffers, {"1": [0, 2]})
+            data = FrameReader().feed(msg.pack(CAP_COMPRESS))[0]
+            self.assertEqual(data["buffers"], {0: ["text", [[1, 4]], 7, [[2, [4, "!"]]]], 3: ["", [], 0, []]})
+            self.assertEqual(data["peers"], {"1": [0, 2]})
+
+    def test_snapshots_need_compress(self):
+        msg = MSG_SET_ALL(-1, {0: ("a", [[1, 1]], 0, [])}, {})
+        self.assertEqual(msg.pack(CAP_BINARY), msg.frame())
+
+    def test_snapshot_compressed_once(self):
+        snapshot = Snapshot(("text", [], 0, []))
+        out = bytearray()
+        write_snapshots(out, {0: snapshot})
+        self.assertIs(snapshot.compress(), snapshot.compress())
+        self.assertEqual(read_snapshots(bytes(out), 0), ({0: ["text", [], 0, []]}, len(out)))
+
+
+class LegacySnapshotTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        runs = [[1, 2], [12, 3], [1, 1]]
+        text, peer_chars = legacy_snapshot("abcdef", runs)
+        self.assertEqual(len(peer_chars), 6)
+        self.assertEqual(read_snapshot((text, peer_chars)), ("abcdef", runs, 0, []))
+
+    def test_new_shape(self):
+        self.assertEqual(read_snapshot(["a", [[1, 1]], 5, []]), ("a", [[1, 1]], 5, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
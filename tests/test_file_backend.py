@@ -0,0 +1,151 @@
+"""
+    Tests for the FileBackend log: recovering after a crash, dropping a torn
+    record at the end of the log, starting a new log at each checkpoint and
+    shutting down the commit thread.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from src.ot.server import Server, HistoryTruncatedError
+from src.ot.file_backend import FileBackend, HEADER, pack_record, remove, RECORD_OPERATION
+from src.ot.text_operation import TextOperation
+
+
+def typing(server, text, user_id=1):
+    """ Appends each character of `text` to the server's document as its own operation """
+    for char in text:
+        server.receive_operation(user_id, server.get_revision(), TextOperation([len(server.document), char] if server.document else [char]))
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+class FileBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "buffer.log")
+        self.backends = []
+
+    def tearDown(self):
+        for backend in self.backends:
+            if not backend.closed:
+                backend.close()
+        shutil.rmtree(self.dir)
+
+    def open(self, path=None, **kwargs):
+        backend = FileBackend(path or self.path, **kwargs)
+        self.backends.append(backend)
+        return backend
+
+    def crash(self, backend):
+        """ Returns the path of a copy of the log as it would be after a crash """
+        backend.commit()
+        path = os.path.join(self.dir, "crashed.log")
+        shutil.copy(self.path, path)
+        return path
+
+    def test_recovers_operations_after_crash(self):
+        server = Server("", self.open())
+        typing(server, "hello")
+        backend = self.open(self.crash(server.backend))
+        self.assertEqual(backend.get_revision(), 5)
+        self.assertEqual(backend.get_operations(0), server.backend.get_operations(0))
+        self.assertEqual(backend.get_last_revision_from_user(1), 4)
+
+    def test_recovers_from_checkpoint(self):
+        server = Server("", self.open(max_operations=4, checkpoint_interval=3))
+        typing(server, "abcdefg")
+        server.backend.close()
+        backend = self.open()
+        self.assertEqual(backend.get_checkpoint(), (6, "abcdef"))
+        self.assertEqual(backend.get_revision(), 7)
+        document = backend.get_checkpoint()[1]
+        for operation in backend.get_operations(6):
+            document = operation(document)
+        self.assertEqual(document, "abcdefg")
+
+    def test_torn_record_is_dropped(self):
+        server = Server("", self.open())
+        typing(server, "abc")
+        server.backend.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, "ab") as f:
+            f.write(pack_record(RECORD_OPERATION, 3, [1, [3, "d"]])[:HEADER.size + 2])
+        backend = self.open()
+        self.assertEqual(backend.get_revision(), 3)
+        self.assertEqual(os.path.getsize(self.path), size)
+        backend.save_operation(1, TextOperation([3, "d"]))
+        backend.close()
+        self.assertEqual(self.open().get_revision(), 4)
+
+    def test_corrupt_record_is_dropped(self):
+        server = Server("", self.open())
+        typing(server, "abc")
+        server.backend.close()
+        with open(self.path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"x")
+        self.assertEqual(self.open().get_revision(), 2)
+
+    def test_checkpoint_starts_new_log(self):
+        server = Server("", self.open(max_operations=100, checkpoint_interval=50, commit_interval=0))
+        typing(server, "x" * 49)
+        size = os.path.getsize(self.path)
+        generation = server.backend.generation
+        typing(server, "yz")
+        wait_for(lambda: server.backend.generation > generation)
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertFalse(os.path.exists(self.path + ".new"))
+        first = server.backend.first_revision
+        self.assertLessEqual(first, server.backend.offset)
+        self.assertEqual(server.backend.get_checkpoint()[0], 50)
+        with self.assertRaises(HistoryTruncatedError):
+            server.backend.get_operations(first - 1)
+        self.assertEqual(len(server.backend.get_operations(first)), 51 - first)
+        server.backend.close()
+        backend = self.open()
+        self.assertEqual(backend.get_revision(), 51)
+        self.assertEqual(backend.get_checkpoint(), (50, "x" * 49 + "y"))
+
+    def test_close_stops_commit_thread(self):
+        backend = self.open(checkpoint_interval=2)
+        server = Server("", backend)
+        typing(server, "abcd")
+        backend.close()
+        self.assertFalse(backend.commit_thread.is_alive())
+
+    def test_commit_thread_survives_errors(self):
+        backend = self.open(commit_interval=0)
+        server = Server("", backend)
+        errors = []
+
+        def rotate():
+            errors.append(True)
+            raise OSError("disk full")
+
+        backend.rotate = rotate
+        typing(server, "a")
+        wait_for(lambda: errors)
+        typing(server, "b")
+        wait_for(lambda: len(errors) > 1)
+        self.assertTrue(backend.commit_thread.is_alive())
+
+    def test_remove_ignores_missing_file(self):
+        remove(self.path + ".new")
+        self.assertFalse(os.path.exists(self.path + ".new"))
+
+
+if __name__ == "__main__":
+    unittest.main()
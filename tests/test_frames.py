@@ -0,0 +1,86 @@
+"""
+    Tests for reading length-prefixed frames and the handshake, when they are
+    split over any number of reads.
+"""
+
+from __future__ import absolute_import
+
+import unittest
+
+from src.network.message import (MSG_OPERATION, MSG_SET_MARK, MSG_PASSWORD, FrameReader, EmptyMessageError,
+                                 ConnectionError, HANDSHAKE, FRAME_MAGIC, CAP_BINARY, CAP_BATCH, CAP_REVISIONS, CAP_COMPRESS, CAPABILITIES,
+                                 PROTOCOL_VERSION, handshake, batch_frames, shared_capabilities)
+
+
+def messages():
+    op = MSG_OPERATION(3, [5, "hello <world>", -2, 7], 12)
+    op.set_buf_id(2)
+    return [op, MSG_SET_MARK(1, 4), MSG_PASSWORD(-1, "abc", "name")]
+
+
+def feed_in_pieces(reader, data, size):
+    pkg = []
+    for i in range(0, len(data), size):
+        pkg.extend(reader.feed(data[i:i + size]))
+    return pkg
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def test_whole_frames(self):
+        msgs = messages()
+        self.assertEqual(FrameReader().feed(b"".join(msg.frame() for msg in msgs)), msgs)
+
+    def test_split_frames(self):
+        msgs = messages()
+        data = b"".join(msg.frame() for msg in msgs)
+        for size in (1, 2, 3, 5, 7, 64):
+            self.assertEqual(feed_in_pieces(FrameReader(), data, size), msgs, size)
+
+    def test_incomplete_frame_is_kept(self):
+        data = messages()[0].frame()
+        reader = FrameReader()
+        self.assertEqual(reader.feed(data[:-1]), [])
+        self.assertEqual(reader.feed(data[-1:]), messages()[:1])
+        self.assertEqual(len(reader.buffer), 0)
+
+    def test_batch_frames(self):
+        msgs = messages()
+        data = batch_frames([msg.pack() for msg in msgs])
+        for size in (1, 4, len(data)):
+            self.assertEqual(feed_in_pieces(FrameReader(), data, size), msgs)
+
+    def test_empty_read(self):
+        with self.assertRaises(EmptyMessageError):
+            FrameReader().feed(b"")
+
+
+class HandshakeTest(unittest.TestCase):
+
+    def test_handshake_split_over_reads(self):
+        msgs = messages()
+        data = handshake(CAP_BINARY | CAP_BATCH) + b"".join(msg.frame() for msg in msgs)
+        for size in (1, 2, HANDSHAKE.size - 1, HANDSHAKE.size + 1):
+            reader = FrameReader(handshake=True)
+            pkg = reader.feed(data[:size])
+            self.assertEqual(reader.handshake, size < HANDSHAKE.size)
+            pkg += feed_in_pieces(reader, data[size:], size)
+            self.assertEqual(pkg, msgs)
+            self.assertEqual(reader.version, PROTOCOL_VERSION)
+            self.assertEqual(reader.capabilities, CAP_BINARY | CAP_BATCH)
+
+    def test_bad_magic(self):
+        with self.assertRaises(ConnectionError):
+            FrameReader(handshake=True).feed(HANDSHAKE.pack(b"\x00XX", PROTOCOL_VERSION, 0))
+
+    def test_unknown_version(self):
+        with self.assertRaises(ConnectionError):
+            FrameReader(handshake=True).feed(HANDSHAKE.pack(FRAME_MAGIC, PROTOCOL_VERSION + 1, 0))
+
+    def test_shared_capabilities(self):
+        self.assertEqual(shared_capabilities(CAPABILITIES | 1 << 20), CAPABILITIES)
+        self.assertEqual(shared_capabilities(CAPABILITIES & ~CAP_REVISIONS), CAP_BINARY | CAP_BATCH | CAP_COMPRESS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+    Tests for the bounded MemoryBackend history: checkpoints, eviction by size
+    and by acknowledgement, and HistoryTruncatedError for evicted revisions.
+    Also covers the operations a buffer sends a client that reconnects.
+"""
+
+from __future__ import absolute_import
+
+import unittest
+
+from src.ot.server import Server, MemoryBackend, HistoryTruncatedError
+from src.ot.text_operation import TextOperation
+from src.network.network_utils import TextHandler
+
+
+def typing(server, text, user_id=1):
+    """ Appends each character of `text` to the server's document as its own operation """
+    for char in text:
+        server.receive_operation(user_id, server.get_revision(), TextOperation([len(server.document), char] if server.document else [char]))
+
+
+class MemoryBackendTest(unittest.TestCase):
+
+    def test_keeps_everything_without_limits(self):
+        server = Server("", MemoryBackend())
+        typing(server, "hello")
+        self.assertEqual(server.get_revision(), 5)
+        self.assertEqual(len(server.backend.get_operations(0)), 5)
+        self.assertEqual(server.backend.get_checkpoint(), (0, None))
+
+    def test_operations_are_only_evicted_behind_a_checkpoint(self):
+        backend = MemoryBackend(max_operations=2)
+        backend.acknowledge(1, 0)
+        for i in range(4):
+            backend.save_operation(1, TextOperation(["x"]))
+        self.assertEqual(backend.get_operations(0), [TextOperation(["x"])] * 4)
+        self.assertTrue(backend.needs_checkpoint())
+        backend.save_checkpoint(3, "xxx")
+        self.assertEqual(backend.offset, 2)
+        self.assertEqual(len(backend.get_operations(2)), 2)
+        self.assertEqual(backend.get_revision(), 4)
+
+    def test_server_saves_checkpoints_at_interval(self):
+        server = Server("", MemoryBackend(max_operations=4, checkpoint_interval=3))
+        typing(server, "abcdefg")
+        revision, document = server.backend.get_checkpoint()
+        self.assertEqual((revision, document), (6, "abcdef"))
+        self.assertLessEqual(server.get_revision() - server.backend.offset, 4)
+        self.assertEqual(server.get_revision(), 7)
+
+    def test_max_bytes(self):
+        server = Server("", MemoryBackend(max_bytes=40, checkpoint_interval=100))
+        typing(server, "x" * 20)
+        self.assertLessEqual(server.backend.nbytes, 40)
+        self.assertEqual(server.document, "x" * 20)
+
+    def test_acknowledged_operations_are_evicted(self):
+        backend = MemoryBackend(max_operations=100)
+        backend.acknowledge(1, 0)
+        backend.acknowledge(2, 0)
+        for _ in range(5):
+            backend.save_operation(1, TextOperation(["x"]))
+        backend.save_checkpoint(4, "xxxx")
+        self.assertEqual(backend.offset, 0)
+        backend.acknowledge(1, 5)
+        self.assertEqual(backend.offset, 0)
+        backend.acknowledge(2, 3)
+        self.assertEqual(backend.offset, 3)
+        backend.remove_user(2)
+        self.assertEqual(backend.offset, 4)
+
+    def test_evicted_revision_raises(self):
+        server = Server("", MemoryBackend(max_operations=2, checkpoint_interval=2))
+        typing(server, "abcde")
+        first = server.backend.offset
+        self.assertGreater(first, 0)
+        with self.assertRaises(HistoryTruncatedError) as cm:
+            server.backend.get_operations(first - 1)
+        self.assertEqual((cm.exception.revision, cm.exception.first_revision), (first - 1, first))
+        with self.assertRaises(HistoryTruncatedError):
+            server.backend.get_composed_operation(0)
+        with self.assertRaises(HistoryTruncatedError):
+            server.receive_operation(2, 0, TextOperation(["z"]))
+        self.assertEqual(server.document, "abcde")
+
+    def test_lookups_after_lists_are_trimmed(self):
+        server = Server("", MemoryBackend(max_operations=10, checkpoint_interval=5))
+        typing(server, "x" * 200)
+        backend = server.backend
+        self.assertLess(len(backend.operations), 200)
+        start = backend.offset
+        expected = None
+        for operation in backend.get_operations(start):
+            expected = operation if expected is None else expected.compose(operation, canonical=False)
+        self.assertEqual(backend.get_composed_operation(start), expected)
+        self.assertEqual([op for _, op in backend.get_authored_operations(start)], backend.get_operations(start))
+
+
+class OperationsSinceTest(unittest.TestCase):
+
+    def test_operations_bring_a_client_up_to_date(self):
+        text = TextHandler()
+        typing(text, "abc", user_id=1)
+        typing(text, "de", user_id=2)
+        document = "abc"
+        operations = text.get_operations_since(3)
+        self.assertEqual([user_id for user_id, _ in operations], [2, 2])
+        for _, operation in operations:
+            document = operation(document)
+        self.assertEqual(document, str(text.document))
+
+    def test_up_to_date_client_gets_no_operations(self):
+        text = TextHandler()
+        typing(text, "abc")
+        self.assertEqual(text.get_operations_since(3), [])
+
+    def test_unknown_revision_needs_a_snapshot(self):
+        text = TextHandler()
+        typing(text, "abc")
+        self.assertIsNone(text.get_operations_since(None))
+        self.assertIsNone(text.get_operations_since(4))
+
+    def test_evicted_revision_needs_a_snapshot(self):
+        text = TextHandler(max_operations=2, checkpoint_interval=2)
+        typing(text, "abcdef")
+        first = text.backend.offset
+        self.assertGreater(first, 0)
+        self.assertIsNone(text.get_operations_since(first - 1))
+        self.assertEqual(len(text.get_operations_since(first)), 6 - first)
+
+
+if __name__ == "__main__":
+    unittest.main()
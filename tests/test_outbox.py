@@ -0,0 +1,84 @@
+"""
+    Tests for the per-client Outbox: the high-water mark, dropping replaced
+    cursor updates and handing everything waiting to the writer at once.
+"""
+
+from __future__ import absolute_import
+
+import unittest
+
+from src.network.message import MSG_OPERATION, MSG_SET_MARK, MSG_SELECT, batch_frames, MESSAGE, FrameReader
+from src.network.outbox import Outbox
+
+
+def operation(src_id=1, text="a"):
+    return MSG_OPERATION(src_id, [text], 0)
+
+
+class OutboxTest(unittest.TestCase):
+
+    def test_get_joins_waiting_messages(self):
+        outbox = Outbox()
+        messages = [operation(), MSG_SET_MARK(1, 5), operation(2)]
+        for msg in messages:
+            self.assertTrue(outbox.put(msg))
+        self.assertEqual(outbox.get(timeout=0), b"".join(msg.bytes() for msg in messages))
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(outbox.get(timeout=0), b"")
+
+    def test_batch_frames(self):
+        outbox = Outbox(encode=MESSAGE.frame, batch=batch_frames)
+        messages = [operation(), MSG_SELECT(2, 1, 4)]
+        for msg in messages:
+            outbox.put(msg)
+        self.assertEqual(FrameReader().feed(outbox.get(timeout=0)), messages)
+
+    def test_empty_outbox_accepts_any_message(self):
+        outbox = Outbox(high_water=4)
+        self.assertTrue(outbox.put(operation(text="x" * 100)))
+        self.assertFalse(outbox.put(operation()))
+
+    def test_high_water_refuses_messages(self):
+        size = len(operation().bytes())
+        outbox = Outbox(high_water=size * 3)
+        for _ in range(3):
+            self.assertTrue(outbox.put(operation()))
+        self.assertFalse(outbox.put(operation()))
+        self.assertEqual(outbox.metrics()["queued_bytes"], size * 3)
+        self.assertEqual(outbox.metrics()["peak_bytes"], size * 3)
+
+    def test_coalesces_replaced_cursor_updates(self):
+        first, second = MSG_SET_MARK(1, 1), MSG_SET_MARK(1, 2)
+        other = MSG_SET_MARK(2, 3)
+        outbox = Outbox(high_water=len(first.bytes()) * 3)
+        for msg in (first, other, second):
+            self.assertTrue(outbox.put(msg))
+
+        # The newest update from peer 1 replaces the queued ones from it
+
+        newest = MSG_SET_MARK(1, 4)
+        self.assertTrue(outbox.put(newest))
+        self.assertEqual([item[0] for item in outbox.messages], [other, newest])
+        self.assertEqual(outbox.coalesced, 2)
+        self.assertEqual(outbox.nbytes, len(other.bytes()) + len(newest.bytes()))
+
+    def test_coalescing_keeps_operations_and_other_types(self):
+        mark, select = MSG_SET_MARK(1, 1), MSG_SELECT(1, 0, 2)
+        op = operation()
+        outbox = Outbox(high_water=len(mark.bytes()) + len(select.bytes()) + len(op.bytes()))
+        for msg in (mark, op, select):
+            outbox.put(msg)
+        self.assertFalse(outbox.put(operation()))
+        self.assertEqual([item[0] for item in outbox.messages], [mark, op, select])
+
+    def test_closed_outbox_drops_messages(self):
+        notified = []
+        outbox = Outbox(notify=lambda: notified.append(True))
+        outbox.close()
+        self.assertTrue(outbox.put(operation()))
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(len(notified), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
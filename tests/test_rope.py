@@ -0,0 +1,121 @@
+"""
+    Tests for the Rope and the Treap it is built on: splitting pieces, inserts
+    and deletes in place or across chunks, and slicing.
+"""
+
+from __future__ import absolute_import
+
+import random
+import unittest
+
+from src.ot.rope import Rope, CHUNK_SIZE, _size
+
+
+def pieces(r):
+    return [node.piece for node, _, _ in r.nodes()]
+
+
+def check_sizes(node):
+    """ Asserts every node's size is its length plus its children's sizes """
+    if node is None:
+        return 0
+    size = node.length + check_sizes(node.left) + check_sizes(node.right)
+    assert node.size == size
+    return size
+
+
+class RopeTest(unittest.TestCase):
+
+    def test_str_and_len(self):
+        r = Rope("hello world")
+        self.assertEqual(str(r), "hello world")
+        self.assertEqual(len(r), 11)
+        self.assertEqual(len(Rope()), 0)
+
+    def test_text_is_chunked(self):
+        r = Rope("x" * (CHUNK_SIZE * 2 + 1))
+        self.assertEqual([len(p) for p in pieces(r)], [CHUNK_SIZE, CHUNK_SIZE, 1])
+
+    def test_split_cuts_a_piece(self):
+        r = Rope("abcdef")
+        left, right = r._split(r.root, 2)
+        self.assertEqual((_size(left), _size(right)), (2, 4))
+        self.assertEqual(left.piece + right.piece, "abcdef")
+
+    def test_split_at_the_ends(self):
+        r = Rope("abc")
+        left, right = r._split(r.root, 0)
+        self.assertIsNone(left)
+        self.assertEqual(_size(right), 3)
+        left, right = r._split(right, 3)
+        self.assertEqual(_size(left), 3)
+        self.assertIsNone(right)
+
+    def test_insert_in_place(self):
+        r = Rope("helld")
+        r.insert(3, "lo wor")
+        self.assertEqual(str(r), "hello world")
+        self.assertEqual(len(pieces(r)), 1)
+
+    def test_insert_splits_full_chunk(self):
+        text = "a" * CHUNK_SIZE
+        r = Rope(text)
+        r.insert(10, "bc")
+        self.assertEqual(str(r), text[:10] + "bc" + text[10:])
+        self.assertEqual(len(r), CHUNK_SIZE + 2)
+        check_sizes(r.root)
+
+    def test_delete_in_place_and_across_chunks(self):
+        text = "".join(chr(97 + i % 26) for i in range(CHUNK_SIZE * 3))
+        r = Rope(text)
+        r.delete(5, 3)
+        text = text[:5] + text[8:]
+        self.assertEqual(str(r), text)
+        r.delete(CHUNK_SIZE - 10, CHUNK_SIZE + 20)
+        text = text[:CHUNK_SIZE - 10] + text[2 * CHUNK_SIZE + 10:]
+        self.assertEqual(str(r), text)
+        check_sizes(r.root)
+
+    def test_delete_everything(self):
+        r = Rope("abc" * CHUNK_SIZE)
+        r.delete(0, len(r))
+        self.assertEqual(str(r), "")
+        self.assertIsNone(r.root)
+
+    def test_getitem(self):
+        text = "".join(chr(97 + i % 26) for i in range(CHUNK_SIZE + 50))
+        r = Rope(text)
+        self.assertEqual(r[CHUNK_SIZE - 5:CHUNK_SIZE + 5], text[CHUNK_SIZE - 5:CHUNK_SIZE + 5])
+        self.assertEqual(r[-1], text[-1])
+        self.assertEqual(r[10:5], "")
+        with self.assertRaises(IndexError):
+            r[len(text)]
+
+    def test_apply(self):
+        r = Rope("hello world")
+        r.apply([5, -6, ", there"])
+        self.assertEqual(str(r), "hello, there")
+
+    def test_random_edits_match_string(self):
+        rng = random.Random(1)
+        text = ""
+        r = Rope()
+        for _ in range(500):
+            pos = rng.randint(0, len(text))
+            if text and rng.random() < 0.4:
+                length = rng.randint(1, min(len(text) - pos, 700) or 1)
+                if pos == len(text):
+                    continue
+                r.delete(pos, length)
+                text = text[:pos] + text[pos + length:]
+            else:
+                s = "".join(rng.choice("abc\n") for _ in range(rng.randint(1, 300)))
+                r.insert(pos, s)
+                text = text[:pos] + s + text[pos:]
+            self.assertEqual(len(r), len(text))
+        self.assertEqual(str(r), text)
+        check_sizes(r.root)
+
+
+if __name__ == "__main__":
+    unittest.main()
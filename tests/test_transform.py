@@ -0,0 +1,157 @@
+"""
+    Tests that TextOperation.transform gives the same results as the original
+    algorithm, which clients from before the composed history still use, and
+    that transforming against composed operations matches transforming against
+    each one when inserts are left in place.
+"""
+
+from __future__ import absolute_import
+
+import random
+import unittest
+
+from src.ot.text_operation import TextOperation, _is_insert, _is_retain, _is_delete, _op_len, _shorten_ops
+from src.ot.server import Server, MemoryBackend
+
+
+def baseline_transform(operation_a, operation_b):
+    """ TextOperation.transform as it was before the composed history """
+    iter_a = iter(operation_a)
+    iter_b = iter(operation_b)
+    a_prime = TextOperation()
+    b_prime = TextOperation()
+    a = b = None
+    while True:
+        if a == None:
+            a = next(iter_a, None)
+        if b == None:
+            b = next(iter_b, None)
+        if a == b == None:
+            break
+        if _is_insert(a):
+            a_prime.insert(a)
+            b_prime.retain(len(a))
+            a = None
+            continue
+        if _is_insert(b):
+            a_prime.retain(len(b))
+            b_prime.insert(b)
+            b = None
+            continue
+        min_len = min(_op_len(a), _op_len(b))
+        if _is_retain(a) and _is_retain(b):
+            a_prime.retain(min_len)
+            b_prime.retain(min_len)
+        elif _is_delete(a) and _is_retain(b):
+            a_prime.delete(min_len)
+        elif _is_retain(a) and _is_delete(b):
+            b_prime.delete(min_len)
+        (a, b) = _shorten_ops(a, b)
+    return (a_prime, b_prime)
+
+
+def random_operation(doc, rng):
+    operation = TextOperation()
+    i = 0
+    while i < len(doc):
+        n = rng.randint(1, min(3, len(doc) - i))
+        r = rng.random()
+        if r < 0.5:
+            operation.retain(n)
+            i += n
+        elif r < 0.75:
+            operation.delete(n)
+            i += n
+        else:
+            operation.insert(rng.choice(["x", "y", "ab"]))
+    if rng.random() < 0.4:
+        operation.insert(rng.choice(["q", "w"]))
+    return operation
+
+
+def random_keystroke(doc, rng):
+    """ Returns an operation with a single insert or delete, which the fast paths handle """
+    index = rng.randint(0, len(doc))
+    if index < len(doc) and rng.random() < 0.5:
+        length = rng.randint(1, len(doc) - index)
+        return TextOperation().retain(index).delete(length).retain(len(doc) - index - length)
+    return TextOperation().retain(index).insert(rng.choice(["x", "yz"])).retain(len(doc) - index)
+
+
+class OldClient(object):
+    """ The client side of the protocol, waiting for one operation to be
+        acknowledged and transforming with the original algorithm """
+
+    def __init__(self, doc, operation):
+        self.doc = operation(doc)
+        self.outstanding = operation
+
+    def apply_server(self, operation):
+        self.outstanding, operation = baseline_transform(self.outstanding, operation)
+        self.doc = operation(self.doc)
+
+
+class TransformTest(unittest.TestCase):
+
+    def test_transform_matches_baseline(self):
+        rng = random.Random(3)
+        for _ in range(3000):
+            doc = "".join(rng.choice("de") for _ in range(rng.randint(0, 8)))
+            a, b = random_operation(doc, rng), random_operation(doc, rng)
+            a_prime, b_prime = TextOperation.transform(a, b)
+            base_a, base_b = baseline_transform(a, b)
+            self.assertEqual((a_prime.ops, b_prime.ops), (base_a.ops, base_b.ops))
+
+    def test_fast_paths_match_general_algorithm(self):
+        rng = random.Random(6)
+        for _ in range(3000):
+            doc = "".join(rng.choice("de") for _ in range(rng.randint(0, 8)))
+            a, b = random_keystroke(doc, rng), random_keystroke(doc, rng)
+            base_a, base_b = baseline_transform(a, b)
+            for canonical in (True, False):
+                a_prime, b_prime = TextOperation.transform(a, b, canonical)
+                self.assertEqual((a_prime.ops, b_prime.ops), (base_a.ops, base_b.ops))
+                c = random_keystroke(a(doc), rng)
+                self.assertEqual(a.compose(c, canonical).ops, a._compose(c, canonical).ops)
+
+    def test_server_converges_with_old_client(self):
+        server = Server("dde", MemoryBackend())
+        client = OldClient("dde", TextOperation([1, -1, 1, "z"]))
+        for i, ops in enumerate([[2, -1], [1, "x", 1], [3, "y"], [4, "z"], [2, -1, 2]]):
+            operation = server.receive_operation(0, i, TextOperation(ops))
+            client.apply_server(operation)
+        server.receive_operation(1, 0, TextOperation([1, -1, 1, "z"]))
+        self.assertEqual(server.document, client.doc)
+        self.assertEqual(server.document, "dzxyz")
+
+    def test_random_histories_converge_with_old_client(self):
+        rng = random.Random(4)
+        for _ in range(1000):
+            doc = "".join(rng.choice("de") for _ in range(rng.randint(0, 6)))
+            server = Server(doc, MemoryBackend())
+            operation = random_operation(doc, rng)
+            client = OldClient(doc, operation)
+            for _ in range(rng.randint(1, 6)):
+                client.apply_server(server.receive_operation(0, len(server.backend.operations), random_operation(server.document, rng)))
+            server.receive_operation(1, 0, operation)
+            self.assertEqual(server.document, client.doc)
+
+    def test_composed_transform_matches_each_in_turn(self):
+        rng = random.Random(5)
+        for _ in range(2000):
+            doc = "".join(rng.choice("de") for _ in range(rng.randint(0, 6)))
+            backend = MemoryBackend()
+            current = doc
+            for _ in range(rng.randint(1, 9)):
+                operation = random_operation(current, rng)
+                backend.save_operation(0, operation)
+                current = operation(current)
+            a = expected = random_operation(doc, rng)
+            for operation in backend.get_operations(0):
+                expected, _ = TextOperation.transform(expected, operation, canonical=False)
+            composed, _ = TextOperation.transform(a, backend.get_composed_operation(0), canonical=False)
+            self.assertEqual(composed.ops, expected.ops)
+
+
+if __name__ == "__main__":
+    unittest.main()
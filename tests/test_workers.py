@@ -0,0 +1,104 @@
+"""
+    Tests for the buffer workers: cursor updates are held and only the newest
+    from each client is sent, and nothing is reordered around operations.
+"""
+
+from __future__ import absolute_import
+
+import time
+import unittest
+
+from src.network.message import MSG_OPERATION, MSG_SET_MARK, MSG_SELECT
+from src.network.workers import BufferWorker, Dispatcher
+
+
+class FakeServer(object):
+    """ Records the messages the workers process """
+    running = True
+    def __init__(self):
+        self.processed = []
+
+    def process_message(self, msg):
+        self.processed.append(msg)
+
+
+def operation(src_id, buf_id=0):
+    msg = MSG_OPERATION(src_id, ["a"], 0)
+    msg.set_buf_id(buf_id)
+    return msg
+
+
+class BufferWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.worker = BufferWorker(self.server, 0, cursor_interval=60)
+
+    def feed(self, *messages):
+        """ Handles messages as the worker's thread would """
+        for msg in messages:
+            self.worker.put(msg)
+            self.worker.handle(self.worker.queue.get())
+
+    def test_holds_cursor_updates(self):
+        self.feed(MSG_SET_MARK(1, 1), MSG_SELECT(1, 0, 2))
+        self.assertEqual(self.server.processed, [])
+        self.worker.flush()
+        self.assertEqual(self.server.processed, [MSG_SET_MARK(1, 1), MSG_SELECT(1, 0, 2)])
+
+    def test_keeps_newest_update_from_each_client(self):
+        self.feed(MSG_SET_MARK(1, 1), MSG_SET_MARK(2, 5), MSG_SET_MARK(1, 2), MSG_SET_MARK(1, 3))
+        self.worker.flush()
+        self.assertEqual(self.server.processed, [MSG_SET_MARK(2, 5), MSG_SET_MARK(1, 3)])
+        self.assertEqual(self.worker.coalesced, 2)
+
+    def test_operation_sends_held_updates_first(self):
+        self.feed(MSG_SET_MARK(1, 1), operation(2), MSG_SET_MARK(1, 2))
+        self.assertEqual(self.server.processed, [MSG_SET_MARK(1, 1), operation(2)])
+        self.worker.flush()
+        self.assertEqual(self.server.processed[-1], MSG_SET_MARK(1, 2))
+
+    def test_join_waits_for_held_updates(self):
+        self.feed(MSG_SET_MARK(1, 1), MSG_SET_MARK(1, 2))
+        self.assertEqual(self.worker.queue.unfinished_tasks, 1)
+        self.worker.flush()
+        self.assertEqual(self.worker.queue.unfinished_tasks, 0)
+
+    def test_sends_held_updates_after_interval(self):
+        self.worker.cursor_interval = 0.01
+        self.feed(MSG_SET_MARK(1, 1))
+        self.assertGreater(self.worker.get_timeout(), 0)
+        time.sleep(0.02)
+        self.assertEqual(self.worker.get_timeout(), 0)
+        self.feed(MSG_SET_MARK(1, 2))
+        self.assertEqual(self.server.processed, [MSG_SET_MARK(1, 2)])
+        self.assertIsNone(self.worker.deadline)
+
+    def test_without_interval_nothing_is_held(self):
+        self.worker.cursor_interval = None
+        self.feed(MSG_SET_MARK(1, 1), MSG_SET_MARK(1, 2))
+        self.assertEqual(self.server.processed, [MSG_SET_MARK(1, 1), MSG_SET_MARK(1, 2)])
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def test_session_messages_wait_for_workers(self):
+        server = FakeServer()
+        workers = {0: BufferWorker(server, 0), 1: BufferWorker(server, 1)}
+        for worker in workers.values():
+            worker.start()
+        dispatcher = Dispatcher(server, workers)
+        first, second = operation(1, 0), operation(1, 1)
+        dispatcher.dispatch(first)
+        dispatcher.dispatch(second)
+
+        # A message for a buffer without a worker is for the whole session
+
+        session = MSG_SELECT(2, 0, 0)
+        session.set_buf_id(99)
+        dispatcher.dispatch(session)
+        self.assertEqual(server.processed, [first, second, session])
+        server.running = False
+
+if __name__ == "__main__":
+    unittest.main()